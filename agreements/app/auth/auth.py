@@ -1,7 +1,17 @@
 import tweepy
 import json
 
+# api returned instead of connecting to twitter (ie the fake api of the simulator)
+installed = None
+
+def install(api):
+    global installed
+    installed = api
+
 def API():
+    if installed is not None:
+        return installed
+
     # loading API keys from json
     with open('app/auth/apikeys.json', 'r') as f:
         keys = json.load(f)
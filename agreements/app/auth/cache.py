@@ -0,0 +1,103 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import tweepy
+
+# lookup_users accepts at most 100 ids per request
+LOOKUP_BATCH_SIZE = 100
+
+# least recently used cache where entries also expire after a fixed time
+class TTLCache:
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires = entry
+            if time.monotonic() > expires:
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+# wraps a tweepy api, answering repeated status, user and me lookups from memory
+# anything not cached (mentions_timeline, update_status...) is passed straight through to the wrapped api
+class CachedAPI:
+    def __init__(self, api, status_ttl=5 * 60, user_ttl=15 * 60, me_ttl=60 * 60):
+        self.api = api
+        self.logger = logging.getLogger(".".join([self.__module__, type(self).__name__]))
+        self.statuses = TTLCache(status_ttl)
+        self.users = TTLCache(user_ttl, maxsize=4096)
+        self.me_cache = TTLCache(me_ttl, maxsize=1)
+
+    def __getattr__(self, name):
+        return getattr(self.api, name)
+
+    def me(self):
+        me = self.me_cache.get('me')
+        if me is None:
+            me = self.api.me()
+            self.me_cache.put('me', me)
+            self.remember_user(me)
+        return me
+
+    def get_status(self, id, **kwargs):
+        # extended and compatibility mode statuses have different text, so they are cached separately
+        key = (int(id), kwargs.get('tweet_mode'))
+        status = self.statuses.get(key)
+        if status is None:
+            status = self.api.get_status(id, **kwargs)
+            self.statuses.put(key, status)
+            self.remember_user(status.user)
+        return status
+
+    def get_user(self, id=None, **kwargs):
+        user_id = id if id is not None else kwargs.get('user_id')
+        user = self.users.get(int(user_id)) if user_id is not None else None
+        if user is None:
+            user = self.api.get_user(id, **kwargs) if id is not None else self.api.get_user(**kwargs)
+            self.remember_user(user)
+        return user
+
+    # stores a user object that came from another response (ie the author of a mention)
+    def remember_user(self, user):
+        self.users.put(user.id, user)
+
+    # resolves every uncached user id with as few lookup_users requests as possible
+    def prefetch_users(self, user_ids):
+        missing = list(dict.fromkeys(int(i) for i in user_ids if int(i) not in self.users))
+
+        for i in range(0, len(missing), LOOKUP_BATCH_SIZE):
+            batch = missing[i:i + LOOKUP_BATCH_SIZE]
+            try:
+                users = self.api.lookup_users(user_ids=batch)
+            except tweepy.error.TweepError as error:
+                # users that can't be prefetched are looked up individually when needed
+                self.logger.warn(f'Could not prefetch users: {error.api_code}')
+                continue
+
+            for user in users:
+                self.remember_user(user)
+
+        if missing:
+            self.logger.info(f'Prefetched {len(missing)} users')
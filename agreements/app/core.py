@@ -1,46 +1,114 @@
-import json, logging
-import tweepy
-from tinydb import TinyDB
-from .auth import auth
+import os
+import logging
+import threading
+from .database import storage, migrate, schema
 from .database.metadata import Metadata
+from . import metrics
 
-# setting up app level logger to log in stdout and to a file
 root_logger = logging.getLogger('app')
-root_logger.setLevel(logging.DEBUG)
-handler = logging.StreamHandler()
-handler.setLevel(logging.DEBUG)
-handler.setFormatter(logging.Formatter(
-    fmt='[%(asctime)s] %(name)-28s > %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'))
-fhandler = logging.FileHandler(f'last.log')
-fhandler.setLevel(logging.DEBUG)
-fhandler.setFormatter(logging.Formatter(
-    fmt='[%(asctime)s] %(name)-38s > %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'))
-root_logger.addHandler(fhandler)
-root_logger.addHandler(handler)
-
 logger = logging.getLogger(__name__)
 
-# api and database references are needed in many other modules
-logger.info('Setting up auth keys...')
-api = auth.API()
-engine_id = api.me().id
-logger.info('Done!')
+# setting up app level logger to log in stdout and to a file, done once the engine starts using its resources
+# (a level set beforehand, ie by the simulator, is kept)
+def setup_logging():
+    if root_logger.handlers:
+        return
+    if root_logger.level == logging.NOTSET:
+        root_logger.setLevel(logging.DEBUG)
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.DEBUG)
+    handler.setFormatter(logging.Formatter(
+        fmt='[%(asctime)s] %(name)-28s > %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'))
+    fhandler = logging.FileHandler(f'last.log')
+    fhandler.setLevel(logging.DEBUG)
+    fhandler.setFormatter(logging.Formatter(
+        fmt='[%(asctime)s] %(name)-38s > %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'))
+    root_logger.addHandler(fhandler)
+    root_logger.addHandler(handler)
+
+def connect_api():
+    # tweepy is only loaded by processes that talk to twitter
+    from .auth import auth, cache
+    setup_logging()
+    logger.info('Setting up auth keys...')
+    # requests that get past the cache are counted and timed
+    api = cache.CachedAPI(metrics.TimedAPI(auth.API()))
+    logger.info('Done!')
+    return api
+
+def load_database():
+    setup_logging()
+
+    # existing tinydb json databases are imported into sqlite until the new backend has been set up
+    if os.path.exists(storage.LEGACY_PATH) and not storage.initialized(storage.DEFAULT_PATH):
+        logger.info('Migrating legacy json database...')
+        migrate.migrate(storage.LEGACY_PATH, storage.DEFAULT_PATH)
+
+    db = storage.open_database(storage.DEFAULT_PATH)
+    # documents written by older versions are converted in place once
+    schema.upgrade(db)
+    logger.info('Database loaded.')
 
-db = TinyDB('app/database/db.json', indent=4)
-logger.info('Database loaded.')
+    # will generate db if doesn't exist yet
+    Metadata(db)
+    return db
 
-# will generate db if doesn't exist yet
-Metadata(db)
+# id of the engine's twitter account, asked to twitter once and then kept in the metadata table
+def find_engine_id():
+    meta = Metadata(resource('db'))
+    engine_id = meta.retrieve('engine_id')
+    if engine_id is None:
+        engine_id = resource('api').me().id
+        meta.update('engine_id', engine_id)
+    return engine_id
+
+RESOURCES = {
+    'api': connect_api,
+    'db': load_database,
+    'engine_id': find_engine_id
+}
+resource_lock = threading.RLock()
+
+# api and database references are needed in many other modules, they are created the first time they are used
+# (ie core.db) so importing core doesn't connect to twitter or load the database
+def resource(name):
+    if name not in RESOURCES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    with resource_lock:
+        if name not in globals():
+            globals()[name] = RESOURCES[name]()
+    return globals()[name]
+
+__getattr__ = resource
 
 # retrieves values from the metadata table in the database
 def retrieve(convert_to, tag):
-    return convert_to(db.table('metadata').get(doc_id=1)[tag])
+    return convert_to(resource('db').table('metadata').get(doc_id=1)[tag])
 
+# configuration values of Consts, read from the metadata table when first used
+CONFIG = {
+    'like_value': int,
+    'like_limit': int,
+    'retweet_value': int,
+    'retweet_limit': int,
+    'tax_rate': float,
+    # days an agreement stays open when no deadline is given
+    'agreement_timeout': int,
+    # days statuses are kept in the database, older ones are moved to compressed segment files
+    'status_retention_days': int
+}
 
+class LazyConsts(type):
+    def __getattr__(cls, name):
+        if name not in CONFIG:
+            raise AttributeError(f'type object {cls.__name__!r} has no attribute {name!r}')
+        value = retrieve(CONFIG[name], name)
+        setattr(cls, name, value)
+        return value
 
-class Consts:
+class Consts(metaclass=LazyConsts):
     kwords = {
         'gen': 'generate',
         'exe': 'execute',
@@ -52,28 +120,21 @@ class Consts:
         'uph': 'upheld',
         'brk': 'broken'
     }
-    like_value = retrieve(int, 'like_value')
-    like_limit = retrieve(int, 'like_limit')
-    retweet_value = retrieve(int, 'retweet_value')
-    retweet_limit = retrieve(int, 'retweet_limit')
-    tax_rate = retrieve(float, 'tax_rate')
     send_tweets = True
 
 # tweets a message, or displays it to the console if sending tweets is disabled
 def emit(message, in_reply_to=None):
+    from .database import outbox
 
     # adds status in response to as "salt" because Twitter doesn't allow duplicate statuses
     if in_reply_to:
         message = f'{message} #{in_reply_to}'
 
+    db = resource('db')
     if Consts.send_tweets:
-        api.update_status(
-            status=message,
-            in_reply_to_status_id=in_reply_to,
-            auto_populate_reply_metadata=True
-        )
-
-        logger.info('LIVE: ' + message)
+        # queued with the changes it reports on, the outbox worker sends it once they are committed
+        outbox.Outbox(db).enqueue(message, in_reply_to)
+        logger.info('QUEUED: ' + message)
 
     else:
-        logger.info('DEBUG: ' + message)
\ No newline at end of file
+        db.after_commit(lambda: logger.info('DEBUG: ' + message))
@@ -0,0 +1,52 @@
+import logging
+from tinydb.database import Document
+
+from .indexes import agreement_index, OPEN_STATES
+
+# table exhausted contracts are moved to, documents keep their id and fields (execution history included)
+ARCHIVE_TABLE = 'contract_archive'
+# contracts read per page while looking for exhausted ones, and moved per transaction
+COMPACTION_BATCH = 500
+
+logger = logging.getLogger(__name__)
+
+# a contract that can never be executed again: used up, or collateral zeroed when its agreement was settled
+# dead contracts with uses left are collateral of agreements that may still be broken, so they stay live
+def exhausted(doc):
+    return doc['count'] <= 0
+
+# collateral of an agreement still waiting on a ruling (same id as the agreement) is settled through the contracts table
+def pending(db, contract_id):
+    index = agreement_index(db)
+    return any(contract_id in index.ids('state', state) for state in OPEN_STATES)
+
+# moves exhausted contracts out of the contracts table into the archive, COMPACTION_BATCH of them per transaction
+# so the live table (and everything built from it) only holds contracts that can still be used
+# returns the number of contracts archived
+def compact(db):
+    contracts = db.table('contracts')
+    archive = db.table(ARCHIVE_TABLE)
+    archived = 0
+
+    after = 0
+    while True:
+        with db.transaction():
+            docs = contracts.page(after, COMPACTION_BATCH)
+            if not docs:
+                break
+            after = docs[-1].doc_id
+
+            moving = [doc for doc in docs if exhausted(doc) and not pending(db, doc.doc_id)]
+            for doc in moving:
+                archive.insert(Document(dict(doc), doc_id=doc.doc_id))
+            if moving:
+                contracts.remove(doc_ids=[doc.doc_id for doc in moving])
+            archived += len(moving)
+
+    if archived:
+        logger.info(f'Archived {archived} exhausted contracts')
+    return archived
+
+# returns an archived contract document, or None if it isn't archived
+def get_archived(db, contract_id):
+    return db.table(ARCHIVE_TABLE).get(doc_id=contract_id)
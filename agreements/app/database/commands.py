@@ -0,0 +1,106 @@
+from ..core import Consts
+
+# command verb of each keyword, found with a single dict lookup per word
+VERBS = {word: word for word in Consts.kwords.values()}
+
+# words naming the unit of an amount
+UNITS = {
+    'like': 'like',
+    'likes': 'like',
+    'retweet': 'retweet',
+    'retweets': 'retweet'
+}
+
+# words naming a span of time, in seconds
+DURATIONS = {
+    'hour': 3600,
+    'hours': 3600,
+    'day': 86400,
+    'days': 86400,
+    'week': 604800,
+    'weeks': 604800
+}
+
+# arguments following the verb of each command (in this order, all optional)
+GRAMMAR = {
+    Consts.kwords['gen']: ('amount', 'unit'),
+    Consts.kwords['agr']: ('amount', 'unit'),
+    Consts.kwords['exe']: ('amount',),
+    Consts.kwords['snd']: ('amount',)
+}
+
+# a mention parsed into what it asks the engine to do
+# verb is the first keyword in the text (None if there is none), amount a non negative integer (None if missing or invalid),
+# unit what the amount counts, duration the seconds given with "for N days" (agreements only, None if not given),
+# mentions the users mentioned besides the engine (as given by twitter)
+class Command:
+    __slots__ = ('verb', 'amount', 'unit', 'duration', 'mentions')
+
+    def __init__(self, verb=None, amount=None, unit=None, duration=None, mentions=()):
+        self.verb = verb
+        self.amount = amount
+        self.unit = unit
+        self.duration = duration
+        self.mentions = mentions
+
+    def __eq__(self, other):
+        return isinstance(other, Command) and all(getattr(self, f) == getattr(other, f) for f in self.__slots__)
+
+    def __repr__(self):
+        return 'Command({})'.format(', '.join(f'{f}={getattr(self, f)!r}' for f in self.__slots__))
+
+# amounts are plain decimal numbers (no signs, so nothing can be sent or spent negatively)
+def to_amount(word):
+    if word.isascii() and word.isdigit():
+        return int(word)
+    return None
+
+# parses the text of a mention in a single pass over its words
+def parse_text(text, mentions=()):
+    words = text.split()
+
+    for i, word in enumerate(words):
+        verb = VERBS.get(word)
+        if verb is not None:
+            break
+    else:
+        return Command(mentions=mentions)
+
+    amount = unit = duration = None
+    arguments = GRAMMAR.get(verb, ())
+    if arguments and (i + 1 < len(words)):
+        amount = to_amount(words[i + 1])
+        # a unit only counts right after an amount
+        if ('unit' in arguments) and (amount is not None) and (i + 2 < len(words)):
+            unit = UNITS.get(words[i + 2])
+
+    # what was always assumed when arguments are left out
+    if verb == Consts.kwords['gen']:
+        if amount is None:
+            amount = 10
+        unit = unit or 'like'
+    elif verb == Consts.kwords['agr']:
+        if amount is None:
+            amount, unit = 0, 'none'
+        else:
+            unit = unit or 'TSC'
+        duration = find_duration(words, i + 1)
+
+    return Command(verb, amount, unit, duration, mentions)
+
+# seconds given anywhere after start as "for N hours/days/weeks", None if there are none
+def find_duration(words, start):
+    for j in range(start, len(words) - 2):
+        if words[j] == 'for':
+            count, seconds = to_amount(words[j + 1]), DURATIONS.get(words[j + 2])
+            if (count is not None) and (seconds is not None):
+                return count * seconds
+    return None
+
+# parses a status, the first user mentioned is the engine itself
+def parse(status):
+    return parse_text(status.full_text, status.entities['user_mentions'][1:])
+
+# parses a batch of statuses (ie a backlog), in the same order
+def parse_many(statuses):
+    return [parse(status) for status in statuses]
@@ -0,0 +1,96 @@
+import time
+import heapq
+import logging
+from datetime import datetime, timezone
+
+from . import storage
+from .indexes import agreement_index, OPEN_STATES
+from .records import AgreementRecord
+
+# agreements expired per transaction
+EXPIRY_BATCH = 100
+
+logger = logging.getLogger(__name__)
+
+# deadlines of the agreements still waiting on a ruling (open or disputed), in a heap ordered by deadline (then id)
+# built from the state index, so finding the due ones never scans the agreements table
+# agreements ruled on before their deadline are left in the heap and skipped once they come up
+class Deadlines:
+    def __init__(self, db):
+        index = agreement_index(db)
+        waiting = [a_id for state in OPEN_STATES for a_id in index.ids('state', state)]
+
+        self.heap = [
+            (doc['deadline'], a_id)
+            for a_id, doc in db.table('agreements').get_many(waiting).items()
+            if doc.get('deadline') is not None
+        ]
+        heapq.heapify(self.heap)
+
+    def push(self, agreement_id, deadline):
+        if deadline is not None:
+            heapq.heappush(self.heap, (deadline, int(agreement_id)))
+
+    # the earliest deadline, None if there are none
+    def next_deadline(self):
+        return self.heap[0][0] if self.heap else None
+
+    # removes and returns the ids of up to limit agreements whose deadline is at or before now, earliest first
+    def pop_due(self, now, limit):
+        due = []
+        while self.heap and (self.heap[0][0] <= now) and (len(due) < limit):
+            due.append(heapq.heappop(self.heap)[1])
+        return due
+
+    def __len__(self):
+        return len(self.heap)
+
+# returns the agreement deadlines of a database
+def agreement_deadlines(db):
+    return storage.derived(db, 'deadlines', Deadlines, ['agreements'])
+
+# unix time of a creation date as stored in documents (str of a utc datetime, ie '2021-06-01 12:00:00')
+def timestamp(created):
+    date = datetime.fromisoformat(created)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return int(date.timestamp())
+
+# deadline of an agreement created at created (unix time), duration is in seconds and defaults to timeout days
+def deadline(created, duration, timeout):
+    if duration is None:
+        duration = timeout * 86400
+    return int(created) + duration
+
+# expires every agreement waiting on a ruling whose deadline has passed, EXPIRY_BATCH of them per transaction
+# works on core.db, like the agreements it expires
+# returns the number of agreements expired
+def expire_due(now=None):
+    # core and the agreement objects import this module
+    from .. import core
+    from ..objs.agreement import Agreement
+
+    db = core.db
+    if now is None:
+        now = time.time()
+
+    agreements = db.table('agreements')
+    expired = 0
+    while True:
+        with db.transaction():
+            # taken inside the transaction, so the due ids it pops are restored (it's rebuilt) if it's rolled back
+            due = agreement_deadlines(db).pop_due(now, EXPIRY_BATCH)
+            if not due:
+                break
+
+            for a_id, doc in agreements.get_many(due).items():
+                # ruled on before the deadline
+                if doc['state'] not in OPEN_STATES:
+                    continue
+                entry = AgreementRecord.from_doc(doc, a_id)
+                Agreement(entry).expire(entry)
+                expired += 1
+
+    if expired:
+        logger.info(f'Expired {expired} agreements past their deadline')
+    return expired
@@ -0,0 +1,185 @@
+import os
+import struct
+import logging
+from array import array
+from bisect import bisect_left
+
+from . import storage
+
+# one log record per execution: account id, contract type code, status id (little endian, 17 bytes)
+RECORD = struct.Struct('<qBq')
+TYPES = ['like', 'retweet']
+TYPE_CODES = {contract_type: code for code, contract_type in enumerate(TYPES)}
+
+# sorted set of 64 bit ids, stored in 8 bytes each with O(log n) membership tests
+class IdSet:
+    __slots__ = ('ids',)
+
+    def __init__(self, ids=()):
+        self.ids = array('q', sorted(set(ids)))
+
+    def __contains__(self, id):
+        i = bisect_left(self.ids, id)
+        return (i < len(self.ids)) and (self.ids[i] == id)
+
+    # returns False if the id was already in the set
+    def add(self, id):
+        i = bisect_left(self.ids, id)
+        if (i < len(self.ids)) and (self.ids[i] == id):
+            return False
+        self.ids.insert(i, id)
+        return True
+
+    def discard(self, id):
+        i = bisect_left(self.ids, id)
+        if (i < len(self.ids)) and (self.ids[i] == id):
+            del self.ids[i]
+
+    # ids lower than before (all of them if None), highest first
+    def descending(self, before=None):
+        i = len(self.ids) if before is None else bisect_left(self.ids, before)
+        while i > 0:
+            i -= 1
+            yield self.ids[i]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+# path of the execution log of a database
+def log_path(db):
+    return os.path.splitext(db.path)[0] + '_executions.bin'
+
+# statuses each account has had a like or retweet contract executed on, kept in memory as id sets and persisted as
+# an append-only binary log next to the database
+# records of a transaction are appended and fsync'd right before it commits, and the committed length of the log
+# (metadata executions_length) is committed with it, so anything past it is dropped when the log is opened again
+class ExecutionLog:
+    def __init__(self, db, path=None, readonly=False):
+        self.db = db
+        self.path = path or log_path(db)
+        self.readonly = readonly
+        self.logger = logging.getLogger(".".join([self.__module__, type(self).__name__]))
+        # (account id, contract type) -> IdSet
+        self.sets = {}
+        # status id -> [(account id, contract type)], the accounts that executed contracts on each status
+        self.by_status = {}
+        # length of the log loaded so far
+        self.length = 0
+        # records of the current transaction
+        self.staged = []
+
+        # readers (ie the web process) load the log as far as they know it is committed with refresh()
+        if not readonly:
+            self.refresh(self.committed_length())
+            self.truncate()
+            self.file = open(self.path, 'ab')
+
+    def committed_length(self):
+        return self.db.table('metadata').get(doc_id=1).get('executions_length', 0)
+
+    # loads records up to length, starting over if the log was rewritten since the last refresh
+    def refresh(self, length):
+        if length < self.length:
+            self.sets = {}
+            self.by_status = {}
+            self.length = 0
+        if length == self.length:
+            return False
+
+        data = b''
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                f.seek(self.length)
+                data = f.read(length - self.length)
+        if self.length + len(data) < length:
+            self.logger.warn(f'Execution log is shorter than its committed length ({self.length + len(data)} < {length} bytes)')
+        data = data[:len(data) - len(data) % RECORD.size]
+
+        for account_id, code, status_id in RECORD.iter_unpack(data):
+            self.record(account_id, TYPES[code], status_id)
+        self.length += len(data)
+        return True
+
+    # drops records written by transactions that were never committed
+    def truncate(self):
+        if os.path.exists(self.path) and (os.path.getsize(self.path) > self.length):
+            self.logger.warn('Dropping uncommitted execution records')
+            with open(self.path, 'r+b') as f:
+                f.truncate(self.length)
+                os.fsync(f.fileno())
+
+    # set of status ids an account has had a contract of the given type executed on
+    def executed(self, account_id, contract_type):
+        key = (int(account_id), contract_type)
+        if key not in self.sets:
+            self.sets[key] = IdSet()
+        return self.sets[key]
+
+    # adds an execution to the sets and the status index, returns False if it was already there
+    def record(self, account_id, contract_type, status_id):
+        if not self.executed(account_id, contract_type).add(status_id):
+            return False
+        self.by_status.setdefault(status_id, []).append((account_id, contract_type))
+        return True
+
+    # records an execution, written to the log when the current transaction commits
+    def add(self, account_id, contract_type, status_id):
+        if not self.record(int(account_id), contract_type, int(status_id)):
+            return False
+
+        first = not self.staged
+        self.staged.append(RECORD.pack(int(account_id), TYPE_CODES[contract_type], int(status_id)))
+        if first:
+            self.db.before_commit(self.flush)
+        return True
+
+    # appends the staged records with a single fsync'd write
+    def flush(self):
+        records, self.staged = self.staged, []
+        if not records:
+            return
+
+        data = b''.join(records)
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.length += len(data)
+        self.db.table('metadata').update({'executions_length': self.length}, doc_ids=[1])
+
+    # executed statuses of an account as lists of id strings, keyed by likes and retweets (as served by the web api)
+    def history(self, account_id):
+        return {
+            f'{contract_type}s': [str(status_id) for status_id in self.sets.get((int(account_id), contract_type), ())]
+            for contract_type in TYPES
+        }
+
+    # ids of the accounts that had a contract executed on a status as lists of id strings, keyed by likes and retweets,
+    # or None if no contract was executed on it
+    def executed_on(self, status_id):
+        executions = self.by_status.get(int(status_id))
+        if not executions:
+            return None
+
+        found = {f'{contract_type}s': [] for contract_type in TYPES}
+        for account_id, contract_type in executions:
+            found[f'{contract_type}s'].append(str(account_id))
+        return found
+
+# writes a new log holding the given {(account id, contract type): status ids}, returns its length
+def write_log(path, executed):
+    with open(path + '.tmp', 'wb') as f:
+        for (account_id, contract_type), status_ids in sorted(executed.items()):
+            for status_id in sorted(set(status_ids)):
+                f.write(RECORD.pack(account_id, TYPE_CODES[contract_type], status_id))
+        f.flush()
+        os.fsync(f.fileno())
+        length = f.tell()
+    os.replace(path + '.tmp', path)
+    return length
+
+# returns the execution log of a database
+def execution_log(db):
+    return storage.derived(db, 'executions', ExecutionLog, ['contracts', 'metadata'])
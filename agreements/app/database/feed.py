@@ -0,0 +1,45 @@
+from tinydb.database import Document
+
+# number of agreements kept in the feed, more than are displayed so blocked users can be filtered out
+FEED_SIZE = 50
+
+# ring buffer of the most recently created agreements, stored as a single document so readers never scan the agreements table
+class Feed:
+    def __init__(self, db, size=FEED_SIZE):
+        self.table = db.table('feed')
+        self.size = size
+
+        # seeded once from the newest existing agreements
+        if not self.table.contains(doc_id=1):
+            agreements = db.table('agreements')._read_table()
+            latest = [
+                self.entry(a_id, a_entry)
+                for a_id, a_entry in sorted(agreements.items())[-self.size:]
+                if a_id != 0
+            ]
+            self.table.insert(Document({'latest': latest[::-1]}, doc_id=1))
+
+    @staticmethod
+    def entry(agreement_id, agreement):
+        return {
+            'id': str(agreement_id),
+            'creator_screen_name': agreement['creator_screen_name']
+        }
+
+    # adds a new agreement (normally at the front), dropping the oldest once full
+    # kept sorted by id, since statuses from different accounts may be parsed out of order
+    def push(self, agreement_id, agreement):
+        entry = self.entry(agreement_id, agreement)
+        size = self.size
+
+        def prepend(doc):
+            latest = doc['latest']
+            i = 0
+            while (i < len(latest)) and (int(latest[i]['id']) > agreement_id):
+                i += 1
+            doc['latest'] = (latest[:i] + [entry] + latest[i:])[:size]
+        self.table.update(prepend, doc_ids=[1])
+
+    # newest first
+    def latest(self):
+        return self.table.get(doc_id=1)['latest']
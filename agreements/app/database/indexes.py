@@ -0,0 +1,93 @@
+import heapq
+
+from . import storage
+from .executions import IdSet
+
+# agreement fields that can be looked up without scanning the agreements table
+AGREEMENT_FIELDS = ('creator_id', 'member_id', 'state')
+# states an agreement goes through: open -> (disputed ->) closed, or expired once its deadline passes without a ruling
+# both parties agreed on (unless only one of them voted, which closes it on that vote)
+AGREEMENT_STATES = ('open', 'disputed', 'closed', 'expired')
+# states of agreements still waiting on a ruling
+OPEN_STATES = ('open', 'disputed')
+
+# secondary indexes of the agreements table, a sorted set of agreement ids for every value of the indexed fields
+# the engine keeps one up to date as agreements are created and ruled on, the web read model keeps its own from the change log
+class AgreementIndex:
+    def __init__(self, agreements=None):
+        # (field, value) -> IdSet
+        self.sets = {}
+        for a_id, a_entry in (agreements or {}).items():
+            if a_id != 0:
+                self.add(a_id, a_entry)
+
+    @staticmethod
+    def keys(a_entry):
+        return [
+            (field, int(a_entry[field]) if field.endswith('_id') else a_entry[field])
+            for field in AGREEMENT_FIELDS if field in a_entry
+        ]
+
+    def add(self, agreement_id, a_entry):
+        for key in self.keys(a_entry):
+            if key not in self.sets:
+                self.sets[key] = IdSet()
+            self.sets[key].add(int(agreement_id))
+
+    def remove(self, agreement_id, a_entry):
+        for key in self.keys(a_entry):
+            if key in self.sets:
+                self.sets[key].discard(int(agreement_id))
+
+    # replaces the entries of an agreement (either document may be None if it was created or deleted)
+    def update(self, agreement_id, old_entry, new_entry):
+        if old_entry:
+            self.remove(agreement_id, old_entry)
+        if new_entry:
+            self.add(agreement_id, new_entry)
+
+    def set_state(self, agreement_id, old_state, new_state):
+        self.update(agreement_id, {'state': old_state}, {'state': new_state})
+
+    def ids(self, field, value):
+        return self.sets.get((field, value), IdSet())
+
+    # ids of agreements a user takes part in (as creator or member), newest first
+    def user_ids(self, user_id, before=None):
+        user_id = int(user_id)
+        merged = heapq.merge(
+            self.ids('creator_id', user_id).descending(before),
+            self.ids('member_id', user_id).descending(before),
+            reverse=True
+        )
+        last = None
+        for a_id in merged:
+            if a_id != last:
+                yield a_id
+            last = a_id
+
+    # one page of a user's agreements, optionally only those in a state
+    # returns (ids, cursor of the next page or None), pages continue below the cursor (an agreement id)
+    def user_page(self, user_id, state=None, cursor=None, limit=20):
+        ids = self.user_ids(user_id, cursor)
+        if state is not None:
+            in_state = self.ids('state', state)
+            ids = (a_id for a_id in ids if a_id in in_state)
+        return page(ids, limit)
+
+    # one page of the agreements in a state, newest first
+    def state_page(self, state, cursor=None, limit=20):
+        return page(self.ids('state', state).descending(cursor), limit)
+
+# takes up to limit ids from a descending iterator, along with the cursor of the next page (None if it was the last)
+def page(ids, limit):
+    taken = []
+    for a_id in ids:
+        if len(taken) == limit:
+            return taken, taken[-1]
+        taken.append(a_id)
+    return taken, None
+
+# returns the agreement index of a database
+def agreement_index(db):
+    return storage.derived(db, 'agreement_index', lambda db: AgreementIndex(db.table('agreements')._read_table()), ['agreements'])
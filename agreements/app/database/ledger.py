@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import time
+import logging
+
+from . import storage
+from .metadata import Metadata
+
+# number of journal entries between two snapshots of every balance
+SNAPSHOT_INTERVAL = 10000
+
+# kinds of balance changes recorded in the journal
+KINDS = {
+    'payout',               # value of a new contract paid to its creator (or to the member of a broken agreement)
+    'tax',                  # share of a contract's value withheld by the agreement engine
+    'execution',            # spent executing contracts
+    'transfer',             # sent from one account to another
+    'collateral_lock',      # staked when creating an agreement
+    'collateral_release',   # returned to the creator of an upheld agreement
+    'collateral_payout'     # paid to the member of a broken agreement
+}
+
+# directory holding the journal and snapshots of a database
+def ledger_path(db):
+    return os.path.splitext(db.path)[0] + '_ledger'
+
+# append-only journal of every balance change, kept next to the database
+# changes made in a transaction are appended and fsync'd in one write right before it commits, and the sequence number
+# of the last entry (metadata ledger_seq) is committed with it, so entries of transactions that never committed are
+# dropped when the journal is opened again
+# account balances deliberately stay in the accounts table, updated in the same transaction as their entries: every
+# reader (commands, the web api, stats) keeps reading them from there, and the journal is the audit trail they can be
+# checked against (verify) and rebuilt from (restore), rather than the only place balances are kept
+class Ledger:
+    def __init__(self, db, path=None, snapshot_interval=SNAPSHOT_INTERVAL):
+        self.db = db
+        self.path = path or ledger_path(db)
+        self.journal_path = os.path.join(self.path, 'journal.jsonl')
+        self.snapshot_dir = os.path.join(self.path, 'snapshots')
+        self.snapshot_interval = snapshot_interval
+        self.meta = Metadata(db)
+        self.logger = logging.getLogger(".".join([self.__module__, type(self).__name__]))
+        # changes of the current transaction, as (account id, amount, kind, ref)
+        self.staged = []
+
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        self.recover()
+        self.journal = open(self.journal_path, 'ab')
+
+    # sequence number of the last entry the database has committed
+    def committed_seq(self):
+        return self.meta.table.get(doc_id=1).get('ledger_seq', 0)
+
+    # materialises balances from the latest snapshot and the journal after it, dropping uncommitted entries
+    def recover(self):
+        committed = self.committed_seq()
+
+        # snapshots written by a transaction that was rolled back
+        for seq in self.snapshot_seqs():
+            if seq > committed:
+                os.remove(self.snapshot_file(seq))
+
+        seqs = self.snapshot_seqs()
+        if not seqs:
+            # first use, the journal starts from the balances already in the database
+            self.adopt_database(committed)
+            return
+
+        snapshot = self.load_snapshot(seqs[-1])
+        self.seq = snapshot['seq']
+        self.balances = {int(a_id): balance for a_id, balance in snapshot['balances'].items()}
+
+        end = snapshot['offset']
+        for entry, length in self.read_journal(snapshot['offset']):
+            if entry['seq'] > committed:
+                break
+            self.apply(entry)
+            end += length
+
+        if os.path.exists(self.journal_path) and (os.path.getsize(self.journal_path) > end):
+            self.logger.warn(f'Dropping uncommitted journal entries after #{self.seq}')
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(end)
+                os.fsync(f.fileno())
+
+        if self.seq < committed:
+            self.logger.warn(f'Journal ends at #{self.seq} but the database is at #{committed}, starting over from the database')
+            self.adopt_database(committed)
+
+    # takes the balances in the database as the starting point of the journal
+    def adopt_database(self, committed):
+        self.seq = committed
+        self.balances = {
+            a_id: doc['balance']
+            for a_id, doc in self.db.table('accounts')._read_table().items()
+            if a_id != 0
+        }
+        offset = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+        self.write_snapshot(offset)
+
+    def apply(self, entry):
+        account_id = int(entry['account'])
+        self.balances[account_id] = self.balances.get(account_id, 0) + entry['amount']
+        self.seq = entry['seq']
+
+    # yields (entry, line length) for every complete line from offset on, a torn last line (crash mid write) ends the journal
+    def read_journal(self, offset=0):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    return
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    return
+                yield (entry, len(line))
+
+    # adds a balance change to the current transaction, written to the journal when it commits
+    def record(self, account_id, amount, kind, ref=None):
+        if kind not in KINDS:
+            raise ValueError(f'Unknown balance change kind: {kind}')
+
+        first = not self.staged
+        self.staged.append((account_id, amount, kind, ref))
+        if first:
+            self.db.before_commit(self.flush)
+
+    # appends the staged changes with a single fsync'd write
+    def flush(self):
+        entries, self.staged = self.staged, []
+        if not entries:
+            return
+
+        start = self.seq
+        now = time.time()
+        lines = []
+        for account_id, amount, kind, ref in entries:
+            entry = {
+                'seq': self.seq + 1,
+                'ts': now,
+                'account': str(account_id),
+                'amount': amount,
+                'kind': kind,
+                'ref': str(ref) if ref else None
+            }
+            lines.append(json.dumps(entry, separators=(',', ':')) + '\n')
+            self.apply(entry)
+
+        self.journal.write(''.join(lines).encode())
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.meta.update('ledger_seq', self.seq)
+
+        if (self.seq // self.snapshot_interval) > (start // self.snapshot_interval):
+            self.write_snapshot(self.journal.tell())
+
+    def snapshot_file(self, seq):
+        return os.path.join(self.snapshot_dir, f'{seq:012d}.json')
+
+    def snapshot_seqs(self):
+        return sorted(int(name[:-len('.json')]) for name in os.listdir(self.snapshot_dir) if name.endswith('.json'))
+
+    def load_snapshot(self, seq):
+        with open(self.snapshot_file(seq), 'r') as f:
+            return json.load(f)
+
+    # every balance as of the current entry, offset is where the journal continues after it
+    def write_snapshot(self, offset):
+        path = self.snapshot_file(self.seq)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({
+                'seq': self.seq,
+                'ts': time.time(),
+                'offset': offset,
+                'balances': {str(a_id): balance for a_id, balance in self.balances.items()}
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        self.logger.info(f'Wrote balance snapshot at #{self.seq}')
+
+    # balance of an account at a point in time (unix timestamp), None if it is before the journal started
+    def balance_at(self, account_id, when):
+        committed = self.committed_seq()
+        snapshot = None
+        for seq in reversed(self.snapshot_seqs()):
+            candidate = self.load_snapshot(seq)
+            if (seq <= committed) and (candidate['ts'] <= when):
+                snapshot = candidate
+                break
+        if snapshot is None:
+            return None
+
+        balance = snapshot['balances'].get(str(account_id), 0)
+        for entry, _ in self.read_journal(snapshot['offset']):
+            if (entry['seq'] > committed) or (entry['ts'] > when):
+                break
+            if entry['account'] == str(account_id):
+                balance += entry['amount']
+        return balance
+
+    # accounts whose stored balance differs from the journal, as {account id: (stored, journal)}
+    def verify(self):
+        stored = {
+            a_id: doc['balance']
+            for a_id, doc in self.db.table('accounts')._read_table().items()
+            if a_id != 0
+        }
+        return {
+            a_id: (stored.get(a_id), self.balances.get(a_id, 0))
+            for a_id in set(stored) | set(self.balances)
+            if stored.get(a_id) != self.balances.get(a_id, 0)
+        }
+
+    # rewrites the stored balances from the journal (ie after restoring an old copy of the database)
+    def restore(self):
+        with self.db.transaction():
+            accounts = self.db.table('accounts')
+            for a_id, (stored, balance) in self.verify().items():
+                if stored is not None:
+                    accounts.update({'balance': balance}, doc_ids=[a_id])
+        return self.verify()
+
+# returns the balance ledger of a database
+def balance_ledger(db):
+    return storage.derived(db, 'ledger', Ledger, ['accounts', 'metadata'])
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    ledger = balance_ledger(storage.open_database(storage.DEFAULT_PATH))
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'verify'
+    if command == 'balance':
+        when = float(sys.argv[3]) if len(sys.argv) > 3 else time.time()
+        print(ledger.balance_at(int(sys.argv[2]), when))
+    elif command == 'restore':
+        print(ledger.restore())
+    else:
+        print(ledger.verify())
@@ -4,6 +4,8 @@ import logging
 from tinydb.database import Document
 from tinydb import where
 
+from .schema import SCHEMA_VERSION, ID_TAGS
+
 # container for metadata in the tinydb database
 class Metadata:
     def __init__(self, db):
@@ -17,29 +19,31 @@ class Metadata:
 
     def initialize_database(self):
         self.logger.info('Database is empty, loading default configuration')
-        config = json.load(open('app/database/default_config.json', 'r'))
+        config = default_config()
         config['last_status_parsed'] = config['genesis_status']
+        config['schema_version'] = SCHEMA_VERSION
         
         self.table.insert(Document(config, doc_id=1))
 
     # retrieves a value from the metadata dictionary
     def retrieve(self, tag):
-        text = self.table.get(doc_id=1)[tag]
-
-        # converts to integer or float as needed
-        try:
-            val = int(text)
-        except ValueError:
-            try:
-                val = float(text)
-            except ValueError:
-                return
+        doc = self.table.get(doc_id=1)
+
+        # twitter ids are stored as strings (and are missing until they are known, ie the engine id)
+        if tag in ID_TAGS:
+            val = doc.get(tag)
+            return int(val) if val else None
         
-        return val
+        return doc[tag]
 
     # updates a value in the metadata dictionary
     def update(self, tag, value):
         self.table.update(
-            {tag: str(value)},
+            {tag: str(value) if tag in ID_TAGS else value},
             doc_ids=[1]
-        )
\ No newline at end of file
+        )
+
+# configuration new databases start with
+def default_config():
+    with open('app/database/default_config.json', 'r') as f:
+        return json.load(f)
@@ -0,0 +1,51 @@
+import json
+import logging
+import os
+import sys
+
+from tinydb.database import Document
+
+from . import storage
+
+logger = logging.getLogger(__name__)
+
+# one-shot import of an existing tinydb json file into a new sqlite database
+def migrate(json_path=storage.LEGACY_PATH, sqlite_path=storage.DEFAULT_PATH):
+    if not os.path.exists(json_path):
+        logger.warn(f'Nothing to migrate, {json_path} does not exist')
+        return False
+
+    # a target without metadata was never set up (ie created empty by an older web process), it's replaced
+    if storage.initialized(sqlite_path):
+        logger.warn(f'Migration target {sqlite_path} already exists, refusing to overwrite it')
+        return False
+
+    with open(json_path, 'r') as f:
+        tables = json.load(f)
+
+    # imported into a temporary file first, so a failed import never leaves a partial database behind
+    tmp_path = sqlite_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    db = storage.SQLiteDB(tmp_path)
+    with db.transaction():
+        for name, docs in tables.items():
+            table = db.table(name)
+            for doc_id, doc in docs.items():
+                table.insert(Document(doc, doc_id=int(doc_id)))
+            logger.info(f'Migrated {len(docs)} documents from table "{name}"')
+    db.close()
+
+    # the wal of a replaced empty database would be applied to the new one
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(sqlite_path + suffix):
+            os.remove(sqlite_path + suffix)
+    os.replace(tmp_path, sqlite_path)
+
+    logger.info(f'Database migrated from {json_path} to {sqlite_path}')
+    return True
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    migrate(*sys.argv[1:3])
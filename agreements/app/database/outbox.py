@@ -0,0 +1,216 @@
+import time
+import logging
+import threading
+import traceback
+from collections import deque
+
+import tweepy
+from tinydb import where
+
+from .. import metrics
+
+# twitter allows 300 statuses (tweets and retweets combined) per 3 hour window
+WINDOW_LENGTH = 3 * 60 * 60
+WINDOW_LIMIT = 300
+
+# error codes that are worth retrying (over capacity, internal error), anything else with a code is permanent
+TRANSIENT_CODES = {130, 131}
+# error codes meaning the account has hit a posting limit
+RATE_LIMIT_CODES = {88, 185}
+# duplicate status, the reply has already been posted
+DUPLICATE_CODE = 187
+
+MAX_ATTEMPTS = 8
+MAX_BACKOFF = 30 * 60
+
+# running workers, woken up whenever new messages are committed
+workers = []
+
+def wake_workers():
+    for worker in workers:
+        worker.wake()
+
+# persistent queue of outgoing tweets, stored in the outbox table of the database
+class Outbox:
+    def __init__(self, db):
+        self.db = db
+        self.table = db.table('outbox')
+
+    # adds a message to the queue, it becomes visible to the worker when the current transaction commits
+    def enqueue(self, message, in_reply_to=None):
+        self.db.after_commit(lambda: metrics.outbox_depth.inc())
+        self.db.after_commit(wake_workers)
+        return self.table.insert({
+            'state': 'pending',
+            'message': message,
+            'in_reply_to': str(in_reply_to) if in_reply_to else None,
+            'attempts': 0,
+            'next_attempt': time.time(),
+            'created': time.time(),
+            'sent': None
+        })
+
+    # returns pending messages in the order they were queued
+    def pending(self):
+        return self.table.search(where('state') == 'pending')
+
+    def depth(self):
+        return len(self.pending())
+
+    # timestamps of messages sent within the current rate limit window
+    def recently_sent(self, now):
+        sent = self.table.search(where('state') == 'sent')
+        return sorted(doc['sent'] for doc in sent if now - doc['sent'] < WINDOW_LENGTH)
+
+    def mark_sent(self, doc_id, now):
+        self.table.update({'state': 'sent', 'sent': now}, doc_ids=[doc_id])
+
+    def mark_failed(self, doc_id):
+        self.table.update({'state': 'failed'}, doc_ids=[doc_id])
+
+    def reschedule(self, doc_id, attempts, next_attempt):
+        self.table.update({'attempts': attempts, 'next_attempt': next_attempt}, doc_ids=[doc_id])
+
+    # sent messages are only kept as long as they count towards the rate limit window
+    def prune(self, now):
+        self.table.remove(doc_ids=[
+            doc.doc_id for doc in self.table.search(where('state') == 'sent')
+            if now - doc['sent'] >= WINDOW_LENGTH
+        ])
+
+# background thread draining the outbox while respecting twitter's rate limits
+class Worker(threading.Thread):
+    def __init__(self, db, api, idle_wait=5):
+        super().__init__(name='outbox', daemon=True)
+        self.outbox = Outbox(db)
+        self.db = db
+        self.api = api
+        self.idle_wait = idle_wait
+        self.logger = logging.getLogger(".".join([self.__module__, type(self).__name__]))
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.paused_until = 0
+        self.window = deque(self.outbox.recently_sent(time.time()))
+
+    # called after new messages are committed so they go out without waiting for the next idle check
+    def wake(self):
+        self.wakeup.set()
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+
+    def run(self):
+        self.logger.info('Outbox worker started')
+        workers.append(self)
+        while not self.stopping.is_set():
+            try:
+                wait = self.drain()
+            except Exception:
+                self.logger.warn(traceback.format_exc())
+                wait = self.idle_wait
+
+            self.wakeup.wait(wait)
+            self.wakeup.clear()
+
+        workers.remove(self)
+
+    # sends every due message it can, returns how long to wait before trying again
+    # due messages are looked up once per pass, and sent ones are pruned once per call
+    def drain(self):
+        self.outbox.prune(time.time())
+
+        while not self.stopping.is_set():
+            now = time.time()
+            wait = self.blocked(now)
+            if wait is not None:
+                return wait
+
+            pending = self.outbox.pending()
+            metrics.outbox_depth.set(len(pending))
+            due = [doc for doc in pending if doc['next_attempt'] <= now]
+            if not due:
+                if pending:
+                    return min(doc['next_attempt'] for doc in pending) - now
+                return self.idle_wait
+
+            for doc in due:
+                if self.stopping.is_set():
+                    break
+                now = time.time()
+                wait = self.blocked(now)
+                if wait is not None:
+                    return wait
+                self.send(doc, now)
+
+        return 0
+
+    # how long sending has to wait for a rate limit (twitter's or our own window), None if it can go ahead
+    def blocked(self, now):
+        if now < self.paused_until:
+            return self.paused_until - now
+
+        # local sliding window so we slow down before twitter starts refusing
+        while self.window and now - self.window[0] >= WINDOW_LENGTH:
+            self.window.popleft()
+        if len(self.window) >= WINDOW_LIMIT:
+            return self.window[0] + WINDOW_LENGTH - now
+
+        return None
+
+    def send(self, doc, now):
+        in_reply_to = int(doc['in_reply_to']) if doc['in_reply_to'] else None
+
+        try:
+            self.api.update_status(
+                status=doc['message'],
+                in_reply_to_status_id=in_reply_to,
+                auto_populate_reply_metadata=True
+            )
+
+        except tweepy.error.RateLimitError as error:
+            self.rate_limited(error, now)
+            return
+
+        except tweepy.error.TweepError as error:
+            if error.api_code == DUPLICATE_CODE:
+                # already posted (ie sent before a restart but not marked), nothing left to do
+                self.logger.warn(f'Duplicate tweet, marking as sent: {doc["message"]}')
+                self.outbox.mark_sent(doc.doc_id, now)
+            elif error.api_code in RATE_LIMIT_CODES:
+                self.rate_limited(error, now)
+            elif (error.api_code is None) or (error.api_code in TRANSIENT_CODES):
+                self.retry(doc, error)
+            else:
+                if error.api_code == 385:
+                    self.logger.warn('Cannot reply to tweet')
+                else:
+                    self.logger.warn(f'Unknown tweepy error: {error.api_code}')
+                self.outbox.mark_failed(doc.doc_id)
+            return
+
+        self.outbox.mark_sent(doc.doc_id, now)
+        self.window.append(now)
+        self.logger.info('LIVE: ' + doc['message'])
+
+    # backs off exponentially, giving up after too many attempts
+    def retry(self, doc, error):
+        attempts = doc['attempts'] + 1
+        if attempts >= MAX_ATTEMPTS:
+            self.logger.warn(f'Giving up on tweet after {attempts} attempts ({error}): {doc["message"]}')
+            self.outbox.mark_failed(doc.doc_id)
+            return
+
+        backoff = min(2 ** attempts, MAX_BACKOFF)
+        self.logger.warn(f'Transient error sending tweet ({error}), retrying in {backoff} seconds')
+        self.outbox.reschedule(doc.doc_id, attempts, time.time() + backoff)
+
+    # pauses sending until the rate limit window resets
+    def rate_limited(self, error, now):
+        reset = None
+        response = getattr(error, 'response', None)
+        if response is not None:
+            reset = response.headers.get('x-rate-limit-reset')
+
+        self.paused_until = float(reset) if reset else now + 15 * 60
+        self.logger.warn(f'Rate limited, pausing outbox for {self.paused_until - now:.0f} seconds')
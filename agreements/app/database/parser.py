@@ -1,8 +1,29 @@
 from tinydb.database import Document
 
 from .metadata import Metadata
-from ..objs import account, contract
+from .feed import Feed
+from .records import StatusRecord, AgreementRecord
+from .stats import economy_stats
+from . import commands
+from ..objs import account
 from ..core import Consts
+from .. import metrics
+
+# account method carrying out each command
+HANDLERS = {
+    Consts.kwords['gen']: 'create_contract',
+    Consts.kwords['exe']: 'execute_contracts',
+    Consts.kwords['bal']: 'send_current_balance',
+    Consts.kwords['lik']: 'send_current_likes',
+    Consts.kwords['rtw']: 'send_current_retweets',
+    Consts.kwords['snd']: 'send_tsc',
+    Consts.kwords['agr']: 'create_agreement',
+    Consts.kwords['uph']: 'vote_upheld',
+    Consts.kwords['brk']: 'vote_broken'
+}
+
+# commands voting on the agreement being replied to
+VOTES = (Consts.kwords['uph'], Consts.kwords['brk'])
 
 class Parser:
     def __init__(self, db, api):
@@ -19,7 +40,7 @@ class Parser:
         if not self.accounts.contains(doc_id=0):
             self.accounts.insert(Document(
                 {
-                    'num_accounts': '0'
+                    'num_accounts': 0
                 },
                 doc_id=0))
             
@@ -29,7 +50,7 @@ class Parser:
         if not self.contracts.contains(doc_id=0):
             self.contracts.insert(Document(
                 {
-                    'num_contracts': '0',
+                    'num_contracts': 0,
                     # 'total_value': '0',
                 },
                 doc_id=0))
@@ -37,61 +58,77 @@ class Parser:
         if not self.agreements.contains(doc_id=0):
             self.agreements.insert(Document(
                 {
-                    'num_agreements': '0'
+                    'num_agreements': 0
                 },
                 doc_id=0))
+
+        # intializing latest agreements feed
+        Feed(db)
+        # built before any status is parsed, so the first build never counts changes of a transaction twice
+        economy_stats(db)
     
-    def parse(self, status):
+    # looks up the twitter data a command needs (the recipient of a send) before its transaction is entered
+    # so waiting on twitter never holds the database lock, parsing then finds it in the api cache
+    # (a user that couldn't be looked up here is looked up again while parsing)
+    def resolve(self, command):
+        if (command.verb == Consts.kwords['snd']) and command.mentions:
+            self.api.get_user(command.mentions[0]['id'])
+
+    # command is the parsed status, if it was already parsed (ie with the rest of its batch)
+    def parse(self, status, command=None):
+        if command is None:
+            command = commands.parse(status)
+
         # decides what command a tweet is and runs the proper code
+        # all changes made while parsing are committed at once when done, or not at all if an error is raised
+        with metrics.trace_status(status.id, command.verb or 'none'):
+            with self.db.transaction():
+                self._parse(status, command)
+
+    def _parse(self, status, command):
         self.add_status(status)
-        text = status.full_text
 
         acc = account.Account(status.user)
 
-        # finds first keyword
-        kword = None
-        for word in text.split():
-            if word in Consts.kwords.values():
-                kword = word
-                break
-
         # calls function based on first keyword found
-        if kword == Consts.kwords['gen']:
-            acc.create_contract(status)
-        elif kword ==  Consts.kwords['exe']:
-            acc.execute_contracts(status)
-        elif kword == Consts.kwords['bal']:
-            acc.send_current_balance(status)
-        elif kword == Consts.kwords['lik']:
-            acc.send_current_likes(status)
-        elif kword == Consts.kwords['rtw']:
-            acc.send_current_retweets(status)
-        elif kword == Consts.kwords['snd']:
-            acc.send_tsc(status)
-        elif kword == Consts.kwords['agr']:
-            acc.create_agreement(status)
-        elif kword == Consts.kwords['uph']:
-            acc.vote_upheld(status)
-        elif kword == Consts.kwords['brk']:
-            acc.vote_broken(status)
+        handler = HANDLERS.get(command.verb)
+        if handler is not None:
+            getattr(acc, handler)(status, command)
+
+    # settles a run of votes (ie the votes of one poll cycle) in a single transaction
+    # every agreement voted on is loaded with one read and kept in memory, so each vote only writes its changes
+    def parse_votes(self, statuses, parsed):
+        with self.db.transaction():
+            agreement_ids = {status.in_reply_to_status_id for status in statuses if status.in_reply_to_status_id}
+            entries = {
+                a_id: AgreementRecord.from_doc(doc, a_id)
+                for a_id, doc in self.agreements.get_many(agreement_ids).items()
+            }
+
+            for status, command in zip(statuses, parsed):
+                with metrics.trace_status(status.id, command.verb):
+                    self.add_status(status)
+                    acc = account.Account(status.user)
+                    getattr(acc, HANDLERS[command.verb])(status, command, entries.get(status.in_reply_to_status_id))
 
     # adds data from every mention status to the database 
     def add_status(self, status):
         if self.statuses.contains(doc_id=status.id):
             return False
 
-        dict_status = {
-            'text': status.full_text,
-            'user_full_name': status.user.name,
-            'user_screen_name': status.user.screen_name,
-            'user_id': str(status.user.id),
-            'created': str(status.created_at),
-            'parent_id': str(status.in_reply_to_status_id) if status.in_reply_to_status_id else None,
-        }
+        record = StatusRecord(
+            status.id,
+            text=status.full_text,
+            user_full_name=status.user.name,
+            user_screen_name=status.user.screen_name,
+            user_id=status.user.id,
+            created=str(status.created_at),
+            parent_id=status.in_reply_to_status_id
+        )
 
         # adding status to database
         self.statuses.insert(Document(
-            dict_status, 
+            record.to_doc(), 
             doc_id=status.id
         ))
 
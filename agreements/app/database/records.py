@@ -0,0 +1,109 @@
+# typed, compact forms of the documents stored in the database
+# since schema version 2 amounts and counters are stored as native json numbers, twitter ids are still stored as
+# strings (like twitter's own id_str) since javascript clients of the web api can't represent them exactly
+
+# field type of twitter ids, an int on the record and a string in the stored document
+ID = 'id'
+
+class Record:
+    __slots__ = ('id',)
+    # stored field name -> type (int, str, list or ID)
+    fields = {}
+
+    def __init__(self, id=None, **values):
+        self.id = id
+        for name in self.fields:
+            setattr(self, name, values.get(name))
+
+    # builds a record from a stored document
+    @classmethod
+    def from_doc(cls, doc, doc_id=None):
+        record = cls.__new__(cls)
+        record.id = doc_id if doc_id is not None else getattr(doc, 'doc_id', None)
+        for name, kind in cls.fields.items():
+            value = doc.get(name)
+            if (kind is ID) and value:
+                value = int(value)
+            setattr(record, name, value)
+        return record
+
+    # returns the record of a document in a table, or None if it doesn't exist
+    @classmethod
+    def load(cls, table, doc_id):
+        doc = table.get(doc_id=doc_id)
+        return cls.from_doc(doc, doc_id) if doc is not None else None
+
+    # returns the document to store for this record
+    def to_doc(self):
+        doc = {}
+        for name, kind in self.fields.items():
+            value = getattr(self, name)
+            if (kind is ID) and value:
+                value = str(value)
+            elif kind is list:
+                # copied so later changes to the stored document never show up in the record
+                value = list(value)
+            doc[name] = value
+        return doc
+
+    # converts the number fields of a document written before schema version 2 (ie '15' -> 15)
+    @classmethod
+    def upgrade(cls, doc):
+        for name, kind in cls.fields.items():
+            if (kind is int) and isinstance(doc.get(name), str):
+                doc[name] = int(doc[name])
+
+    def __repr__(self):
+        values = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.fields)
+        return f'{type(self).__name__}(id={self.id!r}, {values})'
+
+class AccountRecord(Record):
+    fields = {
+        'full_name': str,
+        'screen_name': str,
+        'balance': int,
+        'contracts': list
+    }
+    __slots__ = tuple(fields)
+
+class ContractRecord(Record):
+    fields = {
+        'state': str,
+        'user_id': ID,
+        'user_screen_name': str,
+        'type': str,
+        'count': int,
+        'price': int,
+        'created': str,
+        'executed_on': list
+    }
+    __slots__ = tuple(fields)
+
+class AgreementRecord(Record):
+    fields = {
+        'state': str,
+        'creator_id': ID,
+        'creator_screen_name': str,
+        'creator_ruling': str,
+        'member_id': ID,
+        'member_screen_name': str,
+        'member_ruling': str,
+        'collateral_type': str,
+        'collateral': int,
+        'created': str,
+        'text': str,
+        # unix time after which the agreement expires if it still hasn't been ruled on
+        'deadline': int
+    }
+    __slots__ = tuple(fields)
+
+class StatusRecord(Record):
+    fields = {
+        'text': str,
+        'user_full_name': str,
+        'user_screen_name': str,
+        'user_id': ID,
+        'created': str,
+        'parent_id': ID
+    }
+    __slots__ = tuple(fields)
@@ -0,0 +1,152 @@
+import time
+import logging
+
+from . import storage, executions, deadlines
+from .records import AccountRecord, ContractRecord, AgreementRecord, StatusRecord
+
+# version of the document layout, stored as schema_version in the metadata document
+# 1: every number stored as a string
+# 2: amounts, counters and settings stored as json numbers (twitter ids are still strings)
+# 3: statuses executed on moved from the likes and retweets lists of accounts to the binary execution log
+# 4: agreements whose rulings disagree are in the disputed state instead of open
+# 5: agreements have a deadline, agreements created before get the default timeout from the upgrade on
+# 6: status_retention_days setting in the metadata document
+SCHEMA_VERSION = 6
+
+# record type of the documents in each table
+RECORDS = {
+    'accounts': AccountRecord,
+    'contracts': ContractRecord,
+    'agreements': AgreementRecord,
+    'statuses': StatusRecord
+}
+
+# counter kept in the header document (doc id 0) of a table
+COUNTERS = {
+    'accounts': 'num_accounts',
+    'contracts': 'num_contracts',
+    'agreements': 'num_agreements'
+}
+
+# metadata values that are twitter ids
+ID_TAGS = ('genesis_status', 'last_status_parsed', 'engine_id')
+
+logger = logging.getLogger(__name__)
+
+# schema version of a database, None if it is empty (new databases are created with the current schema)
+def version(db):
+    meta = db.table('metadata').get(doc_id=1)
+    if meta is None:
+        return None
+    return meta.get('schema_version', 1)
+
+# brings an existing database up to the current schema version, in a single transaction
+def upgrade(db):
+    current = version(db)
+    if (current is None) or (current >= SCHEMA_VERSION):
+        return False
+
+    logger.info(f'Upgrading database from schema version {current} to {SCHEMA_VERSION}')
+    with db.transaction():
+        if current < 2:
+            native_numbers(db)
+        if current < 3:
+            move_executions(db)
+        if current < 4:
+            mark_disputed(db)
+        if current < 5:
+            add_deadlines(db)
+        if current < 6:
+            add_status_retention(db)
+        db.table('metadata').update({'schema_version': SCHEMA_VERSION}, doc_ids=[1])
+
+    # derived structures (ie the contract count index) are rebuilt from the converted documents
+    storage.invalidate(db)
+    return True
+
+# converts values stored as strings into json numbers
+def native_numbers(db):
+    for name, record_cls in RECORDS.items():
+        counter = COUNTERS.get(name)
+
+        # the header document only holds the counter, record fields it doesn't have are left alone
+        def transform(doc):
+            record_cls.upgrade(doc)
+            if counter in doc:
+                doc[counter] = int(doc[counter])
+        db.table(name).update(transform)
+
+    def transform_metadata(doc):
+        for tag, value in doc.items():
+            if (tag not in ID_TAGS) and isinstance(value, str):
+                doc[tag] = to_number(value)
+    db.table('metadata').update(transform_metadata, doc_ids=[1])
+
+    def transform_outbox(doc):
+        doc['attempts'] = int(doc['attempts'])
+        for field in ('next_attempt', 'created', 'sent'):
+            if doc[field] is not None:
+                doc[field] = float(doc[field])
+    db.table('outbox').update(transform_outbox)
+
+# writes the likes and retweets lists of every account to the execution log and removes them from the documents
+def move_executions(db):
+    accounts = db.table('accounts')
+    executed = {}
+    for a_id, doc in accounts._read_table().items():
+        for contract_type in executions.TYPES:
+            status_ids = doc.get(f'{contract_type}s')
+            if status_ids:
+                executed[(a_id, contract_type)] = [int(status_id) for status_id in status_ids]
+
+    length = executions.write_log(executions.log_path(db), executed)
+    db.table('metadata').update({'executions_length': length}, doc_ids=[1])
+    logger.info(f'Moved {sum(len(ids) for ids in executed.values())} executions to the execution log')
+
+    def transform(doc):
+        doc.pop('likes', None)
+        doc.pop('retweets', None)
+    accounts.update(transform)
+
+# agreements ruled on differently by both sides were left open
+def mark_disputed(db):
+    def transform(doc):
+        if doc.get('state') != 'open':
+            return
+        rulings = (doc['creator_ruling'], doc['member_ruling'])
+        if all(rulings) and (rulings[0] != rulings[1]):
+            doc['state'] = 'disputed'
+    db.table('agreements').update(transform)
+
+# agreements created before deadlines get the default timeout, counted from the upgrade for the ones older than that
+# (from their creation, they would all expire at once on the first update after the upgrade)
+def add_deadlines(db):
+    # imported here since metadata imports this module
+    from .metadata import default_config
+
+    timeout = default_config()['agreement_timeout']
+    db.table('metadata').update({'agreement_timeout': timeout}, doc_ids=[1])
+
+    now = int(time.time())
+    def transform(doc):
+        if ('created' in doc) and (doc.get('deadline') is None):
+            start = max(deadlines.timestamp(doc['created']), now)
+            doc['deadline'] = deadlines.deadline(start, None, timeout)
+    db.table('agreements').update(transform)
+
+# days statuses are kept in the database before they're moved to segments, configured from now on
+def add_status_retention(db):
+    from .metadata import default_config
+
+    retention = default_config()['status_retention_days']
+    db.table('metadata').update({'status_retention_days': retention}, doc_ids=[1])
+
+# parses a number stored as a string, leaving anything else as it is
+def to_number(text):
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            return text
@@ -0,0 +1,124 @@
+import os
+import time
+import gzip
+import json
+import logging
+from datetime import datetime, timezone
+
+from .metadata import Metadata
+
+# start of twitter's snowflake ids (ms since the unix epoch), ids are (ms - epoch) << 22 plus a sequence number
+TWITTER_EPOCH = 1288834974657
+# statuses moved per transaction
+RETENTION_BATCH = 1000
+
+logger = logging.getLogger(__name__)
+
+# unix time (ms) a twitter id was created at
+def id_time(status_id):
+    return (int(status_id) >> 22) + TWITTER_EPOCH
+
+# smallest twitter id created at or after a unix time (ms)
+def time_id(ms):
+    return max(0, int(ms) - TWITTER_EPOCH) << 22
+
+# utc day a twitter id was created on, names the directory of the segments it is archived in
+def id_day(status_id):
+    return datetime.fromtimestamp(id_time(status_id) / 1000, timezone.utc).strftime('%Y-%m-%d')
+
+# directory of the status segments of a database
+def segments_path(db):
+    return os.path.splitext(db.path)[0] + '_statuses'
+
+# statuses moved out of the database, partitioned by day (by the time in their id) into a directory per day
+# every append writes new gzipped json lines segments named after the range of ids they hold, segments are never
+# changed once written, and they show up whole or not at all (written to a temporary file and renamed)
+class StatusSegments:
+    def __init__(self, path):
+        self.path = path
+
+    def day_path(self, day):
+        return os.path.join(self.path, day)
+
+    # appends status documents (with their doc_id) as one new segment per day, synced to disk
+    def append(self, docs):
+        days = {}
+        for doc in docs:
+            days.setdefault(id_day(doc.doc_id), []).append(doc)
+
+        for day, day_docs in sorted(days.items()):
+            day_docs.sort(key=lambda doc: doc.doc_id)
+            # the id goes first so lookups can match lines without parsing them
+            lines = ''.join(json.dumps({'id': str(doc.doc_id), **doc}) + '\n' for doc in day_docs)
+
+            os.makedirs(self.day_path(day), exist_ok=True)
+            path = os.path.join(self.day_path(day), f'{day_docs[0].doc_id}-{day_docs[-1].doc_id}.jsonl.gz')
+            with open(path + '.tmp', 'wb') as f:
+                f.write(gzip.compress(lines.encode()))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+
+    # segments of a day that may hold an id
+    def candidates(self, status_id):
+        day_path = self.day_path(id_day(status_id))
+        if not os.path.isdir(day_path):
+            return []
+
+        found = []
+        for name in sorted(os.listdir(day_path)):
+            if not name.endswith('.jsonl.gz'):
+                continue
+            first, last = name[:-len('.jsonl.gz')].split('-')
+            if int(first) <= status_id <= int(last):
+                found.append(os.path.join(day_path, name))
+        return found
+
+    # returns an archived status document (with its id as a string), or None if it isn't archived
+    def get(self, status_id):
+        status_id = int(status_id)
+        prefix = json.dumps({'id': str(status_id)})[:-1] + ','
+        for path in self.candidates(status_id):
+            with gzip.open(path, 'rt') as f:
+                for line in f:
+                    if line.startswith(prefix):
+                        return json.loads(line)
+        return None
+
+# moves statuses older than days (by the time in their id) out of the statuses table into segments, oldest first
+# returns the number of statuses moved
+def retain(db, days, now=None):
+    if now is None:
+        now = time.time()
+
+    cutoff = time_id((now - days * 86400) * 1000)
+    # statuses past the checkpoint may be parsed again (ie after a crash), they're looked up in the table to skip them
+    last_status_parsed = Metadata(db).retrieve('last_status_parsed')
+    if last_status_parsed:
+        cutoff = min(cutoff, last_status_parsed + 1)
+
+    statuses = db.table('statuses')
+    segments = StatusSegments(segments_path(db))
+    moved = 0
+    while True:
+        with db.transaction():
+            # ids grow with time, so the oldest statuses are the first page
+            docs = [doc for doc in statuses.page(0, RETENTION_BATCH) if doc.doc_id < cutoff]
+            if docs:
+                statuses.remove(doc_ids=[doc.doc_id for doc in docs])
+                # written (and synced) before the removal is committed, so statuses are never only in memory
+                db.before_commit(lambda docs=docs: segments.append(docs))
+        moved += len(docs)
+        if len(docs) < RETENTION_BATCH:
+            break
+
+    if moved:
+        logger.info(f'Moved {moved} statuses to segments')
+    return moved
+
+# returns a status document by id, from the statuses table or its segment
+def find_status(db, status_id):
+    doc = db.table('statuses').get(doc_id=int(status_id))
+    if doc is not None:
+        return doc
+    return StatusSegments(segments_path(db)).get(status_id)
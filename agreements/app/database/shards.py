@@ -0,0 +1,107 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from ..core import Consts
+from .records import AgreementRecord
+from . import commands
+
+# key shared by statuses that may touch any account (ie executions reach every contract owner)
+GLOBAL = ('global',)
+
+# returns the set of keys (accounts, agreements) a status may read or write
+# statuses with no keys in common can be processed in any order relative to each other
+def conflict_keys(status, command, agreements):
+    kword = command.verb
+
+    keys = {('account', status.user.id)}
+    for mention in command.mentions:
+        keys.add(('account', mention['id']))
+
+    if kword == Consts.kwords['exe']:
+        return {GLOBAL}
+
+    elif kword == Consts.kwords['agr']:
+        keys.add(('agreement', status.id))
+
+    elif kword in (Consts.kwords['uph'], Consts.kwords['brk']):
+        agreement_id = status.in_reply_to_status_id
+        keys.add(('agreement', agreement_id))
+
+        # settling moves collateral between both parties, which are only known once the agreement exists
+        entry = AgreementRecord.load(agreements, agreement_id) if agreement_id else None
+        if entry is None:
+            return {GLOBAL}
+        keys.add(('account', entry.creator_id))
+        keys.add(('account', entry.member_id))
+
+    return keys
+
+# processes a batch of statuses on a pool of worker threads
+# a status starts only after every earlier status sharing one of its keys is done, so each account
+# sees its statuses in chronological order, while unrelated statuses overlap their twitter lookups
+# (changes to the database are still made one transaction at a time, under its lock)
+class ShardedProcessor:
+    def __init__(self, db, process, checkpoint, workers=4):
+        self.agreements = db.table('agreements')
+        self.process = process
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.logger = logging.getLogger(".".join([self.__module__, type(self).__name__]))
+
+    # parsed is the command of each status in the batch, parsed here if not given
+    # an error raised by process stops the checkpoint before its status, and skips every later status sharing a key
+    # with it (so they're parsed again in order on the next update), the first one is raised once the batch is done
+    def run(self, batch, parsed=None):
+        if parsed is None:
+            parsed = commands.parse_many(batch)
+
+        done = [False] * len(batch)
+        errors = []
+        # index of the first status that isn't done yet, everything before it is checkpointed
+        watermark = [0]
+        checkpoint_lock = threading.Lock()
+
+        # returns whether the status was processed
+        def task(i, status, command, dependencies):
+            wait(dependencies)
+            if not all(dependency.result() for dependency in dependencies):
+                return False
+
+            try:
+                self.process(status, command)
+            except Exception as error:
+                self.logger.warn(f'Error while parsing status [{status.id}], changes rolled back')
+                errors.append((i, error))
+                return False
+
+            # only the checkpoint is serialized, it advances over the longest finished prefix of the batch
+            with checkpoint_lock:
+                done[i] = True
+                start = watermark[0]
+                while (watermark[0] < len(batch)) and done[watermark[0]]:
+                    watermark[0] += 1
+                if watermark[0] > start:
+                    self.checkpoint(batch[watermark[0] - 1])
+            return True
+
+        # latest submitted task for each key
+        last_task = {}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='shard') as pool:
+            for i, (status, command) in enumerate(zip(batch, parsed)):
+                keys = conflict_keys(status, command, self.agreements)
+
+                if GLOBAL in keys:
+                    # waits for everything before it, and everything after waits for it
+                    dependencies = set(last_task.values())
+                    last_task = {}
+                else:
+                    dependencies = {last_task[key] for key in keys | {GLOBAL} if key in last_task}
+
+                future = pool.submit(task, i, status, command, dependencies)
+                for key in keys:
+                    last_task[key] = future
+
+        self.logger.info(f'Processed {len(batch)} statuses on {self.workers} workers')
+        if errors:
+            raise min(errors, key=lambda error: error[0])[1]
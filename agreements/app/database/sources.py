@@ -0,0 +1,129 @@
+import json
+import queue
+import logging
+import tempfile
+
+import tweepy
+from tweepy.models import Status
+
+# sources deliver new mentions as batches of statuses in chronological order (oldest first)
+# each has batches(since_id), a generator of lists of statuses newer than since_id,
+# and next_interval(processed), how long the scheduler should wait before asking again
+
+# polls the mentions timeline, shortening the interval while there is activity and backing off when idle
+class PollingSource:
+    def __init__(self, api, page_size=200, min_interval=15, max_interval=120, interval=60):
+        self.api = api
+        self.page_size = page_size
+        # mentions_timeline allows 75 requests per 15 minutes, so never poll more than every 12 seconds
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = interval
+        self.logger = logging.getLogger(".".join([self.__module__, type(self).__name__]))
+
+    def pages(self, since_id):
+        # pages come in reverse chronological order
+        return tweepy.Cursor(
+            self.api.mentions_timeline,
+            tweet_mode="extended", # needed to get full text for longer tweets
+            since_id=since_id, # won't iterate through tweets already in database
+            count=self.page_size
+        ).pages()
+
+    def batches(self, since_id):
+        pages = iter(self.pages(since_id))
+
+        first = next(pages, [])
+        second = next(pages, None)
+
+        # usual case, everything new fits in one page and is processed right away
+        if second is None:
+            if first:
+                yield list(reversed(first))
+            return
+
+        # a backlog (ie after downtime) is spilled to disk page by page and read back oldest page first,
+        # so only one page is held in memory at a time
+        self.logger.info('Backlog of mentions spans multiple pages, spilling to disk')
+        with tempfile.TemporaryFile(mode='w+') as spill:
+            offsets = []
+            for page in [first, second]:
+                offsets.append(self.spill_page(spill, page))
+            for page in pages:
+                offsets.append(self.spill_page(spill, page))
+
+            for offset in reversed(offsets):
+                spill.seek(offset)
+                page = json.loads(spill.readline())
+                yield [Status.parse(self.api, data) for data in reversed(page)]
+
+    @staticmethod
+    def spill_page(spill, page):
+        spill.seek(0, 2)
+        offset = spill.tell()
+        spill.write(json.dumps([status._json for status in page]) + '\n')
+        return offset
+
+    # polls faster while mentions keep coming in and slows down when idle
+    def next_interval(self, processed):
+        if processed > 0:
+            self.interval = max(self.min_interval, self.interval / 2)
+        else:
+            self.interval = min(self.max_interval, self.interval * 1.5)
+        return self.interval
+
+# replays statuses from a file with one status json object per line (ie for tests or reprocessing)
+class FileReplaySource:
+    def __init__(self, path, batch_size=200, api=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.api = api
+
+    def batches(self, since_id):
+        batch = []
+        with open(self.path, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                status = Status.parse(self.api, json.loads(line))
+                if since_id and status.id <= since_id:
+                    continue
+
+                batch.append(status)
+                if len(batch) >= self.batch_size:
+                    yield sorted(batch, key=lambda s: s.id)
+                    batch = []
+
+        if batch:
+            yield sorted(batch, key=lambda s: s.id)
+
+    def next_interval(self, processed):
+        return 0
+
+# statuses pushed in by another component (ie a streaming listener or a webhook endpoint)
+class QueueSource:
+    def __init__(self, batch_size=200, interval=1):
+        self.statuses = queue.Queue()
+        self.batch_size = batch_size
+        self.interval = interval
+
+    def push(self, status):
+        self.statuses.put(status)
+
+    def batches(self, since_id):
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    status = self.statuses.get_nowait()
+                except queue.Empty:
+                    break
+                if (not since_id) or (status.id > since_id):
+                    batch.append(status)
+
+            if not batch:
+                return
+            yield sorted(batch, key=lambda s: s.id)
+
+    def next_interval(self, processed):
+        return self.interval
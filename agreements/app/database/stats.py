@@ -0,0 +1,141 @@
+import logging
+from tinydb.database import Document
+
+from . import storage
+from .metadata import Metadata
+from .records import AccountRecord, ContractRecord, AgreementRecord
+from .indexes import OPEN_STATES
+from .archive import ARCHIVE_TABLE
+
+CONTRACT_TYPES = ['like', 'retweet']
+
+# totals of the economy kept up to date as balances, contracts and agreements change, so they never need a full scan
+# kept in memory and written to the stats table (doc 1) once per transaction, right before it commits
+class Stats:
+    version = 2
+
+    def __init__(self, db):
+        self.db = db
+        self.table = db.table('stats')
+        self.logger = logging.getLogger(".".join([self.__module__, type(self).__name__]))
+        self.dirty = False
+
+        doc = self.table.get(doc_id=1)
+        if doc and doc.get('stats_version') == self.version:
+            self.values = copy(doc)
+        else:
+            self.rebuild()
+
+    @staticmethod
+    def empty():
+        return {
+            # sum of all account balances (including the engine's)
+            'tsc_in_circulation': 0,
+            # TSC held as collateral by open agreements
+            'collateral_locked': 0,
+            # TSC paid to the engine as tax
+            'tax_revenue': 0,
+            # live contracts (alive with uses left) and their remaining uses, by type
+            'live_contracts': {contract_type: 0 for contract_type in CONTRACT_TYPES},
+            'live_supply': {contract_type: 0 for contract_type in CONTRACT_TYPES},
+            'executions': 0,
+            # agreements not closed yet (open or disputed)
+            'open_agreements': 0,
+            'upheld_agreements': 0,
+            'broken_agreements': 0,
+            # agreements whose deadline passed before they were ruled on
+            'expired_agreements': 0
+        }
+
+    # recomputes every total with a full scan (only needed once for existing databases)
+    def rebuild(self):
+        self.logger.info('Building economy statistics')
+        values = self.empty()
+
+        engine_id = Metadata(self.db).retrieve('engine_id')
+        for a_id, a_entry in self.db.table('accounts')._read_table().items():
+            if a_id == 0:
+                continue
+            a = AccountRecord.from_doc(a_entry, a_id)
+            values['tsc_in_circulation'] += a.balance
+            # tax payments weren't told apart before, the engine's balance is the closest there is
+            if a_id == engine_id:
+                values['tax_revenue'] = a.balance
+
+        for c_id, c_entry in self.db.table('contracts')._read_table().items():
+            if c_id == 0:
+                continue
+            c = ContractRecord.from_doc(c_entry, c_id)
+            values['executions'] += len(c.executed_on)
+            if (c.state == 'alive') and (c.count > 0):
+                values['live_contracts'][c.type] += 1
+                values['live_supply'][c.type] += c.count
+
+        # archived contracts are all used up, only their executions count
+        for c_entry in self.db.table(ARCHIVE_TABLE)._read_table().values():
+            values['executions'] += len(c_entry['executed_on'])
+
+        for a_id, a_entry in self.db.table('agreements')._read_table().items():
+            if a_id == 0:
+                continue
+            a = AgreementRecord.from_doc(a_entry, a_id)
+            if a.state in OPEN_STATES:
+                values['open_agreements'] += 1
+                if a.collateral_type == 'TSC':
+                    values['collateral_locked'] += a.collateral
+            elif a.state == 'expired':
+                values['expired_agreements'] += 1
+            # agreements settled when they expired only have the ruling of the party that voted
+            elif (a.creator_ruling or a.member_ruling) in ('upheld', 'broken'):
+                values[f'{a.creator_ruling or a.member_ruling}_agreements'] += 1
+
+        values['stats_version'] = self.version
+        self.values = values
+        self.dirty = True
+        self.flush()
+
+    def get(self):
+        return copy(self.values)
+
+    # adds amount to a total, written when the current transaction commits
+    def add(self, name, amount, contract_type=None):
+        if contract_type is None:
+            self.values[name] += amount
+        else:
+            self.values[name][contract_type] += amount
+
+        if not self.dirty:
+            self.dirty = True
+            self.db.before_commit(self.flush)
+
+    # change in the number of live contracts of a type and in their remaining uses
+    def supply_changed(self, contract_type, contracts, uses):
+        self.add('live_contracts', contracts, contract_type)
+        self.add('live_supply', uses, contract_type)
+
+    # a balance change of the given kind (as recorded in the balance journal)
+    def balance_changed(self, amount, kind):
+        self.add('tsc_in_circulation', amount)
+        if kind == 'tax':
+            self.add('tax_revenue', amount)
+        # collateral leaves a balance when it's locked and comes back to one when it's released or paid out
+        elif kind in ('collateral_lock', 'collateral_release', 'collateral_payout'):
+            self.add('collateral_locked', -amount)
+
+    def flush(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+
+        if self.table.contains(doc_id=1):
+            self.table.update(copy(self.values), doc_ids=[1])
+        else:
+            self.table.insert(Document(copy(self.values), doc_id=1))
+
+# copy of a stats document that shares no nested dicts with it
+def copy(values):
+    return {name: dict(value) if isinstance(value, dict) else value for name, value in values.items()}
+
+# returns the economy statistics of a database
+def economy_stats(db):
+    return storage.derived(db, 'stats', Stats, ['stats', 'accounts', 'contracts', ARCHIVE_TABLE, 'agreements'])
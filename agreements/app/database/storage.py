@@ -0,0 +1,545 @@
+import os
+import json
+import sqlite3
+import threading
+import logging
+import weakref
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+from tinydb import TinyDB
+from tinydb.database import Document
+from tinydb.table import Table
+from tinydb.middlewares import Middleware
+from tinydb.storages import JSONStorage
+
+from .. import metrics
+
+DEFAULT_PATH = 'app/database/db.sqlite3'
+LEGACY_PATH = 'app/database/db.json'
+
+# number of entries kept in the sqlite change log, readers further behind than this reload everything
+CHANGE_LOG_SIZE = 100000
+
+# document fields that get an sqlite expression index, keyed by table name
+INDEXED_FIELDS = {
+    'accounts': ['screen_name'],
+    'contracts': ['user_id', 'state'],
+    'agreements': ['creator_id', 'member_id', 'state'],
+    'statuses': ['user_id', 'parent_id'],
+    'metadata': [],
+    'outbox': ['state'],
+}
+
+# in-memory structures derived from a database (indexes, queues), built on first use and kept per database object
+# as {name: (structure, names of the tables it is derived from)}
+_derived = weakref.WeakKeyDictionary()
+
+# returns the derived structure registered under name, building it from the database if needed
+# tables are the ones it is derived from, it's dropped when a transaction that wrote to one of them is rolled back
+def derived(db, name, build, tables=()):
+    cache = _derived.setdefault(db, {})
+    if name not in cache:
+        cache[name] = (build(db), frozenset(tables))
+    db.mark_used(name)
+    return cache[name][0]
+
+# drops derived structures of a database, they will be rebuilt from the stored data on next use
+# all of them, or only the ones derived from one of tables and the ones named in names
+def invalidate(db, tables=None, names=()):
+    if tables is None:
+        _derived.pop(db, None)
+        return
+
+    cache = _derived.get(db, {})
+    for name, (_, sources) in list(cache.items()):
+        if (name in names) or (sources & tables):
+            del cache[name]
+
+# read only databases are opened without creating the file (ie by the web process, which never writes)
+def open_database(path=DEFAULT_PATH, readonly=False):
+    if path.endswith('.json'):
+        if readonly:
+            return JSONDB(path, storage=BufferedStorage(JSONStorage), access_mode='r')
+        return JSONDB(path, indent=4, storage=BufferedStorage(JSONStorage))
+    else:
+        return SQLiteDB(path, readonly)
+
+# whether the engine has set up the database at path, its metadata document is only written once the database is
+# created or fully migrated (migrations are imported into another file and renamed into place)
+def initialized(path=DEFAULT_PATH):
+    if not os.path.exists(path):
+        return False
+    db = open_database(path, readonly=True)
+    try:
+        return db.table('metadata').get(doc_id=1) is not None
+    finally:
+        db.close()
+
+# returns the full contents of a database as {table: {doc_id: doc}} with string ids, matching the tinydb json layout
+def read_tables(db):
+    if isinstance(db, TinyDB):
+        return db.storage.read() or {}
+
+    return {
+        name: {str(doc_id): doc for doc_id, doc in db.table(name)._read_table().items()}
+        for name in db.tables()
+    }
+
+# converts a simple tinydb equality query (where('field') == value) into an sql clause, returns None if not possible
+def query_to_sql(cond):
+    hashval = getattr(cond, '_hash', None)
+
+    if (not isinstance(hashval, tuple)) or (len(hashval) != 3) or (hashval[0] != '=='):
+        return None
+
+    path, value = hashval[1], hashval[2]
+    # only plain field names, so the expression matches the one used by the indexes
+    if not all(isinstance(p, str) and p.isidentifier() for p in path):
+        return None
+    if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+        return None
+
+    json_path = '$.' + '.'.join(path)
+    return (f'json_extract(data, \'{json_path}\') = ?', value)
+
+# unit of work shared by both backends: all writes made inside transaction() are committed together in one write,
+# or discarded if an exception is raised, along with the derived in-memory structures that may hold its changes
+class Transactional:
+    def _init_transactions(self):
+        # held for the whole transaction, so other threads never see or write into a half finished unit of work
+        self.lock = threading.RLock()
+        self._depth = 0
+        self._owner = None
+        self._before_commit = []
+        self._after_commit = []
+        # tables written and derived structures handed out during the current transaction
+        self._written = set()
+        self._used = set()
+
+    # whether the calling thread is inside a transaction
+    def in_transaction(self):
+        return (self._depth > 0) and (self._owner == threading.get_ident())
+
+    # nested transactions join the outermost one
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            if self._depth == 0:
+                self._begin()
+                self._owner = threading.get_ident()
+                self._written = set()
+                self._used = set()
+            self._depth += 1
+
+            try:
+                yield self
+                # hooks may still write, their changes are committed (or rolled back) with the rest
+                while (self._depth == 1) and self._before_commit:
+                    self._before_commit.pop(0)()
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._rollback()
+                    self._before_commit = []
+                    self._after_commit = []
+                    # structures handed out during the transaction may have been changed before (or without) a write
+                    # to the tables they're derived from, the ones left alone stay in memory
+                    invalidate(self, self._written, self._used)
+                raise
+
+            self._depth -= 1
+            if self._depth == 0:
+                self._commit()
+                hooks, self._after_commit = self._after_commit, []
+                for hook in hooks:
+                    hook()
+
+    # records that a table was written, done by the tables themselves
+    def mark_written(self, table_name):
+        if self.in_transaction():
+            self._written.add(table_name)
+
+    # records that a derived structure was handed out, done by derived()
+    def mark_used(self, name):
+        if self.in_transaction():
+            self._used.add(name)
+
+    # runs fn right before the current transaction is committed (right away if there is no transaction)
+    def before_commit(self, fn):
+        if self.in_transaction():
+            self._before_commit.append(fn)
+        else:
+            fn()
+
+    # runs fn once the current transaction is committed (right away if there is no transaction)
+    def after_commit(self, fn):
+        if self.in_transaction():
+            self._after_commit.append(fn)
+        else:
+            fn()
+
+# storage middleware that keeps writes in memory during a transaction and writes them to the file on commit
+class BufferedStorage(Middleware):
+    def __init__(self, storage_cls=JSONStorage):
+        super().__init__(storage_cls)
+        self.lock = threading.RLock()
+        self.buffering = False
+        self.cache = None
+
+    def read(self):
+        if self.buffering:
+            if self.cache is None:
+                self.cache = self.storage.read() or {}
+            return self.cache
+        return self.storage.read()
+
+    def write(self, data):
+        if self.buffering:
+            self.cache = data
+        else:
+            self.storage.write(data)
+
+    def begin(self):
+        self.buffering = True
+        self.cache = None
+
+    def commit(self):
+        if self.cache is not None:
+            self.storage.write(self.cache)
+            # the whole file is rewritten
+            metrics.record_write('*', self.storage._handle.tell())
+        self.buffering = False
+        self.cache = None
+
+    def rollback(self):
+        self.buffering = False
+        self.cache = None
+
+# tinydb table whose read-modify-write cycles hold the database lock, so other threads can't interleave with them
+class LockedTable(Table):
+    def _read_table(self):
+        with self._storage.lock:
+            table = super()._read_table()
+        metrics.record_read(self.name, len(table))
+        return table
+
+    # bytes are counted when the file is written (see BufferedStorage.commit)
+    def _update_table(self, updater):
+        with self._storage.lock:
+            super()._update_table(updater)
+            self._storage.db.mark_written(self.name)
+        metrics.record_write(self.name, 0)
+
+    # returns the documents with the given ids that still exist, keyed by id (the table is read once for all of them)
+    def get_many(self, doc_ids):
+        table = self._read_table()
+        return {doc_id: Document(table[doc_id], doc_id) for doc_id in doc_ids if doc_id in table}
+
+    # documents with ids greater than after, in id order, at most limit of them (the json file is read as a whole)
+    def page(self, after, limit):
+        table = self._read_table()
+        doc_ids = sorted(doc_id for doc_id in table if doc_id > after)[:limit]
+        return [Document(table[doc_id], doc_id) for doc_id in doc_ids]
+
+# tinydb database with transaction support, the whole json file is written once per transaction
+class JSONDB(TinyDB, Transactional):
+    table_class = LockedTable
+
+    def __init__(self, path, **kwargs):
+        super().__init__(path, **kwargs)
+        self.path = path
+        self._init_transactions()
+        self.lock = self.storage.lock
+        # tables report their writes through the storage they share
+        self.storage.db = self
+
+    def _begin(self):
+        self.storage.begin()
+
+    def _commit(self):
+        self.storage.commit()
+
+    def _rollback(self):
+        self.storage.rollback()
+        for table in self._tables.values():
+            table.clear_cache()
+            table._next_id = None
+
+# database stored in sqlite, one table per tinydb table with each document kept as a json row
+class SQLiteDB(Transactional):
+    def __init__(self, path=DEFAULT_PATH, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self.logger = logging.getLogger(".".join([self.__module__, type(self).__name__]))
+        # connection is shared between threads (scheduler, outbound workers), access is serialized by the lock
+        self._init_transactions()
+        self._tables = {}
+        if readonly:
+            # fails instead of creating the file, and leaves the tables to the engine
+            uri = 'file:' + pathname2url(os.path.abspath(path)) + '?mode=ro'
+            self.conn = sqlite3.connect(uri, uri=True, isolation_level=None, check_same_thread=False)
+            return
+
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        # every insert, update and delete is recorded here so readers can catch up incrementally
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS "_changes" (rev INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT NOT NULL, doc_id INTEGER NOT NULL)')
+
+    def _begin(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+
+    def _commit(self):
+        self.conn.execute('COMMIT')
+
+    def _rollback(self):
+        self.conn.execute('ROLLBACK')
+        # tables created during the transaction no longer exist
+        self._tables = {}
+
+    def table(self, name):
+        if name not in self._tables:
+            self._tables[name] = SQLiteTable(self, name)
+        return self._tables[name]
+
+    def tables(self):
+        rows = self.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' AND name NOT LIKE '\\_%' ESCAPE '\\'")
+        return {row[0] for row in rows}
+
+    # records that a document changed, old entries are trimmed every so often
+    def log_change(self, table_name, doc_id):
+        self.mark_written(table_name)
+        with self.lock:
+            rev = self.conn.execute('INSERT INTO "_changes" (tbl, doc_id) VALUES (?, ?)', (table_name, doc_id)).lastrowid
+            if rev % 1000 == 0:
+                self.conn.execute('DELETE FROM "_changes" WHERE rev <= ?', (rev - CHANGE_LOG_SIZE,))
+
+    # latest change log revision, changes whenever any document is written
+    def revision(self):
+        return self.execute('SELECT COALESCE(MAX(rev), 0) FROM "_changes"')[0][0]
+
+    # returns (table, doc_id) pairs changed after rev, or None if the log no longer reaches back that far
+    def changes_since(self, rev):
+        oldest = self.execute('SELECT MIN(rev) FROM "_changes"')[0][0]
+        if (oldest is not None) and (oldest > rev + 1):
+            return None
+        return [(tbl, doc_id) for tbl, doc_id in self.execute(
+            'SELECT tbl, doc_id FROM "_changes" WHERE rev > ? ORDER BY rev', (rev,))]
+
+    # read only transaction, everything read inside sees the same committed state
+    @contextmanager
+    def snapshot(self):
+        with self.lock:
+            if self.in_transaction():
+                yield self
+                return
+
+            self.conn.execute('BEGIN')
+            try:
+                yield self
+            finally:
+                self.conn.execute('COMMIT')
+
+    def drop_table(self, name):
+        with self.lock:
+            self.conn.execute(f'DROP TABLE IF EXISTS "{name}"')
+            self._tables.pop(name, None)
+
+    def drop_tables(self):
+        for name in self.tables():
+            self.drop_table(name)
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            try:
+                return self.conn.execute(sql, params).fetchall()
+            except sqlite3.OperationalError as e:
+                # tables the engine hasn't created yet read as empty
+                if self.readonly and str(e).startswith('no such table'):
+                    return []
+                raise
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# single table of an sqlite database, implements the subset of the tinydb table api used by the app
+class SQLiteTable:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+        self._create()
+
+    def _create(self):
+        if self.db.readonly:
+            return
+        with self.db.lock:
+            self.db.conn.execute(
+                f'CREATE TABLE IF NOT EXISTS "{self.name}" (doc_id INTEGER PRIMARY KEY, data TEXT NOT NULL)')
+            for field in INDEXED_FIELDS.get(self.name, []):
+                self.db.conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS "idx_{self.name}_{field}" ON "{self.name}" (json_extract(data, \'$.{field}\'))')
+
+    def _select(self, where='', params=(), limit=None):
+        limit_clause = f'LIMIT {int(limit)}' if limit is not None else ''
+        rows = self.db.execute(f'SELECT doc_id, data FROM "{self.name}" {where} ORDER BY doc_id {limit_clause}', params)
+        metrics.record_read(self.name, len(rows))
+        return [Document(json.loads(data), doc_id) for doc_id, data in rows]
+
+    def _write(self, doc_id, doc):
+        data = json.dumps(doc)
+        self.db.execute(
+            f'UPDATE "{self.name}" SET data = ? WHERE doc_id = ?',
+            (data, doc_id))
+        self.db.log_change(self.name, doc_id)
+        metrics.record_write(self.name, len(data))
+
+    # returns the documents with the given ids that still exist, keyed by id
+    def get_many(self, doc_ids):
+        docs = {}
+        doc_ids = list(doc_ids)
+        for i in range(0, len(doc_ids), 500):
+            batch = doc_ids[i:i + 500]
+            placeholders = ','.join('?' * len(batch))
+            for doc in self._select(f'WHERE doc_id IN ({placeholders})', batch):
+                docs[doc.doc_id] = doc
+        return docs
+
+    # returns the documents matching a query, using an index when the query is a simple equality check
+    def _matching(self, cond):
+        translated = query_to_sql(cond)
+        if translated:
+            clause, value = translated
+            candidates = self._select(f'WHERE {clause}', (value,))
+        else:
+            candidates = self._select()
+
+        # sql only narrows the candidates, the query itself has the final say
+        return [doc for doc in candidates if cond(doc)]
+
+    # documents with ids greater than after, in id order, at most limit of them (a primary key range scan)
+    def page(self, after, limit):
+        return self._select('WHERE doc_id > ?', (after,), limit)
+
+    def insert(self, document):
+        if isinstance(document, Document):
+            doc_id = document.doc_id
+        else:
+            rows = self.db.execute(f'SELECT MAX(doc_id) FROM "{self.name}"')
+            doc_id = (rows[0][0] or 0) + 1
+
+        data = json.dumps(dict(document))
+        try:
+            self.db.execute(
+                f'INSERT INTO "{self.name}" (doc_id, data) VALUES (?, ?)',
+                (doc_id, data))
+        except sqlite3.IntegrityError:
+            raise AssertionError(f'doc_id {doc_id} already exists')
+        self.db.log_change(self.name, doc_id)
+        metrics.record_write(self.name, len(data))
+
+        return doc_id
+
+    def insert_multiple(self, documents):
+        return [self.insert(document) for document in documents]
+
+    def get(self, cond=None, doc_id=None):
+        if doc_id is not None:
+            docs = self._select('WHERE doc_id = ?', (doc_id,))
+        elif cond is not None:
+            docs = self._matching(cond)
+        else:
+            raise RuntimeError('You have to pass either cond or doc_id')
+
+        return docs[0] if docs else None
+
+    def contains(self, cond=None, doc_id=None):
+        if doc_id is not None:
+            metrics.record_read(self.name)
+            return bool(self.db.execute(f'SELECT 1 FROM "{self.name}" WHERE doc_id = ?', (doc_id,)))
+        elif cond is not None:
+            return len(self._matching(cond)) > 0
+        else:
+            raise RuntimeError('You have to pass either cond or doc_id')
+
+    def search(self, cond):
+        return self._matching(cond)
+
+    def all(self):
+        return self._select()
+
+    def count(self, cond):
+        return len(self._matching(cond))
+
+    def update(self, fields, cond=None, doc_ids=None):
+        with self.db.lock:
+            if doc_ids is not None:
+                docs = []
+                for doc_id in doc_ids:
+                    doc = self.get(doc_id=doc_id)
+                    if doc is None:
+                        raise KeyError(doc_id)
+                    docs.append(doc)
+            elif cond is not None:
+                docs = self._matching(cond)
+            else:
+                docs = self._select()
+
+            for doc in docs:
+                if callable(fields):
+                    fields(doc)
+                else:
+                    doc.update(fields)
+                self._write(doc.doc_id, doc)
+
+        return [doc.doc_id for doc in docs]
+
+    def upsert(self, document, cond):
+        updated = self.update(document, cond)
+        if updated:
+            return updated
+        return [self.insert(document)]
+
+    def remove(self, cond=None, doc_ids=None):
+        with self.db.lock:
+            if doc_ids is not None:
+                removed = list(doc_ids)
+            elif cond is not None:
+                removed = [doc.doc_id for doc in self._matching(cond)]
+            else:
+                raise RuntimeError('Use truncate() to remove all documents')
+
+            for doc_id in removed:
+                self.db.execute(f'DELETE FROM "{self.name}" WHERE doc_id = ?', (doc_id,))
+                self.db.log_change(self.name, doc_id)
+                metrics.record_write(self.name, 0)
+
+        return removed
+
+    def truncate(self):
+        with self.db.lock:
+            for (doc_id,) in self.db.execute(f'SELECT doc_id FROM "{self.name}"'):
+                self.db.log_change(self.name, doc_id)
+            self.db.execute(f'DELETE FROM "{self.name}"')
+
+    def clear_cache(self):
+        pass
+
+    # returns table as a dict of doc_id -> document, ordered by doc_id (same as the tinydb internal)
+    def _read_table(self):
+        return {doc.doc_id: doc for doc in self._select()}
+
+    def __len__(self):
+        rows = self.db.execute(f'SELECT COUNT(*) FROM "{self.name}"')
+        return rows[0][0] if rows else 0
+
+    def __iter__(self):
+        return iter(self._select())
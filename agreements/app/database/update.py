@@ -1,50 +1,127 @@
 import logging
+import itertools
+import traceback
 import tweepy
 
 from .. import core
-from .parser import Parser
+from .parser import Parser, VOTES
 from .metadata import Metadata
+from .sources import PollingSource
+from .shards import ShardedProcessor
+from . import commands
 
 logger = logging.getLogger(__name__)
 
-def run():
+def run(source=None, workers=1, parser=None):
     # core.db.drop_tables() # clears database
 
     meta = Metadata(core.db)
-    parser = Parser(core.db, core.api)
+    if parser is None:
+        parser = Parser(core.db, core.api)
 
-    last_status_parsed = meta.retrieve('last_status_parsed')
+    if source is None:
+        source = PollingSource(core.api)
 
-    new_statuses = []
+    last_status_parsed = meta.retrieve('last_status_parsed')
+    num_processed = 0
 
     # logger.info(f'Update started at status #{last_status_parsed}')
 
-    # collects new statuses in reverse chronological order
-    for status in tweepy.Cursor(
-        core.api.mentions_timeline, 
-        tweet_mode="extended", # needed to get full text for longer tweets
-        since_id=last_status_parsed, # won't iterate through tweets already in database
-        count=200
-    ).items():
-        new_statuses.append(status)
+    # statuses are processed in chronological order as each batch arrives
+    for batch in source.batches(last_status_parsed):
+        if workers > 1:
+            process_sharded(batch, meta, parser, last_status_parsed, workers)
+        else:
+            process_batch(batch, meta, parser, last_status_parsed)
+        num_processed += len(batch)
+
+    return (num_processed, last_status_parsed)
+
+# authors are already known, other mentioned users (ie send recipients) are resolved in batches up front
+def prefetch(batch):
+    for status in batch:
+        core.api.remember_user(status.user)
+    core.api.prefetch_users(
+        mention['id']
+        for status in batch
+        for mention in status.entities['user_mentions'][1:]
+    )
+
+def process_batch(batch, meta, parser, last_status_parsed):
+    prefetch(batch)
+
+    # consecutive votes are settled together
+    runs = itertools.groupby(zip(batch, commands.parse_many(batch)), key=lambda pair: pair[1].verb in VOTES)
+    for is_vote, run in runs:
+        run = list(run)
+        if is_vote and (len(run) > 1) and process_votes(run, meta, parser, last_status_parsed):
+            continue
+
+        for status, command in run:
+            process_status(status, command, meta, parser, last_status_parsed)
+
+def process_status(status, command, meta, parser, last_status_parsed):
+    try:
+        logger.info('')
+        logger.info(f'NEW STATUS: [{status.id_str}] -> {status.full_text}')
+
+        parser.resolve(command)
+        # the status and the checkpoint are committed together in a single write
+        with core.db.transaction():
+            parser.parse(status, command)
+            if status.id > last_status_parsed:
+                meta.update('last_status_parsed', status.id)
+        return
 
+    except tweepy.error.TweepError as error:
+        logger.warn(f'Tweepy error while parsing status, changes rolled back: {error.api_code}')
+
+    # updates last status id -> next mentions timeline won't see already parsed tweets
+    # (only statuses twitter refused are skipped, any other error is raised once the changes are rolled back and the
+    # status is parsed again on the next update)
+    if status.id > last_status_parsed:
+        meta.update('last_status_parsed', status.id)
+
+# settles a run of votes and checkpoints past them in a single transaction
+# returns False if any of them failed, nothing is changed then and the votes are parsed one by one instead
+def process_votes(run, meta, parser, last_status_parsed):
+    for status, _ in run:
+        logger.info('')
+        logger.info(f'NEW STATUS: [{status.id_str}] -> {status.full_text}')
+
+    statuses, parsed = zip(*run)
+    try:
+        with core.db.transaction():
+            parser.parse_votes(statuses, parsed)
+            newest = max(status.id for status in statuses)
+            if newest > last_status_parsed:
+                meta.update('last_status_parsed', newest)
+        return True
+
+    except Exception:
+        logger.warn(f'Error while settling {len(run)} votes together, changes rolled back:\n{traceback.format_exc()}')
+        return False
+
+# processes statuses from different accounts concurrently, statuses sharing an account stay in order
+def process_sharded(batch, meta, parser, last_status_parsed, workers):
+    prefetch(batch)
+
+    def process(status, command):
+        # a status already in the database was parsed before the checkpoint caught up (ie before a crash)
+        if parser.statuses.contains(doc_id=status.id):
+            logger.info(f'Skipping already parsed status [{status.id_str}]')
+            return
 
-    # iterates through statuses in chronological order
-    for status in reversed(new_statuses):
         try:
-            logger.info('')
             logger.info(f'NEW STATUS: [{status.id_str}] -> {status.full_text}')
-            parser.parse(status)
+            # only the database changes are serialized, twitter lookups of different workers overlap
+            parser.resolve(command)
+            parser.parse(status, command)
         except tweepy.error.TweepError as error:
-            if error.api_code == 385:
-                logger.warn('Cannot reply to tweet')
-            elif error.api_code == 187:
-                logger.warn('Duplicate tweet')
-            else:
-                logger.warn(f'Unknown tweepy error: {error.api_code}')
-
-        # updates last status id -> next mentions timeline won't see already parsed tweets
+            logger.warn(f'Tweepy error while parsing status, changes rolled back: {error.api_code}')
+
+    def checkpoint(status):
         if status.id > last_status_parsed:
             meta.update('last_status_parsed', status.id)
-    
-    return (len(new_statuses), last_status_parsed)
+
+    ShardedProcessor(core.db, process, checkpoint, workers).run(batch)
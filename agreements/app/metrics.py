@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# where the engine writes its metrics for the web server to serve (relative to the working directory, like last.log)
+DEFAULT_PATH = 'metrics.prom'
+
+# upper bounds of histogram buckets, in seconds for timings
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# upper bounds for histograms of counts (ie contracts scanned, rows written per status)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+# formats a sample line of the prometheus text format
+def sample(name, labels, value):
+    if labels:
+        pairs = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+        name = f'{name}{{{pairs}}}'
+    return f'{name} {value:g}' if isinstance(value, float) else f'{name} {value}'
+
+# base of all metrics, values are kept per combination of labels
+class Metric:
+    kind = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def lines(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.kind}'
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in sorted(values):
+            yield from self.samples(labels, value)
+
+    def samples(self, labels, value):
+        yield sample(self.name, labels, value)
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=TIME_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # one count per bucket plus the overflow (+Inf) bucket, then the sum
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0]
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self, labels, counts):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            total += count
+            yield sample(f'{self.name}_bucket', labels + (('le', bound),), total)
+        yield sample(f'{self.name}_sum', labels, float(counts[-1]))
+        yield sample(f'{self.name}_count', labels, total)
+
+# metrics of a process, rendered in the prometheus text format
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        return self.add(Counter(name, help))
+
+    def gauge(self, name, help):
+        return self.add(Gauge(name, help))
+
+    def histogram(self, name, help, buckets=TIME_BUCKETS):
+        return self.add(Histogram(name, help, buckets))
+
+    def render(self):
+        return '\n'.join(line for metric in self.metrics for line in metric.lines()) + '\n'
+
+    # replaces the file at path with the current metrics (ie for the web server of another process to serve)
+    def write(self, path=DEFAULT_PATH):
+        with open(path + '.tmp', 'w') as f:
+            f.write(self.render())
+        os.replace(path + '.tmp', path)
+
+registry = Registry()
+
+parse_seconds = registry.histogram('agreements_parse_seconds', 'Time spent parsing a status, by command')
+db_reads = registry.counter('agreements_db_reads_total', 'Documents read from the database, by table')
+db_writes = registry.counter('agreements_db_writes_total', 'Documents written to the database, by table')
+db_bytes_written = registry.counter('agreements_db_bytes_written_total', 'Bytes of documents written to the database, by table')
+status_db_reads = registry.histogram('agreements_status_db_reads', 'Documents read while parsing a status', COUNT_BUCKETS)
+status_db_writes = registry.histogram('agreements_status_db_writes', 'Documents written while parsing a status', COUNT_BUCKETS)
+status_db_bytes_written = registry.histogram(
+    'agreements_status_db_bytes_written', 'Bytes of documents written while parsing a status',
+    (0, 256, 1024, 4096, 16384, 65536, 262144, 1048576))
+api_calls = registry.counter('agreements_api_calls_total', 'Requests made to the twitter api, by endpoint')
+api_errors = registry.counter('agreements_api_errors_total', 'Requests to the twitter api that raised, by endpoint')
+api_seconds = registry.histogram('agreements_api_seconds', 'Latency of twitter api requests, by endpoint')
+outbox_depth = registry.gauge('agreements_outbox_depth', 'Replies queued in the outbox and not sent yet')
+contract_scan_length = registry.histogram(
+    'agreements_contract_scan_length', 'Contracts taken from the execution queue by one execute command', COUNT_BUCKETS)
+
+# trace of the status being parsed by the current thread, None outside of Parser.parse
+local = threading.local()
+
+# file the traces of parsed statuses are appended to (one json object per line), None to not keep them
+trace_path = None
+trace_lock = threading.Lock()
+
+def trace_to(path):
+    global trace_path
+    trace_path = path
+
+# adds amount to a field of the current status trace, if any
+def add_to_trace(field, amount=1):
+    trace = getattr(local, 'trace', None)
+    if trace is not None:
+        trace[field] = trace.get(field, 0) + amount
+
+def record_read(table, count=1):
+    db_reads.inc(count, table=table)
+    add_to_trace('db_reads', count)
+
+def record_write(table, size):
+    db_writes.inc(table=table)
+    db_bytes_written.inc(size, table=table)
+    add_to_trace('db_writes')
+    add_to_trace('db_bytes_written', size)
+
+# times the parsing of a status and collects what it did, the trace is written to the trace log if there is one
+@contextmanager
+def trace_status(status_id, command):
+    trace = local.trace = {'status': str(status_id), 'command': command, 'db_reads': 0, 'db_writes': 0, 'db_bytes_written': 0}
+    start = time.perf_counter()
+    try:
+        yield trace
+    except BaseException as error:
+        trace['error'] = type(error).__name__
+        raise
+    finally:
+        local.trace = None
+        trace['seconds'] = round(time.perf_counter() - start, 6)
+
+        parse_seconds.observe(trace['seconds'], command=command)
+        status_db_reads.observe(trace['db_reads'])
+        status_db_writes.observe(trace['db_writes'])
+        status_db_bytes_written.observe(trace['db_bytes_written'])
+
+        if trace_path is not None:
+            line = json.dumps(trace) + '\n'
+            with trace_lock:
+                with open(trace_path, 'a') as f:
+                    f.write(line)
+
+# api method that records the number and latency of the requests it makes
+# other attributes are passed through, so tweepy.Cursor still finds what it needs (ie pagination_mode)
+class TimedMethod:
+    def __init__(self, endpoint, method):
+        self.endpoint = endpoint
+        self.method = method
+
+    def __getattr__(self, name):
+        return getattr(self.method, name)
+
+    def __call__(self, *args, **kwargs):
+        # tweepy asks for the method description this way, no request is made
+        if kwargs.get('create'):
+            return self.method(*args, **kwargs)
+
+        api_calls.inc(endpoint=self.endpoint)
+        add_to_trace('api_calls')
+        start = time.perf_counter()
+        try:
+            return self.method(*args, **kwargs)
+        except Exception:
+            api_errors.inc(endpoint=self.endpoint)
+            raise
+        finally:
+            api_seconds.observe(time.perf_counter() - start, endpoint=self.endpoint)
+
+# wraps a tweepy api so every request it makes is counted and timed
+class TimedAPI:
+    def __init__(self, api):
+        self.api = api
+
+    def __getattr__(self, name):
+        attr = getattr(self.api, name)
+        if callable(attr) and not name.startswith('_'):
+            return TimedMethod(name, attr)
+        return attr
@@ -4,6 +4,10 @@ import tweepy
 from tinydb.database import Document
 
 from .. import core
+from ..database.records import AccountRecord, AgreementRecord
+from ..database.ledger import balance_ledger
+from ..database.executions import execution_log
+from ..database.stats import economy_stats
 from . import contract, agreement
 
 # represents a single account
@@ -32,17 +36,17 @@ class Account:
         else:
             self.logger.warn('Invalid parameter when creating Account')
 
-        self.screen_name = self.get_entry()['screen_name']
+        self.screen_name = self.get_entry().screen_name
 
         # greeting message for new users (excluding the agreement engine)
-        if new_user and (self.id != core.api.me().id):
+        if new_user and (self.id != core.engine_id):
             self.logger.info(f"Welcoming {self.screen_name}")
             message = f"@{self.screen_name} Welcome to Agreement Engine! Check out https://agreements.metagov.org/about and https://agreements.metagov.org/help to learn about agreements and how to make them!"
             core.emit(message)
 
-    # returns dict from db
+    # returns account record from db
     def get_entry(self):
-        return self.account_table.get(doc_id=self.id)
+        return AccountRecord.load(self.account_table, self.id)
 
     # checks if user id is already in db
     def in_database(self):
@@ -51,26 +55,22 @@ class Account:
     # generates a new account
     def generate(self, user):
         # initializing default account data
-        entry = {
-            'full_name': user.name,
-            'screen_name': user.screen_name,
-            'balance': '0',
-            'contracts': [],
-            'likes': [],
-            'retweets': []
-        }
+        entry = AccountRecord(
+            full_name=user.name,
+            screen_name=user.screen_name,
+            balance=0,
+            contracts=[]
+        )
 
         # inserting account data into table
         self.account_table.insert(Document(
-            entry, 
+            entry.to_doc(), 
             doc_id=self.id
         ))
 
         # updating number of accounts
         def increment_num_accounts(doc):
-            num_accounts = int(doc['num_accounts'])
-            num_accounts += 1
-            doc['num_accounts'] = str(num_accounts)
+            doc['num_accounts'] += 1
         self.account_table.update(
             increment_num_accounts, 
             doc_ids=[0]
@@ -78,28 +78,33 @@ class Account:
 
         self.logger.info(f'New account created for @{user.screen_name}!')
     
-    # modifies account balance
-    def change_balance(self, user_id, amount):
+    # modifies account balance, kind and ref (the status causing it) are recorded in the balance journal
+    def change_balance(self, user_id, amount, kind, ref=None):
+        # journal is opened before the balance changes, the first time it starts from the balances in the database
+        ledger = balance_ledger(core.db)
+
         # passed into tiny db update function, adds to balance
         def add_to_balance(doc):
-            doc['balance'] = str(int(doc['balance']) + amount)
+            doc['balance'] += amount
         
         # updates account balance
         self.account_table.update(
             add_to_balance,
             doc_ids=[user_id]
-        )        
+        )
+        ledger.record(user_id, amount, kind, ref)
+        economy_stats(core.db).balance_changed(amount, kind)
     
     def check_balance(self):
-        return int(self.account_table.get(doc_id=self.id)['balance'])
+        return self.get_entry().balance
     
-    def send_current_balance(self, status):
+    def send_current_balance(self, status, command):
         self.logger.info('Sending current balance')
 
         message = f'@{self.screen_name} ' + f'You currently have {self.check_balance()} TSC in your account.'
         core.emit(message, status.id)
         
-    def send_current_likes(self, status):
+    def send_current_likes(self, status, command):
         likes = contract.Pool().count_user_contracts('like', self.id)
 
         self.logger.info('Sending active like contract count')
@@ -107,7 +112,7 @@ class Account:
         message = f'@{self.screen_name} ' + f'You currently have {likes} active like contracts.'
         core.emit(message, status.id)
 
-    def send_current_retweets(self, status):
+    def send_current_retweets(self, status, command):
         retweets = contract.Pool().count_user_contracts('retweet', self.id)
 
         self.logger.info('Sending active retweet contract count')
@@ -117,19 +122,17 @@ class Account:
 
     # checks whether a user has had a like contract called in on a status
     def has_liked(self, status_id):
-        likes = self.get_entry()['likes']
-        return str(status_id) in likes
+        return int(status_id) in execution_log(core.db).executed(self.id, 'like')
     
     # checks whether a user has had a retweet contract called in on a status
     def has_retweeted(self, status_id):
-        retweets = self.get_entry()['retweets']
-        return str(status_id) in retweets
+        return int(status_id) in execution_log(core.db).executed(self.id, 'retweet')
 
-    def create_agreement(self, status):
+    def create_agreement(self, status, command):
         self.logger.info(f'Generating new agreement for {self.screen_name} [{self.id}]')
 
         new_agreement = agreement.Agreement(status)
-        new_agreement.generate(self)
+        new_agreement.generate(self, command)
 
         if new_agreement.contract_limited:
             update_message = f'This agreement could not be created because you have reached your contract limit.'
@@ -145,8 +148,8 @@ class Account:
             if not a_entry:
                 self.logger.warn("Couldn't get agreement from database (this shouldn't happen)")
                 return False
-            collateral = a_entry['collateral']
-            c_type = a_entry['collateral_type']
+            collateral = a_entry.collateral
+            c_type = a_entry.collateral_type
 
             if c_type == 'TSC':
                 update_message = f'Your agreement staking {collateral} TSC has been created!'
@@ -158,29 +161,31 @@ class Account:
         message = f'@{self.screen_name} ' + update_message
         core.emit(message, status.id)
 
-    def vote_upheld(self, status):
-        original_agreement = agreement.Agreement(status.in_reply_to_status_id)
+    def vote_upheld(self, status, command, entry=None):
+        return self.vote(status, 'upheld', entry)
 
-        if original_agreement.valid:
-            original_agreement.vote(self, 'upheld')
-        else:
-            self.logger.warn("Invalid agreement id, entry not found")
-    
-    def vote_broken(self, status):
-        original_agreement = agreement.Agreement(status.in_reply_to_status_id)
+    def vote_broken(self, status, command, entry=None):
+        return self.vote(status, 'broken', entry)
 
-        if original_agreement.valid:
-            original_agreement.vote(self, 'broken')
-        else:
+    # votes on the agreement being replied to, entry is the agreement if it was already loaded
+    def vote(self, status, ruling, entry=None):
+        agreement_id = status.in_reply_to_status_id
+        if (entry is None) and agreement_id:
+            entry = AgreementRecord.load(core.db.table('agreements'), agreement_id)
+
+        if entry is None:
             self.logger.warn("Invalid agreement id, entry not found")
+            return False
+
+        return agreement.Agreement(entry).vote(self, ruling, entry)
 
     # generates a new contract
-    def create_contract(self, status):
+    def create_contract(self, status, command):
         self.logger.info(f'Generating new contract for {self.screen_name} [{self.id}]')
 
         # created contract object
         new_contract = contract.Contract(status)
-        total_value = new_contract.generate()
+        total_value = new_contract.generate(command)
 
         if total_value == False:
             self.logger.warn('Exiting invalid contract')
@@ -191,8 +196,8 @@ class Account:
             to_pay_user = total_value - to_pay_engine
 
             # paid out to user and agreement engine
-            self.change_balance(core.engine_id, to_pay_engine)
-            self.change_balance(self.id, to_pay_user)
+            self.change_balance(core.engine_id, to_pay_engine, 'tax', status.id)
+            self.change_balance(self.id, to_pay_user, 'payout', status.id)
             self.logger.info(f'Paid {self.screen_name} [{self.id}] {to_pay_user} TSC ({to_pay_engine} withheld)')
 
             # adds contract id to account list
@@ -211,27 +216,23 @@ class Account:
         if new_contract.oversized:
             update_message = f'You have reached your contract limit and cannot generate new ones until they have been used up.'
         elif new_contract.resized:
-            update_message = f'Your request exceeded your {c_entry["type"]} contract limit so it was resized. Your account has been credited {to_pay_user} TSC for this {c_entry["count"]} {c_entry["type"]} contract.'
+            update_message = f'Your request exceeded your {c_entry.type} contract limit so it was resized. Your account has been credited {to_pay_user} TSC for this {c_entry.count} {c_entry.type} contract.'
         elif new_contract.no_followers:
             update_message = f'Your account has 0 followers, so contracts cannot be generated.'
         else:
-            update_message = f'Successfully generated! Your account has been credited {to_pay_user} TSC for this {c_entry["count"]} {c_entry["type"]} contract.'
+            update_message = f'Successfully generated! Your account has been credited {to_pay_user} TSC for this {c_entry.count} {c_entry.type} contract.'
 
         message = f'@{self.screen_name} ' + update_message
         core.emit(message, status.id)
 
     # executes contracts on a requested post for a certain amount of TSC
-    def execute_contracts(self, status):
+    def execute_contracts(self, status, command):
         self.logger.info(f'Executing contracts for {self.screen_name} [{self.id}]')
 
-        text = status.full_text 
-        arg = text[text.find(core.Consts.kwords['exe']):].split()[1]
-
-        # extracting amount to spend
-        try:
-            to_spend = int(arg)
-        except ValueError:
-            self.logger.warn(f'Could not parse to_spend: "{arg}"')
+        # amount to spend
+        to_spend = command.amount
+        if to_spend is None:
+            self.logger.warn(f'Could not parse to_spend: "{status.full_text}"')
             return False
         
         # executed on the post being replied to (ie reply to post you want to execute contracts on)
@@ -239,7 +240,11 @@ class Account:
 
         self.logger.info(f'New execution request spending {to_spend} TSC on status #{executing_on}')
 
-        if to_spend > self.check_balance():
+        if executing_on is None:
+            self.logger.info(f'Execution request is not a reply')
+
+            update_message = f'Reply to the post you want contracts executed on, your account has not been charged.'
+        elif to_spend > self.check_balance():
             self.logger.info(f'Execution request exceeds balance')
 
             update_message = f'This request exceeds your balance of {self.check_balance()} TSC.'
@@ -249,7 +254,7 @@ class Account:
             executed_count, amount_spent = contract_pool.auto_execute_contracts(self.id, executing_on, to_spend)
 
             # updates balance based on amount actually spent
-            self.change_balance(self.id, -amount_spent)
+            self.change_balance(self.id, -amount_spent, 'execution', status.id)
 
             if executed_count > 0:
                 update_message = f'Executed {executed_count} contracts for {amount_spent} TSC.'
@@ -259,26 +264,20 @@ class Account:
         message = f'@{self.screen_name} ' + update_message
         core.emit(message, status.id)
 
-    def send_tsc(self, status):
+    def send_tsc(self, status, command):
         self.logger.info(f'Sending TSC from {self.screen_name} [{self.id}]')
 
-        text = status.full_text
-        arg = text[text.find(core.Consts.kwords['snd']):].split()[1]
-
-        try:
-            payment = int(arg)
-        except ValueError:
-            self.logger.warn(f'Could not parse payment: "{arg}"')
+        payment = command.amount
+        if payment is None:
+            self.logger.warn(f'Could not parse payment: "{status.full_text}"')
             return False
 
-        users = status.entities['user_mentions']
-
         # sending to which user?
-        if len(users) <= 1:
+        if not command.mentions:
             self.logger.warn('Did not specify users to send to')
             return False
 
-        recipient_id = users[1]['id']
+        recipient_id = command.mentions[0]['id']
         recipient_user = core.api.get_user(recipient_id)
 
         # balance check
@@ -287,10 +286,10 @@ class Account:
             update_message = 'Insufficient balance to send that amount.'
         else:
             # removing from own balance
-            self.change_balance(self.id, -payment)
+            self.change_balance(self.id, -payment, 'transfer', status.id)
             # adding to recipient's balance
             recipient = Account(recipient_user)
-            self.change_balance(recipient.id, payment)
+            self.change_balance(recipient.id, payment, 'transfer', status.id)
             self.logger.info(f'Transferred {payment} from @{self.screen_name} to @{recipient.screen_name}')
 
             update_message = f'Sent {payment} TSC to @{recipient.screen_name}.'
@@ -4,6 +4,11 @@ import tweepy
 from tinydb.database import Document
 
 from .. import core
+from ..database.feed import Feed
+from ..database.records import AgreementRecord, ContractRecord
+from ..database.stats import economy_stats
+from ..database.indexes import agreement_index, OPEN_STATES
+from ..database.deadlines import agreement_deadlines, timestamp, deadline
 from . import contract
 
 class Agreement:
@@ -22,6 +27,10 @@ class Agreement:
                 self.logger.warn('Agreement does not exist, unable to generate (status not provided)')
                 self.valid = False
 
+        # an agreement already loaded from the database (no need to check it exists)
+        elif type(arg) == AgreementRecord:
+            self.id = arg.id
+
         elif type(arg) == tweepy.models.Status:
             status = arg
             self.id = status.id
@@ -32,54 +41,25 @@ class Agreement:
             self.valid = False
 
     def get_entry(self):
-        return self.agreement_table.get(doc_id=self.id)
+        return AgreementRecord.load(self.agreement_table, self.id)
 
     def in_database(self):
         return self.agreement_table.contains(doc_id=self.id)
 
     # generates a new agreement
-    def generate(self, account):
+    # command is the parsed agreement command, with collateral of type TSC, like, retweet, or none
+    def generate(self, account, command):
         text = self.status.full_text
-        
-        state = 'find_command'
-        collateral_size = 0
-        collateral_type = ''
-        # parses command parameters for agreements of type TSC, like, retweet, and none
-        for word in text.split():
-            if state == 'find_command':
-                if word == 'agreement':
-                    state = 'find_size'
-            
-            elif state == 'find_size':
-                if word.isnumeric():
-                    collateral_size = int(word)
-                    collateral_type = 'TSC'
-                    state = 'find_type'
-                else:
-                    collateral_type = 'none'
-                    break
-
-            elif state == 'find_type':
-                if (word == 'like') or (word == 'likes'):
-                    collateral_type = 'like'
-                    break
-                elif (word == 'retweet') or (word == 'retweets'):
-                    collateral_type = 'retweet'
-                    break
-                else:
-                    collateral_type = 'TSC'
-                    break
-        
-        # extracts all users mentioned in tweet
-        users = self.status.entities['user_mentions']
+        collateral_size = command.amount
+        collateral_type = command.unit
 
-        # the first other user becomes the "member" opposite the "creator"
-        if len(users) <= 1:
+        # the first other user mentioned becomes the "member" opposite the "creator"
+        if not command.mentions:
             self.logger.warn('Agreement does not contain other members')
             self.no_members = True
             return False
         else:
-            member = users[1]
+            member = command.mentions[0]
         
         # attempts to pay with existing balance
         if collateral_type == "TSC":
@@ -89,17 +69,15 @@ class Agreement:
                 return False
             else:
                 # removes funds from account balance
-                account.change_balance(account.id, -collateral_size)
+                account.change_balance(account.id, -collateral_size, 'collateral_lock', self.id)
                 self.logger.info(f'Removed {collateral_size} TSC of collateral from the balance of {account.screen_name} [{account.id}]')
 
         # if user is paying with likes or retweets, the contract will only be created if the agreement is broken
         elif (collateral_type == "like") or (collateral_type == "retweet"):
             self.logger.info(f'Generating new contract for {account.screen_name} [{account.id}] (agreement context)')
-                
-            status = core.api.get_status(self.id)
 
             # creates new contract
-            con = contract.Contract(status)
+            con = contract.Contract(self.status)
             total_value = con.complex_generate(collateral_type, collateral_size)
 
             if con.resized or con.oversized:
@@ -108,24 +86,27 @@ class Agreement:
                 return False
             
             # contract will not be activated unless the agreement is broken
-            con.contract_table.update(
-                {'state': 'dead'},
-                doc_ids=[self.id]
-            )
-
-        entry = {
-            "state": "open",
-            "creator_id": str(account.id),
-            "creator_screen_name": account.screen_name,
-            "creator_ruling": "",
-            "member_id": member['id_str'],
-            "member_screen_name": member['screen_name'],
-            "member_ruling": "",
-            "collateral_type": collateral_type,
-            "collateral": str(collateral_size),
-            "created": str(self.status.created_at),
-            "text": text
-        }
+            contract.Pool().kill(self.id)
+
+        # expires after the duration given in the command, or the default timeout
+        created = str(self.status.created_at)
+        expires = deadline(timestamp(created), command.duration, core.Consts.agreement_timeout)
+
+        entry = AgreementRecord(
+            self.id,
+            state="open",
+            creator_id=account.id,
+            creator_screen_name=account.screen_name,
+            creator_ruling="",
+            member_id=member['id'],
+            member_screen_name=member['screen_name'],
+            member_ruling="",
+            collateral_type=collateral_type,
+            collateral=collateral_size,
+            created=created,
+            text=text,
+            deadline=expires
+        ).to_doc()
 
         # adding agreement to db
         self.agreement_table.insert(Document(
@@ -134,57 +115,69 @@ class Agreement:
 
         # updating number of agreements
         def increment_num_agreements(doc):
-            num_agreements = int(doc['num_agreements'])
-            num_agreements += 1
-            doc['num_agreements'] = str(num_agreements)
+            doc['num_agreements'] += 1
         self.agreement_table.update(
             increment_num_agreements, 
             doc_ids=[0]
         )
 
+        # shown on the home page
+        Feed(core.db).push(self.id, entry)
+        economy_stats(core.db).add('open_agreements', 1)
+        agreement_index(core.db).add(self.id, entry)
+        agreement_deadlines(core.db).push(self.id, expires)
+
         self.logger.info(entry)
         
 
-    # adds a ruling vote to the agreement from the member or creator
-    def vote(self, account, ruling):
-        entry = self.get_entry()
+    # adds a ruling vote to the agreement from the member or creator, and settles it once both rulings agree
+    # entry is the agreement if it was already loaded (ie for a batch of votes), it's kept up to date with the vote
+    def vote(self, account, ruling, entry=None):
+        if entry is None:
+            entry = self.get_entry()
 
-        if entry['state'] == 'closed':
-            self.logger.warn('User voted on a closed agreement.')
+        if entry.state not in OPEN_STATES:
+            self.logger.warn(f'User voted on a {entry.state} agreement.')
             return False
 
+        # the ruling is written along with the state it leads to
+        fields = {}
+
         # adds ruling if member
-        if str(account.id) == entry['member_id']:
-            self.agreement_table.update(
-                {'member_ruling': ruling},
-                doc_ids=[self.id]
-            )
+        if account.id == entry.member_id:
+            entry.member_ruling = fields['member_ruling'] = ruling
             self.logger.info(f'Member {account.screen_name} [{account.id}] voted {ruling} on Agreement #{self.id}')
 
         # adds ruling if creator
-        elif str(account.id) == entry['creator_id']:
-            self.agreement_table.update(
-                {'creator_ruling': ruling},
-                doc_ids=[self.id]
-            )
+        elif account.id == entry.creator_id:
+            entry.creator_ruling = fields['creator_ruling'] = ruling
             self.logger.info(f'Creator {account.screen_name} [{account.id}] voted {ruling} on Agreement #{self.id}')
 
-        # extracting from db
-        collateral_type = entry['collateral_type']
-        collateral = int(entry['collateral'])
-        member_id = int(entry['member_id'])
-        member_screen_name = entry['member_screen_name']
-        creator_id = int(entry['creator_id'])
-        creator_screen_name = entry['creator_screen_name']
-
         # checks the current ruling state of the agreement
-        ruling = self.check_ruling()
+        ruling = self.check_ruling(entry, fields)
+
+        if (ruling == 'upheld') or (ruling == 'broken'):
+            # send result
+            core.emit(self.settle(entry, ruling, account), self.id)
+        elif ruling == 'disputed':
+            core.emit(f'Agreement outcome is disputed. No action will be taken, users can change their ruling to come to a consensus.', self.id)
+
+    # moves the collateral of an agreement ruled upheld or broken, account is any account (used to change balances)
+    # returns the message announcing the result
+    def settle(self, entry, ruling, account):
+        # extracting from db
+        collateral_type = entry.collateral_type
+        collateral = entry.collateral
+        member_id = entry.member_id
+        member_screen_name = entry.member_screen_name
+        creator_id = entry.creator_id
+        creator_screen_name = entry.creator_screen_name
 
         # both users say the agreement was upheld
         if ruling == 'upheld':
             # if the creator used TSC as collateral, it is returned to their balance
             if collateral_type == 'TSC':
-                account.change_balance(creator_id, collateral)
+                account.change_balance(creator_id, collateral, 'collateral_release', self.id)
                 self.logger.info(f'Paid back {collateral} TSC to {creator_screen_name} [{creator_id}] ')
 
                 update_message = f'Agreement is upheld, {collateral} TSC has been repaid to @{creator_screen_name}.'
@@ -193,10 +186,7 @@ class Agreement:
             elif (collateral_type == "like") or (collateral_type == "retweet"):
                 self.logger.info('Agreement is upheld, collateral type is future contract, nothing to do')
                 # effectively zeroes out dead contract
-                core.db.table('contracts').update(
-                    {'count': '0'},
-                    doc_ids=[self.id]
-                )
+                contract.Pool().zero(self.id)
                 
                 update_message = f'Agreement is upheld, no contracts will be generated.'
             
@@ -209,26 +199,23 @@ class Agreement:
         elif ruling == 'broken':
             # if the creator used TSC as collateral, it is transferred to the member
             if collateral_type == 'TSC':
-                account.change_balance(member_id, collateral)
+                account.change_balance(member_id, collateral, 'collateral_payout', self.id)
                 self.logger.info(f'Transferred {collateral} TSC to {member_id} [{member_id}]')
                 update_message = f'Agreement is broken, {collateral} TSC has been paid to @{member_screen_name}'
             
             # if the creator used likes/retweets as collateral, a contract is generated and the profit is transferred to the member
             elif (collateral_type == "like") or (collateral_type == "retweet"):
                 # retrieving inactive contract
-                c_entry = core.db.table('contracts').get(doc_id=self.id)
-                c_total = int(c_entry['count'])
-                c_value = int(c_entry['price'])
+                c_entry = ContractRecord.load(core.db.table('contracts'), self.id)
+                c_total = c_entry.count
+                c_value = c_entry.price
                 total_value = c_total * c_value
 
                 # paying tax to agreement engine
                 to_pay_engine = math.ceil(total_value * core.Consts.tax_rate)
                 collateral = total_value - to_pay_engine
 
-                core.db.table('contracts').update(
-                    {'state': 'alive'},
-                    doc_ids=[self.id]
-                )    
+                contract.Pool().activate(self.id)
                 self.logger.info(f'Collateral contract #{self.id} activated')
 
                 core.db.table('accounts').update(
@@ -237,38 +224,101 @@ class Agreement:
                 )
 
                 # paid out to agreement engine
-                account.change_balance(core.engine_id, to_pay_engine)
-                account.change_balance(member_id, collateral)
+                account.change_balance(core.engine_id, to_pay_engine, 'tax', self.id)
+                account.change_balance(member_id, collateral, 'payout', self.id)
                 self.logger.info(f'Transferred {collateral} TSC to {member_screen_name} [{member_id}]') 
                 update_message = f'Agreement is broken, @{creator_screen_name}\'s contract was generated and {collateral} TSC has been paid to @{member_screen_name}.'
             
             elif collateral_type == "none":
                 self.logger.info('Agreement is broken, collateral type is none, nothing to do.')
+
+                update_message = 'Agreement is broken.'
                 
-        elif ruling == 'disputed':
-            update_message = f'Agreement outcome is disputed. No action will be taken, users can change their ruling to come to a consensus.'
 
-        if (ruling == 'upheld') or (ruling == 'broken') or (ruling == 'disputed'):
-            # send result
-            core.emit(update_message, self.id)
+        return update_message
     
-    def check_ruling(self):
-        m_ruling = self.get_entry()['member_ruling']
-        c_ruling = self.get_entry()['creator_ruling']
-
-        if m_ruling and c_ruling:
-            if m_ruling == c_ruling:
-                self.logger.info(f'Consensus reached: {c_ruling}')
-
-                self.agreement_table.update(
-                    {'state': 'closed'},
-                    doc_ids=[self.id]
-                )
-
-                return c_ruling
-            else:
-                self.logger.info('Dispute in agreement')
-                return 'disputed'
-        else:
+    # works out the ruling of the agreement and moves it to the state it leads to, keeping the state index up to date
+    # fields are changes to the entry that aren't written yet (ie a vote), they're written in the same update as the state
+    def check_ruling(self, entry=None, fields=None):
+        if entry is None:
+            entry = self.get_entry()
+        fields = dict(fields or {})
+        ruling = resolve(entry.creator_ruling, entry.member_ruling)
+
+        if ruling == 'waiting':
             self.logger.info('Have not received all rulings')
-            return 'waiting'
\ No newline at end of file
+        elif ruling == 'disputed':
+            self.logger.info('Dispute in agreement')
+            # still open to votes, until both rulings agree
+            if entry.state == 'open':
+                fields['state'] = 'disputed'
+        else:
+            self.logger.info(f'Consensus reached: {ruling}')
+            if entry.state in OPEN_STATES:
+                stats = economy_stats(core.db)
+                stats.add('open_agreements', -1)
+                stats.add(f'{ruling}_agreements', 1)
+                fields['state'] = 'closed'
+
+        if 'state' in fields:
+            agreement_index(core.db).set_state(self.id, entry.state, fields['state'])
+            entry.state = fields['state']
+        if fields:
+            self.agreement_table.update(fields, doc_ids=[self.id])
+
+        return ruling
+
+    # ends an agreement whose deadline passed before both parties agreed on a ruling
+    # a vote cast by only one of them stands and the agreement is settled on it, otherwise (no votes, or a dispute) the
+    # agreement expires: collateral goes back to the creator and collateral contracts are never generated
+    def expire(self, entry=None):
+        if entry is None:
+            entry = self.get_entry()
+        # account imports this module
+        from .account import Account
+
+        ruling = expiry_ruling(entry.creator_ruling, entry.member_ruling)
+        state = 'closed' if ruling else 'expired'
+
+        stats = economy_stats(core.db)
+        stats.add('open_agreements', -1)
+        stats.add(f'{ruling}_agreements' if ruling else 'expired_agreements', 1)
+        agreement_index(core.db).set_state(self.id, entry.state, state)
+        self.agreement_table.update({'state': state}, doc_ids=[self.id])
+        disputed = (entry.state == 'disputed')
+        entry.state = state
+
+        if ruling:
+            self.logger.info(f'Agreement #{self.id} expired with a single ruling: {ruling}')
+            # a member that never voted may not have an account to be paid into yet
+            if (ruling == 'broken') and not core.db.table('accounts').contains(doc_id=entry.member_id):
+                Account(core.api.get_user(entry.member_id))
+            update_message = self.settle(entry, ruling, Account(entry.creator_id))
+            core.emit(f'Agreement has expired, settled on the only ruling given. {update_message}', self.id)
+            return
+
+        if entry.collateral_type == 'TSC':
+            Account(entry.creator_id).change_balance(entry.creator_id, entry.collateral, 'collateral_release', self.id)
+            self.logger.info(f'Paid back {entry.collateral} TSC to {entry.creator_screen_name} [{entry.creator_id}]')
+        elif entry.collateral_type in ('like', 'retweet'):
+            contract.Pool().zero(self.id)
+
+        reason = 'while disputed' if disputed else 'without a ruling'
+        self.logger.info(f'Agreement #{self.id} expired {reason}')
+        core.emit(f'Agreement has expired {reason}, any collateral has been returned to @{entry.creator_screen_name}.', self.id)
+
+# ruling of an agreement given the votes of both parties: waiting until both voted, then their ruling if they agree
+def resolve(creator_ruling, member_ruling):
+    if not (creator_ruling and member_ruling):
+        return 'waiting'
+    elif creator_ruling == member_ruling:
+        return creator_ruling
+    else:
+        return 'disputed'
+
+# ruling an agreement is settled on when its deadline passes: the vote of the only party that voted, None if neither
+# or both of them did (both voting the same settles it before the deadline, so both voting means a dispute)
+def expiry_ruling(creator_ruling, member_ruling):
+    if bool(creator_ruling) != bool(member_ruling):
+        return creator_ruling or member_ruling
+    return None
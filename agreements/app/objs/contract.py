@@ -1,9 +1,146 @@
+import heapq
 import logging
 from tinydb.database import Document
-from tinydb import where
 
-from .. import core
-from . import account
+from .. import core, metrics
+from ..database import storage
+from ..database.records import ContractRecord
+from ..database.executions import execution_log
+from ..database.stats import economy_stats
+
+# index of contract counts keyed by (user id, contract type), kept in memory and mirrored in the contract_counts table
+# counts include every contract of a user regardless of state (same as the contract limit has always been computed)
+class CountIndex:
+    version = 2
+
+    def __init__(self, db):
+        self.db = db
+        self.index_table = db.table('contract_counts')
+        self.logger = logging.getLogger(".".join([self.__module__, type(self).__name__]))
+        self.counts = {}
+
+        header = self.index_table.get(doc_id=0)
+        if header and header.get('index_version') == self.version:
+            for doc in self.index_table.all():
+                if doc.doc_id == 0:
+                    continue
+                for contract_type, count in doc.items():
+                    self.counts[(doc.doc_id, contract_type)] = count
+        else:
+            self.rebuild()
+
+    # recreates the index from a full scan of the contracts table (only needed once for existing databases)
+    def rebuild(self):
+        self.logger.info('Building contract count index')
+        self.counts = {}
+        for c_id, c_entry in self.db.table('contracts')._read_table().items():
+            if c_id == 0:
+                continue
+            c = ContractRecord.from_doc(c_entry, c_id)
+            key = (c.user_id, c.type)
+            self.counts[key] = self.counts.get(key, 0) + c.count
+
+        self.index_table.truncate()
+        self.index_table.insert(Document({'index_version': self.version}, doc_id=0))
+        for user_id in {user_id for user_id, _ in self.counts}:
+            self.index_table.insert(Document(self.user_entry(user_id), doc_id=user_id))
+
+    def user_entry(self, user_id):
+        return {
+            contract_type: count
+            for (c_user_id, contract_type), count in self.counts.items()
+            if c_user_id == user_id
+        }
+
+    def get(self, user_id, contract_type):
+        return self.counts.get((int(user_id), contract_type), 0)
+
+    # adds amount (may be negative) to the count of a user's contracts of a type
+    def add(self, user_id, contract_type, amount):
+        user_id = int(user_id)
+        key = (user_id, contract_type)
+        self.counts[key] = self.counts.get(key, 0) + amount
+
+        count = self.counts[key]
+        if self.index_table.contains(doc_id=user_id):
+            self.index_table.update({contract_type: count}, doc_ids=[user_id])
+        else:
+            self.index_table.insert(Document({contract_type: count}, doc_id=user_id))
+
+# returns the contract count index of the current database
+def count_index():
+    return storage.derived(core.db, 'contract_counts', CountIndex, ['contracts', 'contract_counts'])
+
+# live contracts (alive with uses left) ordered by price then age
+# contracts entering and leaving it are also counted in the live supply of the economy statistics
+class ExecutionQueue:
+    def __init__(self, db):
+        self.db = db
+        self.logger = logging.getLogger(".".join([self.__module__, type(self).__name__]))
+        # contract id -> contract record (count is kept up to date as the contract is used)
+        self.live = {}
+        # heap of (price, contract id), may hold stale ids of contracts no longer live (skipped when popped)
+        self.heap = []
+        self.in_heap = set()
+
+        for c_id, c_entry in db.table('contracts')._read_table().items():
+            if c_id == 0:
+                continue
+            if (c_entry['state'] == 'alive') and (c_entry['count'] > 0):
+                self.live[c_id] = ContractRecord.from_doc(c_entry, c_id)
+
+        self.heap = [(c.price, c_id) for c_id, c in self.live.items()]
+        heapq.heapify(self.heap)
+        self.in_heap = set(self.live)
+        self.logger.info(f'Loaded {len(self.live)} live contracts')
+
+    def __len__(self):
+        return len(self.live)
+
+    # adds a contract that just became live (generated or activated) to the queue
+    def push(self, c):
+        if c.count <= 0:
+            return
+        self.live[c.id] = c
+        self.restore(c.id)
+        economy_stats(self.db).supply_changed(c.type, 1, c.count)
+
+    # puts a popped contract back into the queue if it is still live
+    def restore(self, contract_id):
+        if (contract_id in self.live) and (contract_id not in self.in_heap):
+            heapq.heappush(self.heap, (self.live[contract_id].price, contract_id))
+            self.in_heap.add(contract_id)
+
+    # removes and returns the cheapest live contract record, or None if the queue is empty
+    def pop(self):
+        while self.heap:
+            price, contract_id = heapq.heappop(self.heap)
+            self.in_heap.discard(contract_id)
+            if contract_id in self.live:
+                return self.live[contract_id]
+        return None
+
+    # evicts a contract from the queue (killed, zeroed or used up)
+    def remove(self, contract_id):
+        c = self.live.pop(contract_id, None)
+        if c is not None:
+            economy_stats(self.db).supply_changed(c.type, -1, -c.count)
+
+    # records one use of a contract on a status, returns the remaining count
+    def use(self, contract_id, status_id):
+        c = self.live[contract_id]
+        c.count -= 1
+        execution_log(self.db).add(c.user_id, c.type, status_id)
+        stats = economy_stats(self.db)
+        stats.supply_changed(c.type, 0, -1)
+        stats.add('executions', 1)
+        if c.count <= 0:
+            self.remove(contract_id)
+        return c.count
+
+# returns the execution queue of the current database
+def execution_queue():
+    return storage.derived(core.db, 'execution_queue', ExecutionQueue, ['contracts'])
 
 # represents the contract pool
 class Pool:
@@ -13,71 +150,77 @@ class Pool:
     
     # counts how many contracts a user has for a given type
     def count_user_contracts(self, contract_type, user_id):
-        contract_count = 0
+        return count_index().get(user_id, contract_type)
+
+    # marks a contract as dead, it will no longer be executed
+    # (dead contracts with uses left, like agreement collateral, still count towards the limit so the index is unchanged)
+    def kill(self, contract_id):
+        execution_queue().remove(contract_id)
+        self.contract_table.update(
+            {'state': 'dead'},
+            doc_ids=[contract_id]
+        )
 
-        # searches all contracts made by specified user
-        for contract in self.contract_table.search(where('user_id') == str(user_id)):
-            # if contract is of requested type, contract count is updated
-            if contract['type'] == contract_type:
-                contract_count += int(contract['count'])
+    # marks a dead contract as alive again so it can be executed (ie agreement collateral when an agreement is broken)
+    def activate(self, contract_id):
+        self.contract_table.update(
+            {'state': 'alive'},
+            doc_ids=[contract_id]
+        )
+        execution_queue().push(ContractRecord.load(self.contract_table, contract_id))
 
-        return contract_count
+    # sets the remaining uses of a contract to zero
+    def zero(self, contract_id):
+        c_entry = ContractRecord.load(self.contract_table, contract_id)
+        execution_queue().remove(contract_id)
+        self.contract_table.update(
+            {'count': 0},
+            doc_ids=[contract_id]
+        )
+        count_index().add(c_entry.user_id, c_entry.type, -c_entry.count)
 
     # automatically executes contracts up to the amount specified on the given status
+    # contracts are executed cheapest first (oldest first among equal prices)
     def auto_execute_contracts(self, user_id, status, amount):
         balance = amount
-        contract_dict = self.contract_table._read_table()
-        # ids are ordered from oldest to newest (excluding zero entry containing metadata)
-        contract_ids = list(contract_dict.keys())[1:]
+        queue = execution_queue()
+        executions = execution_log(core.db)
+        status = int(status)
 
         contract_count = 0
+        # contracts taken out of the queue while executing, put back once done
+        popped = []
 
-        for c_id in contract_ids:
-            c_entry = contract_dict[c_id]
-            c_price = int(c_entry['price'])
-            c_user_id = int(c_entry['user_id'])
-            c_type = c_entry['type']
-            c_count = int(c_entry['count'])
-            c_state = c_entry['state']
+        while balance > 0:
+            next_contract = queue.pop()
+            if next_contract is None:
+                break
+            popped.append(next_contract.id)
 
-            if c_state == "dead":
-                continue
+            # queue is ordered by price, so no remaining contract can be paid for either
+            if next_contract.price > balance:
+                break
 
             # prevents user from executing their own contract
-            if user_id == c_user_id:
+            if user_id == next_contract.user_id:
                 continue
 
             # a user can't like or retweet the same post twice
-            acc = account.Account(c_user_id)
-            if (c_type == "like") and (acc.has_liked(status)):
-                continue
-            if (c_type == "retweet") and (acc.has_retweeted(status)):
+            if status in executions.executed(next_contract.user_id, next_contract.type):
                 continue
 
-            # executes contract if it can be paid for
-            if c_price <= balance:
-                if c_count > 0:
-                    self.execute(c_id, status)
-                    # adds status to likes or retweets list of an account
-                    core.db.table('accounts').update(
-                        lambda d: d[f'{c_type}s'].append(str(status)),
-                        doc_ids=[c_user_id]
-                    )
-                    # updates remaining balance
-                    balance -= c_price
-                    contract_count += 1
-                else:
-                    def kill_contract(doc):
-                        doc['state'] = 'dead'
-                    self.contract_table.update(
-                        kill_contract,
-                        doc_ids=[c_id]
-                    )
-
-            # stops trying to execute when total amount is spent
-            if balance == 0:
-                break
-        
+            # also adds the status to the executions of the contract's owner
+            self.execute(next_contract.id, status)
+            # updates remaining balance
+            balance -= next_contract.price
+            contract_count += 1
+
+        for c_id in popped:
+            queue.restore(c_id)
+
+        metrics.contract_scan_length.observe(len(popped))
+        metrics.add_to_trace('contracts_scanned', len(popped))
+
         if contract_count > 0:
             self.logger.info(f'Successfully executed {contract_count} contracts for {amount - balance}/{amount} TSC')
         else:
@@ -88,30 +231,33 @@ class Pool:
 
     # actual execution of a single contract on a status
     def execute(self, contract_id, status_id):
-        contract_dict = self.contract_table._read_table()
-        to_execute = contract_dict[contract_id]
-        c_price = to_execute['price']
-        c_type = to_execute['type']
-        c_user_id = to_execute['user_id']
-        c_user_screen_name = to_execute['user_screen_name']
-
-        status = core.api.get_status(status_id)
+        to_execute = ContractRecord.load(self.contract_table, contract_id)
+        c_price = to_execute.price
+        c_type = to_execute.type
+        c_user_id = to_execute.user_id
+        c_user_screen_name = to_execute.user_screen_name
 
         self.logger.info(f'Executed {c_type} contract #{contract_id} from {c_user_screen_name} [{c_user_id}] for {c_price} TSC')
 
         message = f'@{c_user_screen_name} Your contract has been called in, please {c_type} the above post!'
         core.emit(message, status_id)
-        
+
+        # used up contracts are killed right away instead of being found again by later executions
+        remaining = execution_queue().use(contract_id, status_id)
+
         # transform function to update contract use count and executions
         def update_contract(status_id):
             def transform(doc):
-                doc['count'] = str(int(doc['count']) - 1)
+                doc['count'] -= 1
                 doc['executed_on'].append(status_id)
+                if remaining <= 0:
+                    doc['state'] = 'dead'
             return transform
         self.contract_table.update(
             update_contract(status_id),
             doc_ids=[contract_id]
         )
+        count_index().add(c_user_id, c_type, -1)
 
 # represents a single contract
 class Contract:
@@ -127,45 +273,13 @@ class Contract:
         self.no_followers = False
         self.bad_args = False
     
-    # returns dict entry from db
+    # returns contract record from db
     def get_entry(self):
-        return self.contract_table.get(doc_id=self.id)
-
-    def generate(self):
-        text = self.status.full_text
-
-        state = 'find_command'
-        contract_size = 0
-        contract_type = ''
-
-        for word in text.split():
-            if state == 'find_command':
-                if word == 'generate':
-                    state = 'find_size'
-            
-            elif state == 'find_size':
-                if word.isnumeric():
-                    contract_size = int(word)
-                    state = 'find_type'
-                else:
-                    # default params if none given
-                    contract_size = 10
-                    contract_type = 'like'
-                    break
-            
-            elif state == 'find_type':
-                if (word == 'like') or (word == 'likes'):
-                    contract_type = 'like'
-                    break
-                elif (word == 'retweet') or (word == 'retweets'):
-                    contract_type = 'retweet'
-                    break
-                else:
-                    # default type if none given
-                    contract_type = 'like'
-                    break
-        
-        return self.complex_generate(contract_type, contract_size)
+        return ContractRecord.load(self.contract_table, self.id)
+
+    # generates a contract from a parsed generate command (10 likes if no size or type is given)
+    def generate(self, command):
+        return self.complex_generate(command.unit, command.amount)
 
     # generates a contract from a status (given in initialization)
     def complex_generate(self, contract_type, contract_size):
@@ -203,31 +317,32 @@ class Contract:
         unit_cost = contract_type_value * social_reach
 
         # generating dict to be entered into db
-        contract = {
-            "state": "alive",
-            "user_id": str(self.status.user.id),
-            "user_screen_name": self.status.user.screen_name,
-            "type": contract_type,
-            "count": str(contract_size),
-            "price": str(unit_cost),
-            "created": str(self.status.created_at),
-            "executed_on": []
-        }
+        contract = ContractRecord(
+            self.status.id,
+            state="alive",
+            user_id=self.status.user.id,
+            user_screen_name=self.status.user.screen_name,
+            type=contract_type,
+            count=contract_size,
+            price=unit_cost,
+            created=str(self.status.created_at),
+            executed_on=[]
+        )
 
         # inserting into database
         self.contract_table.insert(Document(
-            contract, doc_id=self.status.id
+            contract.to_doc(), doc_id=self.status.id
         ))
 
         # updating number of contracts
         def increment_num_contracts(doc):
-            num_contracts = int(doc['num_contracts'])
-            num_contracts += 1
-            doc['num_contracts'] = str(num_contracts)
+            doc['num_contracts'] += 1
         self.contract_table.update(
             increment_num_contracts, 
             doc_ids=[0]
         )
+        count_index().add(self.status.user.id, contract_type, contract_size)
+        execution_queue().push(contract)
 
         # calculating total cost
         total_cost = unit_cost * contract_size
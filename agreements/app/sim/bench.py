@@ -0,0 +1,216 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+
+from .fakeapi import FakeAPI
+from .workload import Workload, WorkloadSource
+from .replay import install
+
+# default relative slowdown (of the median) reported as a regression
+DEFAULT_THRESHOLD = 0.2
+
+# collects the duration of each timed block
+class Timer:
+    def __init__(self):
+        self.samples = []
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args):
+        self.samples.append(time.perf_counter() - self.start)
+
+    def summary(self):
+        samples = sorted(self.samples)
+        def at(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1e6, 1)
+        return {
+            'n': len(samples),
+            'mean_us': round(sum(samples) / len(samples) * 1e6, 1),
+            'min_us': at(0),
+            'p50_us': at(0.5),
+            'p90_us': at(0.9)
+        }
+
+# seeded database and helpers shared by the benchmarks
+class Bench:
+    def __init__(self, db_path, statuses, users, seed):
+        self.api = FakeAPI(keep_statuses=False)
+        self.core = install(self.api, db_path)
+        self.random = random.Random(seed)
+
+        from ..database import update
+        self.workload = Workload(self.api, users=users, seed=seed)
+        update.run(WorkloadSource(self.workload, statuses))
+
+        from ..objs import account, agreement, contract
+        from ..database import commands
+        self.commands = commands
+        self.account = account
+        self.agreement = agreement
+        self.contract = contract
+        self.user_ids = [user_id for user_id in self.core.db.table('accounts')._read_table() if user_id != 0]
+
+    def user(self):
+        return self.workload.pick_user()
+
+    # runs fn as the parser would, in its own transaction
+    def transaction(self, fn, *args):
+        with self.core.db.transaction():
+            return fn(*args)
+
+def bench_count_user_contracts(b, timer):
+    pool = b.contract.Pool()
+    user_id = b.random.choice(b.user_ids)
+    with timer:
+        pool.count_user_contracts('like', user_id)
+
+def bench_auto_execute_contracts(b, timer):
+    user = b.user()
+    b.account.Account(user)
+    post_id = b.api.next_id()
+    with timer:
+        b.transaction(b.contract.Pool().auto_execute_contracts, user.id, post_id, 100)
+
+def bench_complex_generate(b, timer):
+    user = b.user()
+    status = b.api.mention(user, f'@{b.api.engine.screen_name} generate 1 likes')
+    with timer:
+        b.transaction(b.contract.Contract(status).complex_generate, 'like', 1)
+
+# a new agreement without collateral for each sample, so every vote lands on an open agreement
+def new_agreement(b):
+    creator = b.user()
+    member = b.workload.pick_other(creator)
+    status = b.api.mention(creator, f'@{b.api.engine.screen_name} agreement with @{member.screen_name}', mentions=[member])
+    b.transaction(b.account.Account(creator).create_agreement, status, b.commands.parse(status))
+    return status.id, b.account.Account(creator), b.account.Account(member)
+
+def bench_agreement_vote(b, timer):
+    agreement_id, creator, member = new_agreement(b)
+    for voter in (creator, member):
+        with timer:
+            b.transaction(b.agreement.Agreement(agreement_id).vote, voter, 'upheld')
+
+def bench_agreement_check_ruling(b, timer):
+    agreement_id, creator, member = new_agreement(b)
+    b.transaction(b.agreement.Agreement(agreement_id).vote, creator, 'upheld')
+    with timer:
+        b.transaction(b.agreement.Agreement(agreement_id).check_ruling)
+
+def bench_send_tsc(b, timer):
+    sender = b.user()
+    recipient = b.workload.pick_other(sender)
+    status = b.api.mention(sender, f'@{b.api.engine.screen_name} send 1 @{recipient.screen_name}', mentions=[recipient])
+    with timer:
+        b.transaction(b.account.Account(sender).send_tsc, status, b.commands.parse(status))
+
+# web handlers are timed through the flask test client against the same database
+def web_bench(path):
+    def bench(b, timer):
+        if not hasattr(b, 'client'):
+            from ..web import server
+            b.client = server.flask_app.test_client()
+            b.ids = {
+                table: [doc_id for doc_id in b.core.db.table(table)._read_table() if doc_id != 0] or [0]
+                for table in ('accounts', 'contracts', 'agreements')
+            }
+        url = path.format(**{table: b.random.choice(ids) for table, ids in b.ids.items()})
+        with timer:
+            b.client.get(url)
+    return bench
+
+BENCHMARKS = {
+    'pool.count_user_contracts': bench_count_user_contracts,
+    'pool.auto_execute_contracts': bench_auto_execute_contracts,
+    'contract.complex_generate': bench_complex_generate,
+    'agreement.vote': bench_agreement_vote,
+    'agreement.check_ruling': bench_agreement_check_ruling,
+    'account.send_tsc': bench_send_tsc,
+    'api.user': web_bench('/api/user/{accounts}'),
+    'api.contract': web_bench('/api/contract/{contracts}'),
+    'api.agreement': web_bench('/api/agreement/{agreements}'),
+    'api.metadata': web_bench('/api/metadata'),
+    'api.latest_agreements': web_bench('/api/latest_agreements')
+}
+
+def run(db_path, statuses, users, seed, iterations, only=None):
+    b = Bench(db_path, statuses, users, seed)
+
+    results = {}
+    for name, bench in BENCHMARKS.items():
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+        timer = Timer()
+        for _ in range(iterations):
+            bench(b, timer)
+        results[name] = timer.summary()
+
+    return {
+        'meta': {
+            'statuses': statuses,
+            'users': users,
+            'seed': seed,
+            'backend': 'json' if db_path.endswith('.json') else 'sqlite',
+            'python': platform.python_version()
+        },
+        'results': results
+    }
+
+# benchmarks whose median got slower than the baseline by more than threshold, as {name: (baseline, current)}
+def regressions(report, baseline, threshold=DEFAULT_THRESHOLD):
+    slower = {}
+    for name, result in report['results'].items():
+        previous = baseline['results'].get(name)
+        if previous and (result['p50_us'] > previous['p50_us'] * (1 + threshold)):
+            slower[name] = (previous['p50_us'], result['p50_us'])
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description='times core engine operations against a seeded database')
+    parser.add_argument('--statuses', type=int, default=10000, help='statuses replayed to seed the database')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--backend', choices=['sqlite', 'json'], default='sqlite')
+    parser.add_argument('--only', action='append', help='only run benchmarks starting with this name')
+    parser.add_argument('--baseline', help='results to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--save', help='where to write the results (ie to use as the next baseline)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='agreements-bench-')
+    try:
+        db_path = os.path.join(directory, 'db.json' if args.backend == 'json' else 'db.sqlite3')
+        report = run(db_path, args.statuses, args.users, args.seed, args.iterations, args.only)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    slower = {}
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        slower = regressions(report, baseline, args.threshold)
+        report['regressions'] = {name: {'baseline_p50_us': a, 'p50_us': b} for name, (a, b) in slower.items()}
+
+    for name, result in report['results'].items():
+        flag = '  REGRESSION' if name in slower else ''
+        print(f'{name:<30} p50 {result["p50_us"]:>10.1f} us   p90 {result["p90_us"]:>10.1f} us{flag}', file=sys.stderr)
+
+    output = json.dumps(report, indent=4)
+    if args.save:
+        with open(args.save, 'w') as f:
+            f.write(output)
+    print(output)
+
+    if slower:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
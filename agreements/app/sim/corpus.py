@@ -0,0 +1,126 @@
+import sys
+import json
+import time
+import random
+import argparse
+
+from ..database import commands
+from .fakeapi import FakeAPI
+
+# words mentions are made of besides keywords, including the ones that used to trip up parsing
+# (signed and non ascii numbers, units without amounts, keywords inside screen names)
+NOISE = [
+    'please', 'thanks', 'with', 'to', 'for', 'on', 'the', 'my', 'of',
+    '5', '10', '0', '007', '-5', '+5', '3.5', '1e3', '١٢', '²', '99999999999999999999',
+    'like', 'likes', 'retweet', 'retweets', 'TSC', 'tsc', 'for', 'days', 'week', 'hours',
+    '@sendbot', '@generate', 'agreements', 'executed', 'Send', '#agreement', '🙂'
+]
+
+# builds a corpus of mention texts, valid commands rendered from random arguments and random word soup
+class Corpus:
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+        self.verbs = list(commands.VERBS)
+
+    # a well formed command, along with what it should parse to
+    def valid(self):
+        verb = self.random.choice(self.verbs)
+        arguments = commands.GRAMMAR.get(verb, ())
+        words = ['@AgreementEngine', verb]
+
+        amount = unit = None
+        if arguments and self.random.random() < 0.8:
+            amount = self.random.randint(0, 10 ** self.random.randint(0, 6))
+            words.append(str(amount))
+            if ('unit' in arguments) and self.random.random() < 0.7:
+                word = self.random.choice(list(commands.UNITS))
+                words.append(word)
+                unit = commands.UNITS[word]
+        words.append('@user' + str(self.random.randint(0, 99)))
+
+        duration = None
+        if (verb == 'agreement') and self.random.random() < 0.5:
+            count, word = self.random.randint(0, 99), self.random.choice(list(commands.DURATIONS))
+            words += ['for', str(count), word]
+            duration = count * commands.DURATIONS[word]
+
+        # defaults of commands with arguments left out
+        if verb == 'generate':
+            amount, unit = (10 if amount is None else amount), (unit or 'like')
+        elif verb == 'agreement':
+            amount, unit = (0, 'none') if amount is None else (amount, unit or 'TSC')
+
+        text = ' '.join(words)
+        expected = commands.Command(verb, amount, unit, duration)
+        return text, expected
+
+    # any sequence of keywords and noise
+    def malformed(self):
+        length = self.random.randint(0, 8)
+        return ' '.join(self.random.choice(self.verbs + NOISE) for _ in range(length))
+
+    def texts(self, count, valid_share=0.5):
+        for _ in range(count):
+            if self.random.random() < valid_share:
+                yield self.valid()
+            else:
+                yield self.malformed(), None
+
+# checks what every parsed command must satisfy, returns a description of each failure
+def check(texts):
+    failures = []
+    for text, expected in texts:
+        try:
+            command = commands.parse_text(text)
+        except Exception as error:
+            failures.append(f'{text!r}: raised {error!r}')
+            continue
+
+        if (command.verb is not None) and (command.verb not in commands.VERBS):
+            failures.append(f'{text!r}: unknown verb {command.verb!r}')
+        if (command.amount is not None) and not (isinstance(command.amount, int) and command.amount >= 0):
+            failures.append(f'{text!r}: invalid amount {command.amount!r}')
+        if command.unit not in (None, 'like', 'retweet', 'TSC', 'none'):
+            failures.append(f'{text!r}: invalid unit {command.unit!r}')
+        if (command.duration is not None) and not (isinstance(command.duration, int) and command.duration >= 0):
+            failures.append(f'{text!r}: invalid duration {command.duration!r}')
+        if (expected is not None) and (command != expected):
+            failures.append(f'{text!r}: parsed {command!r}, expected {expected!r}')
+    return failures
+
+# statuses parsed per second by parse_many
+def throughput(texts, repeat=5):
+    api = FakeAPI(keep_statuses=False)
+    user = api.add_user(api.next_id(), 'user', 10)
+    statuses = [api.mention(user, text) for text in texts]
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        commands.parse_many(statuses)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(statuses) / best if best else float('inf')
+
+def main():
+    parser = argparse.ArgumentParser(description='fuzzes the command parser with a generated corpus of mentions and times it')
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--show', type=int, default=20, help='failures to print')
+    args = parser.parse_args()
+
+    texts = list(Corpus(args.seed).texts(args.count))
+    failures = check(texts)
+    report = {
+        'texts': len(texts),
+        'failures': len(failures),
+        'statuses_per_second': round(throughput([text for text, _ in texts]))
+    }
+
+    for failure in failures[:args.show]:
+        print(failure, file=sys.stderr)
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import json
+import time
+import threading
+from datetime import datetime, timezone
+from collections import deque
+
+import tweepy
+from tweepy.models import Status, User
+
+# start of twitter's snowflake ids (ms since the unix epoch), ids are (ms - epoch) << 22 plus a sequence number
+TWITTER_EPOCH = 1288834974657
+
+# mentions_timeline as tweepy.Cursor expects it, a method with id pagination that can return raw json
+class TimelineMethod:
+    pagination_mode = 'id'
+    payload_type = 'status'
+    payload_list = True
+
+    def __init__(self, api):
+        self.api = api
+
+    def __call__(self, create=False, parser=None, **kwargs):
+        if create:
+            return self
+        statuses = self.api.timeline(**kwargs)
+        if parser is not None:
+            return json.dumps([status._json for status in statuses])
+        return statuses
+
+# in-memory stand-in for the twitter api, with an optional delay per call to model network round trips
+class FakeAPI:
+    parser = tweepy.parsers.ModelParser()
+
+    def __init__(self, engine_screen_name='AgreementEngine', latency=0, keep_statuses=True, sent_history=1000):
+        self.latency = latency
+        # mentions are kept for mentions_timeline and get_status, generators of very long streams can turn this off
+        self.keep_statuses = keep_statuses
+        self.users = {}
+        self.statuses = {}
+        self.mentions = []
+        # only the latest replies are kept, sent_count has the total
+        self.sent = deque(maxlen=sent_history)
+        self.sent_count = 0
+        self.lock = threading.Lock()
+        self.last_id = 0
+        self.engine = self.add_user(self.next_id(), engine_screen_name, 1000)
+        self.mentions_timeline = TimelineMethod(self)
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    # new snowflake id for the current time, always increasing
+    def next_id(self):
+        with self.lock:
+            self.last_id = max(self.last_id + 1, (int(time.time() * 1000) - TWITTER_EPOCH) << 22)
+            return self.last_id
+
+    def add_user(self, user_id, screen_name, followers_count):
+        user = User.parse(self, {
+            'id': user_id,
+            'id_str': str(user_id),
+            'name': screen_name,
+            'screen_name': screen_name,
+            'followers_count': followers_count
+        })
+        self.users[user_id] = user
+        return user
+
+    # creates a status mentioning the engine (and any other users given) as it would show up in the timeline
+    def mention(self, user, text, in_reply_to=None, mentions=()):
+        status_id = self.next_id()
+        created = datetime.fromtimestamp(((status_id >> 22) + TWITTER_EPOCH) / 1000, timezone.utc)
+        status = Status.parse(self, {
+            'id': status_id,
+            'id_str': str(status_id),
+            'full_text': text,
+            'user': user._json,
+            'created_at': created.strftime('%a %b %d %H:%M:%S +0000 %Y'),
+            'in_reply_to_status_id': in_reply_to,
+            'in_reply_to_status_id_str': str(in_reply_to) if in_reply_to else None,
+            'entities': {
+                'user_mentions': [
+                    {'id': u.id, 'id_str': u.id_str, 'screen_name': u.screen_name}
+                    for u in [self.engine, *mentions]
+                ]
+            }
+        })
+
+        if self.keep_statuses:
+            self.statuses[status_id] = status
+            self.mentions.append(status)
+        return status
+
+    # newest first, like the real timeline
+    def timeline(self, since_id=None, max_id=None, count=20, **kwargs):
+        self.wait()
+        found = []
+        for status in reversed(self.mentions):
+            if since_id and status.id <= since_id:
+                break
+            if max_id and status.id > max_id:
+                continue
+            found.append(status)
+            if len(found) >= count:
+                break
+        return found
+
+    def me(self):
+        self.wait()
+        return self.engine
+
+    def get_status(self, id, **kwargs):
+        self.wait()
+        if int(id) not in self.statuses:
+            raise tweepy.error.TweepError('No status found with that ID.', api_code=144)
+        return self.statuses[int(id)]
+
+    def get_user(self, id=None, user_id=None, screen_name=None, **kwargs):
+        self.wait()
+        user_id = id if id is not None else user_id
+        if user_id is not None:
+            user = self.users.get(int(user_id))
+        else:
+            user = next((u for u in self.users.values() if u.screen_name == screen_name), None)
+        if user is None:
+            raise tweepy.error.TweepError('User not found.', api_code=50)
+        return user
+
+    def lookup_users(self, user_ids=None, **kwargs):
+        self.wait()
+        return [self.users[int(user_id)] for user_id in user_ids or [] if int(user_id) in self.users]
+
+    def update_status(self, status=None, in_reply_to_status_id=None, **kwargs):
+        self.wait()
+        with self.lock:
+            self.sent.append((status, in_reply_to_status_id))
+            self.sent_count += 1
+        return status
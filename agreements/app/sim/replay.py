@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+
+from ..auth import auth
+from ..database import storage
+from .fakeapi import FakeAPI
+from .workload import Workload, WorkloadSource
+
+# number of statuses replayed at each scale when none are given
+DEFAULT_SCALES = [1000, 10000, 100000, 1000000]
+
+# points the app at a fake twitter api and a new database at db_path, must run before app.core is first used
+def install(api, db_path):
+    auth.install(api)
+    storage.DEFAULT_PATH = db_path
+    # keeps the automatic migration from picking up the legacy database of the working directory
+    storage.LEGACY_PATH = os.path.splitext(db_path)[0] + '_legacy.json'
+
+    # per-status warnings (ie insufficient balance) are expected in synthetic traffic, errors go to stderr
+    # instead of the log file of the engine
+    app_logger = logging.getLogger('app')
+    app_logger.setLevel(logging.ERROR)
+    app_logger.addHandler(logging.StreamHandler())
+
+    from .. import core
+    return core
+
+# size in bytes of the database and the files kept next to it (sqlite wal, balance journal, execution log)
+def database_size(db_path):
+    base = os.path.splitext(db_path)[0]
+    directory = os.path.dirname(db_path) or '.'
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if path.startswith(base):
+                total += os.path.getsize(path)
+    return total
+
+# time taken by each status, grouped by the command it contains
+def timed_parser(core, latencies):
+    from ..database.parser import Parser
+    from ..database import commands
+
+    class TimedParser(Parser):
+        def parse(self, status, command=None):
+            if command is None:
+                command = commands.parse(status)
+            start = time.perf_counter()
+            try:
+                super().parse(status, command)
+            finally:
+                latencies.setdefault(command.verb or 'none', []).append(time.perf_counter() - start)
+
+        # votes settled together share the time taken by their run
+        def parse_votes(self, statuses, parsed):
+            start = time.perf_counter()
+            try:
+                super().parse_votes(statuses, parsed)
+            finally:
+                share = (time.perf_counter() - start) / len(statuses)
+                for command in parsed:
+                    latencies.setdefault(command.verb, []).append(share)
+
+    return TimedParser(core.db, core.api)
+
+def percentiles(samples):
+    samples = sorted(samples)
+    def at(p):
+        return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 3)
+    return {'count': len(samples), 'p50': at(0.5), 'p90': at(0.9), 'p99': at(0.99), 'max': at(1)}
+
+# replays count synthetic statuses through update.run against a new database, returns the report
+def run(count, db_path, users=1000, seed=0, workers=1, latency=0, batch_size=200, samples=10):
+    api = FakeAPI(latency=latency, keep_statuses=False)
+    core = install(api, db_path)
+    from ..database import update
+
+    workload = Workload(api, users=users, seed=seed)
+    latencies = {}
+    parser = timed_parser(core, latencies)
+
+    growth = [(0, database_size(db_path))]
+    step = max(count // samples, batch_size)
+
+    start = time.perf_counter()
+    done = 0
+    while done < count:
+        chunk = min(step, count - done)
+        update.run(WorkloadSource(workload, chunk, batch_size), workers, parser)
+        done += chunk
+        growth.append((done, database_size(db_path)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'statuses': count,
+        'backend': 'json' if db_path.endswith('.json') else 'sqlite',
+        'workers': workers,
+        'seconds': round(elapsed, 3),
+        'statuses_per_sec': round(count / elapsed, 1) if elapsed else None,
+        'latency_ms': {command: percentiles(samples) for command, samples in sorted(latencies.items())},
+        'db_bytes': growth,
+        'replies_queued': len(core.db.table('outbox'))
+    }
+
+# runs every scale in its own process, so each starts from a fresh app.core and a new database
+def run_scales(scales, args):
+    reports = []
+    for count in scales:
+        command = [sys.executable, '-m', 'app.sim.replay', '--statuses', str(count), '--single',
+                   '--backend', args.backend, '--users', str(args.users), '--seed', str(args.seed),
+                   '--workers', str(args.workers), '--latency', str(args.latency)]
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE).stdout
+        report = json.loads(output)
+        reports.append(report)
+        print(f'{count:>9} statuses  {report["statuses_per_sec"]:>9} statuses/sec  '
+              f'{report["db_bytes"][-1][1] / 1e6:>8.1f} MB', file=sys.stderr)
+    return reports
+
+def main():
+    parser = argparse.ArgumentParser(description='replays synthetic mention streams through the update pipeline')
+    parser.add_argument('--statuses', type=int, action='append', help='number of statuses (repeat for several scales)')
+    parser.add_argument('--backend', choices=['sqlite', 'json'], default='sqlite')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every fake api call')
+    parser.add_argument('--keep', action='store_true', help='keep the generated databases')
+    parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    scales = args.statuses or DEFAULT_SCALES
+    if not args.single:
+        print(json.dumps(run_scales(scales, args), indent=4))
+        return
+
+    directory = tempfile.mkdtemp(prefix='agreements-sim-')
+    try:
+        db_path = os.path.join(directory, 'db.json' if args.backend == 'json' else 'db.sqlite3')
+        report = run(scales[0], db_path, args.users, args.seed, args.workers, args.latency)
+        if args.keep:
+            report['db_path'] = db_path
+        print(json.dumps(report))
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
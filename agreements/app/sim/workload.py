@@ -0,0 +1,112 @@
+import random
+import itertools
+
+# relative frequency of each kind of mention
+DEFAULT_MIX = {
+    'generate': 25,
+    'execute': 20,
+    'send': 10,
+    'agreement': 15,
+    'vote': 20,
+    'info': 10
+}
+
+# synthesises a stream of mentions from a population of users whose activity follows a power law
+# (a few users send most of the commands, like on the real account)
+class Workload:
+    def __init__(self, api, users=1000, seed=0, skew=1.2, mix=DEFAULT_MIX):
+        self.api = api
+        self.random = random.Random(seed)
+        self.kinds = list(mix)
+        self.kind_weights = list(itertools.accumulate(mix.values()))
+
+        # follower counts are heavy tailed too, they set the price of contracts
+        self.users = [
+            api.add_user(api.next_id(), f'user{i}', max(1, int(self.random.lognormvariate(3, 1.5))))
+            for i in range(users)
+        ]
+        self.user_weights = list(itertools.accumulate(1 / (rank + 1) ** skew for rank in range(users)))
+
+        # ids of posts contracts can be executed on, mostly recent ones
+        self.posts = []
+        # open agreements as [status id, creator, member, votes cast]
+        self.agreements = []
+
+    def pick_user(self):
+        return self.random.choices(self.users, cum_weights=self.user_weights)[0]
+
+    def pick_other(self, user):
+        other = self.pick_user()
+        while other is user:
+            other = self.random.choice(self.users)
+        return other
+
+    # yields count new statuses in chronological order
+    def statuses(self, count):
+        for _ in range(count):
+            yield self.next_status()
+
+    def next_status(self):
+        kind = self.random.choices(self.kinds, cum_weights=self.kind_weights)[0]
+        if (kind == 'vote') and not self.agreements:
+            kind = 'agreement'
+        user = self.pick_user()
+
+        if kind == 'generate':
+            size = self.random.randint(1, 10)
+            contract_type = self.random.choice(['likes', 'retweets'])
+            return self.api.mention(user, f'@{self.api.engine.screen_name} generate {size} {contract_type}')
+
+        elif kind == 'execute':
+            if (not self.posts) or (self.random.random() < 0.2):
+                self.posts.append(self.api.next_id())
+                self.posts = self.posts[-1000:]
+            post = self.posts[-1 - min(int(self.random.expovariate(0.1)), len(self.posts) - 1)]
+            amount = self.random.randint(1, 500)
+            return self.api.mention(user, f'@{self.api.engine.screen_name} execute {amount}', in_reply_to=post)
+
+        elif kind == 'send':
+            recipient = self.pick_other(user)
+            amount = self.random.randint(1, 50)
+            return self.api.mention(
+                user, f'@{self.api.engine.screen_name} send {amount} @{recipient.screen_name}', mentions=[recipient])
+
+        elif kind == 'agreement':
+            member = self.pick_other(user)
+            collateral = self.random.choice(['', f'{self.random.randint(1, 50)}', f'{self.random.randint(1, 5)} likes',
+                                             f'{self.random.randint(1, 5)} retweets'])
+            words = [f'@{self.api.engine.screen_name}', 'agreement', collateral, 'with', f'@{member.screen_name}']
+            status = self.api.mention(user, ' '.join(w for w in words if w), mentions=[member])
+            self.agreements.append([status.id, user, member, 0])
+            self.agreements = self.agreements[-5000:]
+            return status
+
+        elif kind == 'vote':
+            agreement = self.random.choice(self.agreements)
+            agreement_id, creator, member, votes = agreement
+            voter = creator if self.random.random() < 0.5 else member
+            ruling = 'upheld' if self.random.random() < 0.7 else 'broken'
+            agreement[3] += 1
+            if agreement[3] >= 2:
+                self.agreements.remove(agreement)
+            return self.api.mention(voter, f'@{self.api.engine.screen_name} {ruling}', in_reply_to=agreement_id)
+
+        else:
+            command = self.random.choice(['balance', 'likes', 'retweets'])
+            return self.api.mention(user, f'@{self.api.engine.screen_name} {command}')
+
+# delivers a workload to update.run in batches, like a source of new mentions
+class WorkloadSource:
+    def __init__(self, workload, count, batch_size=200):
+        self.workload = workload
+        self.remaining = count
+        self.batch_size = batch_size
+
+    def batches(self, since_id):
+        while self.remaining > 0:
+            size = min(self.batch_size, self.remaining)
+            self.remaining -= size
+            yield list(self.workload.statuses(size))
+
+    def next_interval(self, processed):
+        return 0
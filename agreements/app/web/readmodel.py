@@ -0,0 +1,101 @@
+import os
+import logging
+import threading
+
+from ..database import storage
+from ..database.executions import ExecutionLog
+from ..database.indexes import AgreementIndex
+
+# tables served by the web api
+TABLES = ['accounts', 'contracts', 'agreements', 'metadata', 'feed', 'stats']
+
+# copy of the served tables kept in memory by the web process, refreshed from the database when it changes
+class ReadModel:
+    def __init__(self, db, tables=TABLES):
+        self.db = db
+        self.table_names = tables
+        self.logger = logging.getLogger(".".join([self.__module__, type(self).__name__]))
+        self.lock = threading.Lock()
+        self.tables = {name: {} for name in tables}
+        # statuses accounts have executed contracts on, read from the execution log as far as the metadata says it is committed
+        self.executions = ExecutionLog(db, readonly=True)
+        # agreements by creator, member and state, kept up to date with the agreements table
+        self.agreement_index = AgreementIndex()
+        # revision of the database the model reflects (sqlite change log rev, or json file mtime and size)
+        self.rev = None
+
+    @property
+    def version(self):
+        return str(self.rev)
+
+    def get(self, table, doc_id):
+        return self.tables[table].get(doc_id)
+
+    # brings the model up to date, cheap when nothing changed
+    def refresh(self):
+        with self.lock:
+            if isinstance(self.db, storage.SQLiteDB):
+                changed = self.refresh_sqlite()
+            else:
+                changed = self.refresh_json()
+
+            if changed is not False:
+                meta = self.tables['metadata'].get(1) or {}
+                self.executions.refresh(meta.get('executions_length', 0))
+
+    # applies the entries of the change log written since the last refresh
+    def refresh_sqlite(self):
+        with self.db.snapshot():
+            rev = self.db.revision()
+            if rev == self.rev:
+                return False
+
+            changes = self.db.changes_since(self.rev) if self.rev is not None else None
+            if changes is None:
+                self.logger.info(f'Loading database at revision {rev}')
+                for name in self.table_names:
+                    self.tables[name] = self.db.table(name)._read_table()
+                self.agreement_index = AgreementIndex(self.tables['agreements'])
+                self.rev = rev
+                return None
+
+            changed = {(tbl, doc_id) for tbl, doc_id in changes if tbl in self.tables}
+            for name in self.table_names:
+                doc_ids = {doc_id for tbl, doc_id in changed if tbl == name}
+                if not doc_ids:
+                    continue
+                docs = self.db.table(name).get_many(doc_ids)
+                for doc_id in doc_ids:
+                    old = self.tables[name].get(doc_id)
+                    if doc_id in docs:
+                        self.tables[name][doc_id] = docs[doc_id]
+                    else:
+                        self.tables[name].pop(doc_id, None)
+                    if name == 'agreements':
+                        self.agreement_index.update(doc_id, old, docs.get(doc_id))
+
+            self.rev = rev
+            return changed
+
+    # the json file can only be reloaded as a whole
+    def refresh_json(self):
+        try:
+            stat = os.stat(self.db.path)
+        except OSError:
+            return False
+
+        rev = f'{stat.st_mtime_ns}-{stat.st_size}'
+        if rev == self.rev:
+            return False
+
+        try:
+            data = self.db.storage.read() or {}
+        except ValueError:
+            # file is being written by the scheduler, keep serving the previous state
+            return False
+
+        for name in self.table_names:
+            self.tables[name] = {int(doc_id): doc for doc_id, doc in data.get(name, {}).items()}
+        self.agreement_index = AgreementIndex(self.tables['agreements'])
+        self.rev = rev
+        return None
@@ -1,13 +1,69 @@
 import json
-from flask import Flask, redirect, render_template
+import os
+import time
+import threading
+from flask import Flask, Response, g, redirect, render_template, request, jsonify
+
+from ..database import storage, archive, segments
+from ..database.indexes import AGREEMENT_STATES
+from .. import metrics
+from . import readmodel
 
 flask_app = Flask(__name__)
 
-def get_db():
-    f = open('app/database/db.json', 'r')
-    db = json.load(f)
-    f.close()
-    return db
+# served tables are kept in memory and only reloaded (incrementally) when the database changes
+# the database is opened read only once the engine has set it up, until then the api answers that it isn't ready
+model = None
+model_lock = threading.Lock()
+
+# metrics of the web process, served along with the ones written by the engine
+web_metrics = metrics.Registry()
+http_requests = web_metrics.counter('agreements_http_requests_total', 'Requests served by the web api, by endpoint and status')
+http_seconds = web_metrics.histogram('agreements_http_seconds', 'Time spent serving web api requests, by endpoint')
+
+@flask_app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+
+@flask_app.before_request
+def load_model():
+    global model
+    with model_lock:
+        if (model is None) and storage.initialized(storage.DEFAULT_PATH):
+            model = readmodel.ReadModel(storage.open_database(storage.DEFAULT_PATH, readonly=True))
+
+    if (model is None) and request.path.startswith('/api/'):
+        response = jsonify({'error': 'database not ready'})
+        response.status_code = 503
+        return response
+
+@flask_app.after_request
+def record_request(response):
+    endpoint = request.endpoint or 'none'
+    http_requests.inc(endpoint=endpoint, status=response.status_code)
+    http_seconds.observe(time.perf_counter() - g.start, endpoint=endpoint)
+    return response
+
+# returns a json response tagged with the database version, so clients can revalidate instead of refetching
+def respond(payload, etag=None):
+    response = jsonify(payload)
+    response.set_etag(etag or model.version)
+    return response.make_conditional(request)
+
+# returns a document of a served table, or None if it doesn't exist
+def lookup(table, id):
+    model.refresh()
+    try:
+        return model.tables.get(table, {}).get(int(id))
+    except ValueError:
+        return None
+
+# returns an archived contract, or None if there is none with that id
+def lookup_archived(id):
+    try:
+        return archive.get_archived(model.db, int(id))
+    except ValueError:
+        return None
 
 @flask_app.route('/')
 def root():
@@ -27,68 +83,223 @@ def help():
 
 @flask_app.route('/api/user/<id>')
 def get_user(id):
-    users = get_db()['accounts']
-    if id in users:
-        return users[id]
+    user = lookup('accounts', id)
+    if user is not None:
+        return respond(dict(user, **model.executions.history(id)))
     else:
-        return {'error': 'user not found'}
+        return respond({'error': 'user not found'})
 
 @flask_app.route('/api/contract/<id>')
 def get_contract(id):
-    contracts = get_db()['contracts']
-    if id in contracts:
-        return contracts[id]
+    contract = lookup('contracts', id)
+    if contract is not None:
+        return respond(contract)
+
+    # used up contracts are moved to the archive, which is read from the database (it isn't kept in memory)
+    contract = lookup_archived(id)
+    if contract is not None:
+        return respond(dict(contract, archived=True))
     else:
-        return {'error': 'contract not found'}
+        return respond({'error': 'contract not found'})
+
+# statuses are read from the database, or from their segment file once they are older than the retention period
+@flask_app.route('/api/status/<id>')
+def get_status(id):
+    model.refresh()
+    try:
+        status = segments.find_status(model.db, int(id))
+    except ValueError:
+        status = None
+
+    if status is not None:
+        return respond(dict(status, id=str(id)))
+    else:
+        return respond({'error': 'status not found'})
 
 @flask_app.route('/api/agreement/<id>')
 def get_agreement(id):
-    agreements = get_db()['agreements']
-    if id in agreements:
-        return agreements[id]
+    agreement = lookup('agreements', id)
+    if agreement is not None:
+        return respond(agreement)
     else:
-        return {'error': 'agreement not found'}
+        return respond({'error': 'agreement not found'})
+
+# page size of list endpoints, unless a smaller limit is asked for
+PAGE_LIMIT = 100
+
+# reads the cursor and limit of a paginated request, returns None if they aren't valid
+def page_args(default_limit=20):
+    try:
+        cursor = int(request.args['cursor']) if request.args.get('cursor') else None
+        limit = int(request.args.get('limit', default_limit))
+    except ValueError:
+        return None
+    if not (0 < limit <= PAGE_LIMIT):
+        return None
+    return cursor, limit
+
+# agreements of a page along with the cursor of the next one
+def agreement_page(ids, next_cursor):
+    agreements = []
+    for a_id in ids:
+        agreement = model.get('agreements', a_id)
+        if agreement is not None:
+            agreements.append(dict(agreement, id=str(a_id)))
+    return respond({'agreements': agreements, 'next_cursor': str(next_cursor) if next_cursor else None})
+
+# agreements a user created or is a member of, newest first, optionally only those in a state (open, disputed, closed)
+@flask_app.route('/api/user/<id>/agreements')
+def get_user_agreements(id):
+    model.refresh()
+    args = page_args()
+    state = request.args.get('state')
+    if (args is None) or not id.isdigit():
+        return respond({'error': 'invalid request'})
+    if (state is not None) and (state not in AGREEMENT_STATES):
+        return respond({'error': 'unknown state'})
+
+    cursor, limit = args
+    return agreement_page(*model.agreement_index.user_page(int(id), state, cursor, limit))
+
+# agreements in a state (ie all disputed agreements), newest first
+@flask_app.route('/api/agreements/<state>')
+def get_agreements_by_state(state):
+    model.refresh()
+    args = page_args()
+    if args is None:
+        return respond({'error': 'invalid request'})
+    if state not in AGREEMENT_STATES:
+        return respond({'error': 'unknown state'})
+
+    cursor, limit = args
+    return agreement_page(*model.agreement_index.state_page(state, cursor, limit))
 
+# tables that can be listed and exported, read from the database a page at a time (statuses and archived contracts
+# aren't kept in memory)
+LIST_TABLES = ['accounts', 'contracts', 'agreements', 'statuses', archive.ARCHIVE_TABLE]
+LIST_TABLES_RULE = 'any({}):table'.format(', '.join(LIST_TABLES))
+EXPORT_BATCH_SIZE = 500
+
+# fields asked for with ?fields=a,b, None for all of them
+def field_args():
+    fields = request.args.get('fields')
+    return [field for field in fields.split(',') if field] if fields else None
+
+# a document as listed, with its id and only the requested fields
+def project(doc, fields):
+    row = {'id': str(doc.doc_id)}
+    if fields is None:
+        row.update(doc)
+    else:
+        row.update((field, doc[field]) for field in fields if field in doc)
+    return row
+
+# lists a table in id order, pages continue after the cursor (the last id of the previous page)
+@flask_app.route(f'/api/<{LIST_TABLES_RULE}>')
+def list_table(table):
+    model.refresh()
+    args = page_args()
+    if args is None:
+        return respond({'error': 'invalid request'})
+
+    cursor, limit = args
+    # one extra document tells whether there is a next page
+    docs = model.db.table(table).page(cursor or 0, limit + 1)
+    next_cursor = str(docs[limit - 1].doc_id) if len(docs) > limit else None
+    fields = field_args()
+    return respond({table: [project(doc, fields) for doc in docs[:limit]], 'next_cursor': next_cursor})
+
+# streams a whole table (or what comes after the cursor) as newline delimited json, one document per line
+# documents are read a batch at a time, so memory use doesn't grow with the table
+@flask_app.route(f'/api/export/<{LIST_TABLES_RULE}>')
+def export_table(table):
+    args = page_args()
+    if args is None:
+        return respond({'error': 'invalid request'})
+
+    cursor, _ = args
+    fields = field_args()
+    db_table = model.db.table(table)
+
+    def rows():
+        after = cursor or 0
+        while True:
+            docs = db_table.page(after, EXPORT_BATCH_SIZE)
+            for doc in docs:
+                yield json.dumps(project(doc, fields)) + '\n'
+            if len(docs) < EXPORT_BATCH_SIZE:
+                return
+            after = docs[-1].doc_id
+
+    return Response(rows(), mimetype='application/x-ndjson')
+
+# accounts that had a contract executed on a status, from the execution log
 @flask_app.route('/api/execution/<id>')
 def get_execution(id):
-    executions = get_db()['executions']
-    if id in executions:
-        return executions[id]
+    model.refresh()
+    try:
+        execution = model.executions.executed_on(int(id))
+    except ValueError:
+        execution = None
+
+    if execution is not None:
+        return respond(dict(execution, id=str(id)))
     else:
-        return {'error': 'execution not found'}
+        return respond({'error': 'execution not found'})
 
 @flask_app.route('/api/metadata')
 def get_metadata():
-    return get_db()['metadata']
+    model.refresh()
+    return respond({str(doc_id): doc for doc_id, doc in model.tables['metadata'].items()})
+
+# totals of the economy, maintained by the engine as it goes
+@flask_app.route('/api/stats')
+def get_stats():
+    model.refresh()
+    stats = dict(model.tables['stats'].get(1) or {})
+    stats.pop('stats_version', None)
+    return respond(stats)
+
+# number of agreements shown on the home page
+LATEST_COUNT = 10
+BLOCKLIST_PATH = 'app/web/blocklist.json'
 
+# filtered home page feed, recomputed only when the feed or the blocklist changes
+latest_cache = {'feed': None, 'blocklist': None, 'urls': {}}
 
 @flask_app.route('/api/latest_agreements')
 def latest_agreements():
-    with open('app/database/db.json', 'r') as f:
-        db = json.load(f)
-    with open('app/web/blocklist.json', 'r') as f:
-        blocklist = json.load(f)
-    agreements = db['agreements']
-    blocked_users = blocklist['blocked_users']
-    
-    # retrieves status urls of 10 most recent agreements
-    urls = []
-    count = 0
-    for s in list(agreements.keys())[1:]:
-        if count > 10:
-            break
-
-        a = agreements[s]
-        name = a['creator_screen_name']
-
-        # adds users to list of urls displayed on home page if they aren't on the block list
-        if name not in blocked_users:
-            url = f'https://twitter.com/{name}/status/{s}'
-            urls.append(url)
-
-        count += 1
-    print(urls)
-    # converts list to json recognizable dictionary
-    return dict(zip(range(0, 10), urls[::-1]))
+    model.refresh()
+    feed = model.tables['feed'].get(1)
+    blocklist_version = os.stat(BLOCKLIST_PATH).st_mtime_ns
+
+    # the read model replaces the feed document whenever it changes
+    if (latest_cache['feed'] is not feed) or (latest_cache['blocklist'] != blocklist_version):
+        with open(BLOCKLIST_PATH, 'r') as f:
+            blocked_users = set(json.load(f)['blocked_users'])
+
+        # urls of the most recent agreements (newest first), skipping users on the block list
+        urls = [
+            f'https://twitter.com/{a["creator_screen_name"]}/status/{a["id"]}'
+            for a in (feed['latest'] if feed else [])
+            if a['creator_screen_name'] not in blocked_users
+        ][:LATEST_COUNT]
+
+        # converts list to json recognizable dictionary
+        latest_cache['urls'] = dict(zip(range(0, LATEST_COUNT), urls))
+        latest_cache['feed'] = feed
+        latest_cache['blocklist'] = blocklist_version
+
+    return respond(latest_cache['urls'], f'{model.version}-{blocklist_version}')
+
+# prometheus text format metrics of the engine (from the last file it wrote) and of this process
+@flask_app.route('/metrics')
+def get_metrics():
+    try:
+        with open(metrics.DEFAULT_PATH, 'r') as f:
+            engine = f.read()
+    except FileNotFoundError:
+        engine = ''
+    return Response(engine + web_metrics.render(), mimetype='text/plain; version=0.0.4')
 
 # flask_app.run(host="127.0.0.1", port=80, debug=True)
\ No newline at end of file
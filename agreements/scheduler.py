@@ -7,18 +7,35 @@ import sys
 
 sys.path.append(Path(__file__).parent.absolute())
 
-from app.database import update
+from app import core, metrics
+from app.database import update, outbox, sources, deadlines, archive, segments
 
 logger = logging.getLogger('app.scheduler')
 
 s = sched.scheduler(time.time, time.sleep)
 
+# where new mentions come from, polling adapts its interval to recent activity
+source = sources.PollingSource(core.api)
+
+# statuses from different accounts are parsed concurrently by this many threads
+# serial until a benchmark (app.sim.bench) shows the sharded mode gaining anything on a real workload
+WORKERS = 1
+
+# exhausted contracts are moved to the archive and old statuses to segment files this often (seconds)
+MAINTENANCE_INTERVAL = 3600
+
+# metrics are written here after every update for the web server to serve at /metrics
+METRICS_PATH = metrics.DEFAULT_PATH
+# set to a path to log a json trace of every parsed status (time, database reads and writes, api calls)
+TRACE_PATH = None
+metrics.trace_to(TRACE_PATH)
+
 def scheduled_update(sc):
-    s.enter(60, 1, scheduled_update, (sc,))
     before = time.time()
+    num_processed = 0
     
     try:
-        num_processed, last_status = update.run()
+        num_processed, last_status = update.run(source, WORKERS)
 
         # only sends update if new statuses were processed so the console doesn't get spammed
         if num_processed > 0:
@@ -27,5 +44,35 @@ def scheduled_update(sc):
     except Exception as e:
         logger.warn(traceback.format_exc())
 
+    # agreements past their deadline are expired in batches, found through the deadline heap
+    try:
+        deadlines.expire_due()
+    except Exception as e:
+        logger.warn(traceback.format_exc())
+
+    try:
+        metrics.registry.write(METRICS_PATH)
+    except OSError as e:
+        logger.warn(f'Could not write metrics: {e}')
+
+    s.enter(source.next_interval(num_processed), 1, scheduled_update, (sc,))
+
+def scheduled_maintenance(sc):
+    try:
+        archive.compact(core.db)
+    except Exception as e:
+        logger.warn(traceback.format_exc())
+
+    try:
+        segments.retain(core.db, core.Consts.status_retention_days)
+    except Exception as e:
+        logger.warn(traceback.format_exc())
+
+    s.enter(MAINTENANCE_INTERVAL, 2, scheduled_maintenance, (sc,))
+
+# replies are sent in the background so a slow or throttled twitter api doesn't hold up parsing
+outbox.Worker(core.db, core.api).start()
+
 s.enter(0, 1, scheduled_update, (s,))
+s.enter(MAINTENANCE_INTERVAL, 2, scheduled_maintenance, (s,))
 s.run()
\ No newline at end of file
@@ -0,0 +1,64 @@
+import os
+import sys
+import logging
+
+import pytest
+
+# the app is run from its own directory (config and key files are opened relative to it)
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'agreements')
+sys.path.insert(0, APP_DIR)
+
+# forgets the api, database and configuration core has loaded, so the next use loads them again
+def reset_core():
+    from app import core
+
+    db = core.__dict__.pop('db', None)
+    if db is not None:
+        db.close()
+    for name in core.RESOURCES:
+        core.__dict__.pop(name, None)
+    for name in core.CONFIG:
+        if name in core.Consts.__dict__:
+            delattr(core.Consts, name)
+
+@pytest.fixture(params=['sqlite', 'json'])
+def backend(request):
+    return request.param
+
+# path the database of a test is kept at, for the backend it runs on
+@pytest.fixture
+def db_path(tmp_path, backend):
+    return str(tmp_path / ('db.json' if backend == 'json' else 'db.sqlite3'))
+
+# app.core pointed at a fake twitter api and a new database, returns (core, api)
+@pytest.fixture
+def engine(tmp_path, db_path, monkeypatch):
+    from app.auth import auth
+    from app.database import storage
+    from app.sim.fakeapi import FakeAPI
+
+    monkeypatch.chdir(APP_DIR)
+    # keeps core from logging to last.log in the app directory
+    app_logger = logging.getLogger('app')
+    if not app_logger.handlers:
+        app_logger.addHandler(logging.NullHandler())
+
+    api = FakeAPI()
+    monkeypatch.setattr(auth, 'installed', api)
+    monkeypatch.setattr(storage, 'DEFAULT_PATH', db_path)
+    monkeypatch.setattr(storage, 'LEGACY_PATH', str(tmp_path / 'legacy.json'))
+
+    reset_core()
+    from app import core
+    yield core, api
+    reset_core()
+
+# test client of the web api, reading the database of the engine fixture
+@pytest.fixture
+def web(engine, monkeypatch):
+    from app.web import server
+
+    monkeypatch.setattr(server, 'model', None)
+    yield server.flask_app.test_client()
+    if server.model is not None:
+        server.model.db.close()
@@ -0,0 +1,80 @@
+from app.database import deadlines, indexes
+from app.database.parser import Parser
+from app.database.records import AgreementRecord
+from app.database.stats import Stats, economy_stats
+from app.objs.account import Account
+
+def fund(core, user, amount):
+    with core.db.transaction():
+        Account(user).change_balance(user.id, amount, 'payout')
+
+def balance(core, user):
+    return core.db.table('accounts').get(doc_id=user.id)['balance']
+
+# alice puts 5 TSC on an agreement with bob, returns (parser, alice, bob, agreement status)
+def agreement(engine):
+    core, api = engine
+    parser = Parser(core.db, core.api)
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    bob = api.add_user(api.next_id(), 'bob', 10)
+    fund(core, alice, 10)
+    status = api.mention(alice, f'@{api.engine.screen_name} agreement 5 TSC with @bob', mentions=[bob])
+    parser.parse(status)
+    assert balance(core, alice) == 5
+    return parser, alice, bob, status
+
+def expire(core, status):
+    entry = AgreementRecord.load(core.db.table('agreements'), status.id)
+    assert deadlines.expire_due(entry.deadline) == 1
+    return AgreementRecord.load(core.db.table('agreements'), status.id)
+
+# the statistics and state index kept up to date match the ones built from scratch
+def assert_consistent(core):
+    kept = economy_stats(core.db).get()
+    with core.db.transaction():
+        stats = Stats(core.db)
+        stats.rebuild()
+    assert stats.get() == kept
+
+    built = indexes.AgreementIndex(core.db.table('agreements')._read_table())
+    for state in ('open', 'disputed', 'closed', 'expired'):
+        assert list(built.ids('state', state)) == list(indexes.agreement_index(core.db).ids('state', state))
+
+# a single vote cast before the deadline stands
+def test_lone_vote_settles_on_expiry(engine):
+    core, api = engine
+    parser, alice, bob, status = agreement(engine)
+    parser.parse(api.mention(bob, f'@{api.engine.screen_name} broken', in_reply_to=status.id))
+
+    entry = expire(core, status)
+    assert entry.state == 'closed'
+    assert balance(core, alice) == 5
+    assert balance(core, bob) == 5
+    assert economy_stats(core.db).values['broken_agreements'] == 1
+    assert_consistent(core)
+
+# the creator conceding pays a member that never used the engine
+def test_lone_creator_vote_pays_new_member(engine):
+    core, api = engine
+    parser, alice, bob, status = agreement(engine)
+    assert not core.db.table('accounts').contains(doc_id=bob.id)
+    parser.parse(api.mention(alice, f'@{api.engine.screen_name} broken', in_reply_to=status.id))
+
+    assert expire(core, status).state == 'closed'
+    assert balance(core, bob) == 5
+    assert_consistent(core)
+
+# a dispute still open at the deadline expires and gives the collateral back
+def test_dispute_expires(engine):
+    core, api = engine
+    parser, alice, bob, status = agreement(engine)
+    parser.parse(api.mention(alice, f'@{api.engine.screen_name} upheld', in_reply_to=status.id))
+    parser.parse(api.mention(bob, f'@{api.engine.screen_name} broken', in_reply_to=status.id))
+    assert AgreementRecord.load(core.db.table('agreements'), status.id).state == 'disputed'
+
+    entry = expire(core, status)
+    assert entry.state == 'expired'
+    assert balance(core, alice) == 10
+    assert balance(core, bob) == 0
+    assert economy_stats(core.db).values['expired_agreements'] == 1
+    assert_consistent(core)
@@ -0,0 +1,96 @@
+import tweepy
+
+from app.auth import cache
+from app.sim.fakeapi import FakeAPI
+
+# fake api counting the requests made to it
+class CountingAPI(FakeAPI):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def get_status(self, id, **kwargs):
+        self.calls.append('get_status')
+        return super().get_status(id, **kwargs)
+
+    def get_user(self, id=None, **kwargs):
+        self.calls.append('get_user')
+        return super().get_user(id, **kwargs)
+
+    def lookup_users(self, user_ids=None, **kwargs):
+        self.calls.append(('lookup_users', len(user_ids)))
+        return super().lookup_users(user_ids, **kwargs)
+
+# entries are dropped once their time is up, and the least recently used one once the cache is full
+def test_ttl_cache(monkeypatch):
+    clock = [0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: clock[0])
+    ttl = cache.TTLCache(10, maxsize=2)
+
+    ttl.put('a', 1)
+    ttl.put('b', 2)
+    clock[0] = 5
+    assert ttl.get('a') == 1
+    ttl.put('c', 3)
+    assert 'b' not in ttl
+    assert 'a' in ttl
+
+    clock[0] = 11
+    assert ttl.get('a') is None
+    assert ttl.get('c') == 3
+
+def test_statuses_and_their_authors_are_cached():
+    api = CountingAPI()
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    status = api.mention(alice, 'hello')
+    cached = cache.CachedAPI(api)
+
+    assert cached.get_status(status.id).id == status.id
+    assert cached.get_status(status.id).id == status.id
+    assert cached.get_user(alice.id).id == alice.id
+    assert api.calls == ['get_status']
+
+    # other tweet modes are looked up separately
+    cached.get_status(status.id, tweet_mode='extended')
+    assert api.calls == ['get_status', 'get_status']
+
+def test_entries_expire(monkeypatch):
+    clock = [0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: clock[0])
+    api = CountingAPI()
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    cached = cache.CachedAPI(api, user_ttl=60)
+
+    cached.get_user(alice.id)
+    clock[0] = 30
+    cached.get_user(alice.id)
+    clock[0] = 61
+    cached.get_user(alice.id)
+    assert api.calls == ['get_user', 'get_user']
+
+# uncached users are looked up in batches of at most 100, users already cached aren't looked up again
+def test_prefetch_users():
+    api = CountingAPI()
+    users = [api.add_user(api.next_id(), f'user{i}', 10) for i in range(150)]
+    cached = cache.CachedAPI(api)
+    cached.get_user(users[0].id)
+
+    cached.prefetch_users([user.id for user in users] + [users[1].id])
+    assert api.calls == ['get_user', ('lookup_users', 100), ('lookup_users', 49)]
+
+    for user in users:
+        assert cached.get_user(user.id).id == user.id
+    assert len(api.calls) == 3
+
+# users whose lookup failed are looked up one by one instead
+def test_failed_prefetch_falls_back(monkeypatch):
+    api = CountingAPI()
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    def refuse(user_ids=None, **kwargs):
+        raise tweepy.error.TweepError('over capacity', api_code=130)
+    monkeypatch.setattr(api, 'lookup_users', refuse)
+    cached = cache.CachedAPI(api)
+
+    cached.prefetch_users([alice.id])
+    assert cached.get_user(alice.id).id == alice.id
+    assert api.calls == ['get_user']
@@ -0,0 +1,50 @@
+import pytest
+
+from app.database import commands
+from app.database.commands import Command, parse_text
+from app.database.parser import Parser
+from app.objs.account import Account
+
+BOB = {'id': 2, 'id_str': '2', 'screen_name': 'bob'}
+
+@pytest.mark.parametrize('text, command', [
+    ('@engine balance', Command('balance')),
+    ('@engine what is my balance please', Command('balance')),
+    ('@engine hello', Command()),
+    # defaults of arguments left out
+    ('@engine generate', Command('generate', 10, 'like')),
+    ('@engine generate 3', Command('generate', 3, 'like')),
+    ('@engine generate 3 retweets', Command('generate', 3, 'retweet')),
+    ('@engine agreement with @bob', Command('agreement', 0, 'none', mentions=[BOB])),
+    ('@engine agreement 50 with @bob', Command('agreement', 50, 'TSC', mentions=[BOB])),
+    ('@engine agreement 5 likes @bob for 2 weeks', Command('agreement', 5, 'like', 2 * 604800, mentions=[BOB])),
+    ('@engine agreement @bob for two weeks', Command('agreement', 0, 'none', mentions=[BOB])),
+    ('@engine execute 4', Command('execute', 4)),
+    ('@engine send 5 @bob', Command('send', 5, mentions=[BOB])),
+    # only the first keyword counts
+    ('@engine send 5 @bob upheld', Command('send', 5, mentions=[BOB])),
+    ('@engine upheld send 5', Command('upheld')),
+])
+def test_grammar(text, command):
+    mentions = [BOB] if '@bob' in text else ()
+    assert parse_text(text, mentions) == command
+
+# amounts are plain digits, anything signed or fractional is no amount at all
+@pytest.mark.parametrize('word', ['-5', '+5', '5.0', '1e3', '٥', 'five'])
+def test_invalid_amounts(word):
+    assert commands.to_amount(word) is None
+    assert parse_text(f'@engine send {word} @bob', [BOB]).amount is None
+    assert parse_text(f'@engine execute {word}').amount is None
+
+def test_negative_send_moves_nothing(engine):
+    core, api = engine
+    parser = Parser(core.db, core.api)
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    bob = api.add_user(api.next_id(), 'bob', 10)
+    parser.parse(api.mention(bob, f'@{api.engine.screen_name} balance'))
+    with core.db.transaction():
+        Account(alice).change_balance(alice.id, 10, 'payout')
+
+    parser.parse(api.mention(alice, f'@{api.engine.screen_name} send -5 @bob', mentions=[bob]))
+    assert core.db.table('accounts').get(doc_id=alice.id)['balance'] == 10
+    assert core.db.table('accounts').get(doc_id=bob.id)['balance'] == 0
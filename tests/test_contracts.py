@@ -0,0 +1,100 @@
+from app.database import archive
+from app.database.parser import Parser
+from app.objs import contract
+from app.objs.account import Account
+
+def fund(core, user, amount):
+    with core.db.transaction():
+        Account(user).change_balance(user.id, amount, 'payout')
+
+def balance(core, user):
+    return core.db.table('accounts').get(doc_id=user.id)['balance']
+
+def replies(core, status):
+    return [doc['message'] for doc in core.db.table('outbox').all() if doc['in_reply_to'] == str(status.id)]
+
+# the count index follows generated contracts, including resized ones, and is loaded back from its table
+def test_contract_counts(engine):
+    core, api = engine
+    parser = Parser(core.db, core.api)
+    alice = api.add_user(api.next_id(), 'alice', 10)
+
+    parser.parse(api.mention(alice, f'@{api.engine.screen_name} generate 4 likes'))
+    parser.parse(api.mention(alice, f'@{api.engine.screen_name} generate 3 likes'))
+    parser.parse(api.mention(alice, f'@{api.engine.screen_name} generate 2 retweets'))
+    assert contract.Pool().count_user_contracts('like', alice.id) == 7
+    assert contract.Pool().count_user_contracts('retweet', alice.id) == 2
+
+    # over the limit of 10 likes, resized to what's left
+    status = api.mention(alice, f'@{api.engine.screen_name} generate 5 likes')
+    parser.parse(status)
+    assert core.db.table('contracts').get(doc_id=status.id)['count'] == 3
+    assert contract.Pool().count_user_contracts('like', alice.id) == 10
+
+    assert contract.CountIndex(core.db).counts == contract.count_index().counts
+
+# contracts are executed cheapest first, and execution stops at the first one the amount left can't pay for
+def test_cheapest_contracts_are_executed_first(engine):
+    core, api = engine
+    parser = Parser(core.db, core.api)
+    owners = [api.add_user(api.next_id(), f'owner{followers}', followers) for followers in (3, 1, 2)]
+    for owner in owners:
+        parser.parse(api.mention(owner, f'@{api.engine.screen_name} generate 1 likes'))
+    contracts = {doc['user_id']: doc_id for doc_id, doc in core.db.table('contracts')._read_table().items() if doc_id}
+
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    fund(core, alice, 4)
+    post = api.mention(owners[0], 'a post')
+    parser.parse(api.mention(alice, f'@{api.engine.screen_name} execute 4', in_reply_to=post.id))
+
+    used = {owner.screen_name: core.db.table('contracts').get(doc_id=contracts[str(owner.id)])['count'] == 0
+            for owner in owners}
+    assert used == {'owner3': False, 'owner1': True, 'owner2': True}
+    assert balance(core, alice) == 1
+
+# an execution that doesn't reply to a post is answered without charging anything
+def test_execute_without_post(engine):
+    core, api = engine
+    parser = Parser(core.db, core.api)
+    owner = api.add_user(api.next_id(), 'owner', 1)
+    parser.parse(api.mention(owner, f'@{api.engine.screen_name} generate 1 likes'))
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    fund(core, alice, 4)
+
+    status = api.mention(alice, f'@{api.engine.screen_name} execute 4')
+    parser.parse(status)
+
+    assert balance(core, alice) == 4
+    assert len(contract.execution_queue()) == 1
+    assert any('Reply to the post' in message for message in replies(core, status))
+
+# used up contracts move to the archive, where the web api still finds them, live ones and collateral stay
+def test_exhausted_contracts_are_archived(engine, web):
+    core, api = engine
+    parser = Parser(core.db, core.api)
+    owner = api.add_user(api.next_id(), 'owner', 1)
+    used = api.mention(owner, f'@{api.engine.screen_name} generate 1 likes')
+    live = api.mention(owner, f'@{api.engine.screen_name} generate 1 retweets')
+    parser.parse(used)
+    parser.parse(live)
+    bob = api.add_user(api.next_id(), 'bob', 10)
+    collateral = api.mention(owner, f'@{api.engine.screen_name} agreement 2 likes with @bob', mentions=[bob])
+    parser.parse(collateral)
+
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    fund(core, alice, 1)
+    parser.parse(api.mention(alice, f'@{api.engine.screen_name} execute 1', in_reply_to=api.mention(bob, 'a post').id))
+    assert core.db.table('contracts').get(doc_id=used.id)['count'] == 0
+    counts = contract.count_index().counts
+
+    assert archive.compact(core.db) == 1
+    assert not core.db.table('contracts').contains(doc_id=used.id)
+    assert archive.get_archived(core.db, used.id)['count'] == 0
+    assert core.db.table('contracts').contains(doc_id=live.id)
+    assert core.db.table('contracts').contains(doc_id=collateral.id)
+    assert contract.CountIndex(core.db).counts == counts
+    assert archive.compact(core.db) == 0
+
+    response = web.get(f'/api/contract/{used.id}').json
+    assert response['archived'] is True
+    assert 'archived' not in web.get(f'/api/contract/{live.id}').json
@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+from app.database import executions, storage
+from app.database.parser import Parser
+
+def setup(engine):
+    core, _ = engine
+    Parser(core.db, core.api)
+    with core.db.transaction():
+        executions.execution_log(core.db).add(1, 'like', 100)
+    return core
+
+# records past the committed length (a transaction that crashed before committing) are dropped when the log is opened
+def test_uncommitted_records_are_truncated(engine):
+    core = setup(engine)
+    log = executions.execution_log(core.db)
+    size = os.path.getsize(log.path)
+    with open(log.path, 'ab') as f:
+        f.write(executions.RECORD.pack(1, 0, 200))
+        f.write(executions.RECORD.pack(2, 1, 200)[:5])
+
+    storage.invalidate(core.db)
+    log = executions.execution_log(core.db)
+    assert os.path.getsize(log.path) == size
+    assert 100 in log.executed(1, 'like')
+    assert 200 not in log.executed(1, 'like')
+    assert log.executed_on(200) is None
+
+    # appending continues from the committed end
+    with core.db.transaction():
+        log.add(2, 'retweet', 200)
+    reader = executions.ExecutionLog(core.db, readonly=True)
+    reader.refresh(reader.committed_length())
+    assert reader.executed_on(200) == {'likes': [], 'retweets': ['2']}
+
+def test_rolled_back_records_are_forgotten(engine):
+    core = setup(engine)
+
+    with pytest.raises(RuntimeError):
+        with core.db.transaction():
+            executions.execution_log(core.db).add(1, 'like', 300)
+            raise RuntimeError('failed status')
+
+    log = executions.execution_log(core.db)
+    assert 300 not in log.executed(1, 'like')
+    assert log.length == os.path.getsize(log.path) == log.committed_length()
@@ -0,0 +1,52 @@
+import pytest
+
+from app.database import indexes
+from app.database.parser import Parser
+
+def sets(index):
+    return {key: list(ids) for key, ids in index.sets.items() if len(ids)}
+
+# the index kept up to date matches one built from the agreements table
+def assert_consistent(core):
+    built = indexes.AgreementIndex(core.db.table('agreements')._read_table())
+    assert sets(indexes.agreement_index(core.db)) == sets(built)
+
+def test_index_follows_agreements(engine):
+    core, api = engine
+    parser = Parser(core.db, core.api)
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    bob = api.add_user(api.next_id(), 'bob', 10)
+    first = api.mention(alice, f'@{api.engine.screen_name} agreement with @bob', mentions=[bob])
+    second = api.mention(bob, f'@{api.engine.screen_name} agreement with @alice', mentions=[alice])
+    parser.parse(first)
+    parser.parse(second)
+    parser.parse(api.mention(alice, f'@{api.engine.screen_name} upheld', in_reply_to=first.id))
+    parser.parse(api.mention(bob, f'@{api.engine.screen_name} upheld', in_reply_to=first.id))
+
+    index = indexes.agreement_index(core.db)
+    assert list(index.ids('state', 'closed')) == [first.id]
+    assert list(index.ids('state', 'open')) == [second.id]
+    assert list(index.user_ids(alice.id)) == [second.id, first.id]
+    assert_consistent(core)
+
+# agreements created and votes cast by a failed status are dropped from the index along with the rest of its changes
+def test_index_after_rollback(engine):
+    core, api = engine
+    parser = Parser(core.db, core.api)
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    bob = api.add_user(api.next_id(), 'bob', 10)
+    first = api.mention(alice, f'@{api.engine.screen_name} agreement with @bob', mentions=[bob])
+    parser.parse(first)
+    parser.parse(api.mention(alice, f'@{api.engine.screen_name} upheld', in_reply_to=first.id))
+
+    with pytest.raises(RuntimeError):
+        with core.db.transaction():
+            parser.parse(api.mention(bob, f'@{api.engine.screen_name} upheld', in_reply_to=first.id))
+            parser.parse(api.mention(bob, f'@{api.engine.screen_name} agreement with @alice', mentions=[alice]))
+            raise RuntimeError('failed status')
+
+    index = indexes.agreement_index(core.db)
+    assert list(index.ids('state', 'open')) == [first.id]
+    assert not index.ids('state', 'closed')
+    assert list(index.user_ids(bob.id)) == [first.id]
+    assert_consistent(core)
@@ -0,0 +1,70 @@
+import os
+import json
+
+import pytest
+
+from app.database import ledger, storage
+from app.database.parser import Parser
+from app.objs.account import Account
+
+def setup(engine):
+    core, api = engine
+    Parser(core.db, core.api)
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    with core.db.transaction():
+        Account(alice).change_balance(alice.id, 10, 'payout')
+    return core, alice
+
+# balances as of any time after the journal started, from the latest snapshot before it and the entries after
+def test_balance_at(engine, monkeypatch):
+    clock = [1000]
+    monkeypatch.setattr(ledger.time, 'time', lambda: clock[0])
+    core, alice = setup(engine)
+
+    clock[0] = 2000
+    with core.db.transaction():
+        Account(alice.id).change_balance(alice.id, -3, 'transfer')
+
+    journal = ledger.balance_ledger(core.db)
+    assert journal.balance_at(alice.id, 999) is None
+    assert journal.balance_at(alice.id, 1500) == 10
+    assert journal.balance_at(alice.id, 2000) == 7
+    assert journal.verify() == {}
+
+def test_verify_after_rollback(engine):
+    core, alice = setup(engine)
+
+    with pytest.raises(RuntimeError):
+        with core.db.transaction():
+            Account(alice.id).change_balance(alice.id, 5, 'payout')
+            raise RuntimeError('failed status')
+
+    assert core.db.table('accounts').get(doc_id=alice.id)['balance'] == 10
+    assert ledger.balance_ledger(core.db).verify() == {}
+
+# entries of a transaction that crashed before committing (complete, then torn) are dropped when the journal is opened
+def test_verify_after_crash(engine):
+    core, alice = setup(engine)
+    journal = ledger.balance_ledger(core.db)
+    size = os.path.getsize(journal.journal_path)
+    entry = {'seq': journal.seq + 1, 'ts': 0, 'account': str(alice.id), 'amount': 5, 'kind': 'payout', 'ref': None}
+    with open(journal.journal_path, 'ab') as f:
+        f.write((json.dumps(entry) + '\n').encode())
+        f.write(b'{"seq": ')
+
+    storage.invalidate(core.db)
+    journal = ledger.balance_ledger(core.db)
+    assert journal.verify() == {}
+    assert journal.balances[alice.id] == 10
+    assert os.path.getsize(journal.journal_path) == size
+
+# balances written behind the journal's back (ie an old copy of the database) are put back from it
+def test_restore(engine):
+    core, alice = setup(engine)
+    with core.db.transaction():
+        core.db.table('accounts').update({'balance': 3}, doc_ids=[alice.id])
+
+    journal = ledger.balance_ledger(core.db)
+    assert journal.verify() == {alice.id: (3, 10)}
+    assert journal.restore() == {}
+    assert core.db.table('accounts').get(doc_id=alice.id)['balance'] == 10
@@ -0,0 +1,66 @@
+import os
+import json
+
+import pytest
+
+from app.database import schema, storage
+
+LEGACY = {
+    'metadata': {'1': {'genesis_status': '1399390246119280700', 'last_status_parsed': '1399390246119280700',
+                       'like_value': '1', 'like_limit': '10', 'retweet_value': '5', 'retweet_limit': '10',
+                       'tax_rate': '0.05'}},
+    'accounts': {'0': {'num_accounts': '1'}, '10': {'full_name': 'alice', 'screen_name': 'alice', 'balance': '3',
+                                                   'contracts': []}}
+}
+
+@pytest.fixture
+def legacy(engine):
+    with open(storage.LEGACY_PATH, 'w') as f:
+        json.dump(LEGACY, f)
+    return engine
+
+@pytest.fixture
+def web(monkeypatch):
+    from app.web import server
+    monkeypatch.setattr(server, 'model', None)
+    return server.flask_app.test_client()
+
+@pytest.mark.parametrize('backend', ['sqlite'])
+def test_legacy_database_is_migrated(legacy):
+    core, _ = legacy
+    assert core.db.table('accounts').get(doc_id=10)['balance'] == 3
+    assert core.db.table('metadata').get(doc_id=1)['schema_version'] == schema.SCHEMA_VERSION
+    assert core.db.table('metadata').get(doc_id=1)['status_retention_days'] == 30
+
+# the web process starting first neither creates the database nor keeps the engine from migrating
+@pytest.mark.parametrize('backend', ['sqlite'])
+def test_web_process_waits_for_migration(legacy, web):
+    core, _ = legacy
+    response = web.get('/api/user/10')
+    assert response.status_code == 503
+    assert not os.path.exists(storage.DEFAULT_PATH)
+
+    core.db
+    response = web.get('/api/user/10')
+    assert response.status_code == 200
+    assert response.get_json()['balance'] == 3
+
+# an empty database (ie left by an older web process) has no metadata, the legacy one is migrated over it
+@pytest.mark.parametrize('backend', ['sqlite'])
+def test_empty_database_is_replaced(legacy):
+    core, _ = legacy
+    storage.SQLiteDB(storage.DEFAULT_PATH).close()
+    assert not storage.initialized(storage.DEFAULT_PATH)
+
+    assert core.db.table('accounts').get(doc_id=10)['balance'] == 3
+
+@pytest.mark.parametrize('backend', ['sqlite'])
+def test_set_up_database_is_not_migrated_again(legacy):
+    from conftest import reset_core
+
+    core, _ = legacy
+    with core.db.transaction():
+        core.db.table('accounts').update({'balance': 8}, doc_ids=[10])
+    reset_core()
+
+    assert core.db.table('accounts').get(doc_id=10)['balance'] == 8
@@ -0,0 +1,86 @@
+import pytest
+import tweepy
+
+from app.database import outbox
+from app.sim.fakeapi import FakeAPI
+
+# fake api failing the next updates with the given twitter error codes
+class FailingAPI(FakeAPI):
+    def __init__(self, *codes):
+        super().__init__()
+        self.codes = list(codes)
+
+    def update_status(self, status=None, in_reply_to_status_id=None, **kwargs):
+        if self.codes:
+            raise tweepy.error.TweepError('failed', api_code=self.codes.pop(0))
+        return super().update_status(status, in_reply_to_status_id, **kwargs)
+
+def queue(core, *messages):
+    with core.db.transaction():
+        for message in messages:
+            outbox.Outbox(core.db).enqueue(message)
+
+def states(core):
+    return {doc['message']: doc['state'] for doc in core.db.table('outbox').all()}
+
+# every due message goes out in a single drain, in the order it was queued
+def test_drain_sends_in_order(engine):
+    core, _ = engine
+    api = FailingAPI()
+    queue(core, 'one', 'two', 'three')
+
+    assert outbox.Worker(core.db, api).drain() == 5
+    assert [status for status, _ in api.sent] == ['one', 'two', 'three']
+    assert set(states(core).values()) == {'sent'}
+
+@pytest.mark.parametrize('code', [130, 131])
+def test_transient_error_is_retried(engine, code):
+    core, _ = engine
+    api = FailingAPI(code)
+    queue(core, 'one', 'two')
+    worker = outbox.Worker(core.db, api)
+
+    assert worker.drain() > 0
+    assert states(core) == {'one': 'pending', 'two': 'sent'}
+    retried = core.db.table('outbox').get(doc_id=1)
+    assert retried['attempts'] == 1
+
+    core.db.table('outbox').update({'next_attempt': 0}, doc_ids=[1])
+    worker.drain()
+    assert states(core) == {'one': 'sent', 'two': 'sent'}
+    assert [status for status, _ in api.sent] == ['two', 'one']
+
+# a duplicate was already posted, it isn't sent again
+def test_duplicate_is_marked_sent(engine):
+    core, _ = engine
+    api = FailingAPI(outbox.DUPLICATE_CODE)
+    queue(core, 'one')
+
+    outbox.Worker(core.db, api).drain()
+    assert states(core) == {'one': 'sent'}
+    assert not api.sent
+
+@pytest.mark.parametrize('code', [88, 185])
+def test_rate_limit_pauses(engine, code):
+    core, _ = engine
+    api = FailingAPI(code)
+    queue(core, 'one', 'two')
+
+    assert outbox.Worker(core.db, api).drain() == pytest.approx(15 * 60, abs=5)
+    assert states(core) == {'one': 'pending', 'two': 'pending'}
+    assert not api.sent
+
+# the queue is read once per pass rather than once per message, and pruned once per drain
+def test_drain_reads_queue_once_per_pass(engine, monkeypatch):
+    core, _ = engine
+    queue(core, *[str(i) for i in range(10)])
+    calls = {'pending': 0, 'prune': 0}
+    for name in calls:
+        method = getattr(outbox.Outbox, name)
+        def counted(self, *args, name=name, method=method):
+            calls[name] += 1
+            return method(self, *args)
+        monkeypatch.setattr(outbox.Outbox, name, counted)
+
+    outbox.Worker(core.db, FailingAPI()).drain()
+    assert calls == {'pending': 2, 'prune': 1}
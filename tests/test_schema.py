@@ -0,0 +1,53 @@
+import time
+
+from app.database import schema, deadlines, storage
+from app.database.parser import Parser
+from app.database.records import AgreementRecord
+
+DAY = 86400
+
+# turns the database back into schema version 4: agreements without deadlines
+def downgrade(db, created):
+    with db.transaction():
+        def transform(doc):
+            doc.pop('deadline', None)
+            doc['created'] = created
+        db.table('agreements').update(transform, doc_ids=[a_id for a_id in db.table('agreements')._read_table() if a_id])
+        db.table('metadata').update({'schema_version': 4}, doc_ids=[1])
+    storage.invalidate(db)
+
+# agreements made before deadlines get the default timeout from the upgrade on, even ones older than it
+def test_backfilled_deadlines_start_at_upgrade(engine):
+    core, api = engine
+    parser = Parser(core.db, core.api)
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    bob = api.add_user(api.next_id(), 'bob', 10)
+    status = api.mention(alice, f'@{api.engine.screen_name} agreement with @bob', mentions=[bob])
+    parser.parse(status)
+
+    downgrade(core.db, '2021-06-01 12:00:00')
+    before = int(time.time())
+    assert schema.upgrade(core.db)
+
+    entry = AgreementRecord.load(core.db.table('agreements'), status.id)
+    timeout = core.db.table('metadata').get(doc_id=1)['agreement_timeout']
+    assert entry.deadline >= before + timeout * DAY
+
+    assert deadlines.expire_due() == 0
+    assert AgreementRecord.load(core.db.table('agreements'), status.id).state == 'open'
+    assert deadlines.expire_due(entry.deadline) == 1
+    assert AgreementRecord.load(core.db.table('agreements'), status.id).state == 'expired'
+
+# databases from before the retention setting get the default one, which is then read like any other setting
+def test_status_retention_is_configured(engine):
+    core, api = engine
+    Parser(core.db, core.api)
+    with core.db.transaction():
+        core.db.table('metadata').update(lambda doc: doc.pop('status_retention_days'), doc_ids=[1])
+        core.db.table('metadata').update({'schema_version': 5}, doc_ids=[1])
+
+    assert schema.upgrade(core.db)
+    meta = core.db.table('metadata').get(doc_id=1)
+    assert meta['schema_version'] == schema.SCHEMA_VERSION
+    assert meta['status_retention_days'] == 30
+    assert core.Consts.status_retention_days == 30
@@ -0,0 +1,43 @@
+import time
+
+from app.database import segments
+from app.database.metadata import Metadata
+from app.database.parser import Parser
+
+DAY = 86400
+
+def parse(engine, count):
+    core, api = engine
+    parser = Parser(core.db, core.api)
+    statuses = [api.mention(api.add_user(api.next_id(), f'user{i}', 10), f'@{api.engine.screen_name} balance') for i in range(count)]
+    for status in statuses:
+        parser.parse(status)
+    return statuses
+
+# statuses older than the retention period move to segments and are still found by id
+def test_retain(engine, web, monkeypatch):
+    core, _ = engine
+    statuses = parse(engine, 5)
+    with core.db.transaction():
+        Metadata(core.db).update('last_status_parsed', statuses[-1].id)
+    monkeypatch.setattr(segments, 'RETENTION_BATCH', 2)
+
+    assert segments.retain(core.db, 30) == 0
+    assert segments.retain(core.db, 1, now=time.time() + 2 * DAY) == 5
+    assert not core.db.table('statuses').contains(doc_id=statuses[0].id)
+    assert segments.retain(core.db, 1, now=time.time() + 2 * DAY) == 0
+
+    for status in statuses:
+        assert segments.find_status(core.db, status.id)['id'] == str(status.id)
+    assert segments.find_status(core.db, statuses[-1].id + 1) is None
+    assert web.get(f'/api/status/{statuses[2].id}').json['id'] == str(statuses[2].id)
+
+# statuses past the checkpoint stay in the table, they're looked up there if they're parsed again
+def test_retain_keeps_unchecked_statuses(engine):
+    core, _ = engine
+    statuses = parse(engine, 4)
+    with core.db.transaction():
+        Metadata(core.db).update('last_status_parsed', statuses[1].id)
+
+    assert segments.retain(core.db, 1, now=time.time() + 2 * DAY) == 2
+    assert [doc.doc_id for doc in core.db.table('statuses').page(0, 10)] == [status.id for status in statuses[2:]]
@@ -0,0 +1,99 @@
+import json
+
+from app.database.parser import Parser
+from app.objs.account import Account
+
+def test_responses_are_tagged_with_the_database_version(engine, web):
+    core, api = engine
+    parser = Parser(core.db, core.api)
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    parser.parse(api.mention(alice, f'@{api.engine.screen_name} balance'))
+
+    response = web.get(f'/api/user/{alice.id}')
+    assert response.json['screen_name'] == 'alice'
+    assert response.headers.get('ETag')
+    # the web process can't tell when the database last changed, so clients revalidate with the etag alone
+    assert 'Last-Modified' not in response.headers
+    assert web.get(f'/api/user/{alice.id}', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    bob = api.add_user(api.next_id(), 'bob', 10)
+    parser.parse(api.mention(bob, f'@{api.engine.screen_name} balance'))
+    assert web.get(f'/api/user/{alice.id}', headers={'If-None-Match': response.headers['ETag']}).status_code == 200
+
+# the accounts whose contracts were executed on a status, from the execution log the web process reads
+def test_execution_lookup(engine, web):
+    core, api = engine
+    parser = Parser(core.db, core.api)
+    owners = [api.add_user(api.next_id(), f'owner{i}', 1) for i in range(3)]
+    for owner in owners:
+        parser.parse(api.mention(owner, f'@{api.engine.screen_name} generate 1 likes'))
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    with core.db.transaction():
+        Account(alice).change_balance(alice.id, 2, 'payout')
+    post = api.mention(owners[2], 'a post')
+    parser.parse(api.mention(alice, f'@{api.engine.screen_name} execute 2', in_reply_to=post.id))
+
+    execution = web.get(f'/api/execution/{post.id}').json
+    assert sorted(execution['likes']) == sorted(str(owner.id) for owner in owners[:2])
+    assert execution['retweets'] == []
+    assert web.get(f'/api/execution/{alice.id}').json == {'error': 'execution not found'}
+
+# lists are read a page at a time in id order, each page continuing after the cursor of the previous one
+def test_list_pages(engine, web):
+    core, api = engine
+    parser = Parser(core.db, core.api)
+    users = [api.add_user(api.next_id(), f'user{i}', 10) for i in range(5)]
+    for user in users:
+        parser.parse(api.mention(user, f'@{api.engine.screen_name} balance'))
+    account_ids = sorted(doc_id for doc_id in core.db.table('accounts')._read_table() if doc_id)
+
+    listed, cursor = [], None
+    while True:
+        page = web.get('/api/accounts', query_string={'limit': 2, 'cursor': cursor or '', 'fields': 'screen_name'}).json
+        assert len(page['accounts']) <= 2
+        listed += page['accounts']
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert [row['id'] for row in listed] == [str(a_id) for a_id in account_ids]
+    assert all(set(row) == {'id', 'screen_name'} for row in listed)
+
+    assert web.get('/api/accounts', query_string={'limit': 0}).json == {'error': 'invalid request'}
+    assert web.get('/api/accounts', query_string={'cursor': 'x'}).json == {'error': 'invalid request'}
+
+# exports stream every document after the cursor as one json object per line
+def test_export(engine, web, monkeypatch):
+    from app.web import server
+
+    core, api = engine
+    parser = Parser(core.db, core.api)
+    statuses = [api.mention(api.add_user(api.next_id(), f'user{i}', 10), f'@{api.engine.screen_name} balance') for i in range(5)]
+    for status in statuses:
+        parser.parse(status)
+    # several batches, the last one full
+    monkeypatch.setattr(server, 'EXPORT_BATCH_SIZE', 2)
+
+    response = web.get('/api/export/statuses', query_string={'cursor': statuses[0].id})
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [row['id'] for row in rows] == [str(status.id) for status in statuses[1:]]
+
+# agreements by state and by user, newest first
+def test_agreement_pages(engine, web):
+    core, api = engine
+    parser = Parser(core.db, core.api)
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    bob = api.add_user(api.next_id(), 'bob', 10)
+    made = [api.mention(alice, f'@{api.engine.screen_name} agreement with @bob', mentions=[bob]) for _ in range(3)]
+    for status in made:
+        parser.parse(status)
+
+    first = web.get('/api/agreements/open', query_string={'limit': 2}).json
+    assert [a['id'] for a in first['agreements']] == [str(made[2].id), str(made[1].id)]
+    rest = web.get('/api/agreements/open', query_string={'limit': 2, 'cursor': first['next_cursor']}).json
+    assert [a['id'] for a in rest['agreements']] == [str(made[0].id)]
+    assert rest['next_cursor'] is None
+
+    assert len(web.get(f'/api/user/{bob.id}/agreements', query_string={'state': 'open'}).json['agreements']) == 3
+    assert web.get(f'/api/user/{bob.id}/agreements', query_string={'state': 'closed'}).json['agreements'] == []
+    assert web.get('/api/agreements/unknown').json == {'error': 'unknown state'}
@@ -0,0 +1,48 @@
+import pytest
+
+from app.database.parser import Parser
+from app.database.stats import Stats, economy_stats
+from app.objs.account import Account
+
+# totals kept up to date as statuses are parsed, and as rebuilt from the tables
+def totals(core):
+    kept = economy_stats(core.db).get()
+    with core.db.transaction():
+        stats = Stats(core.db)
+        stats.rebuild()
+    return kept, stats.get()
+
+def test_stats_follow_the_economy(engine):
+    core, api = engine
+    parser = Parser(core.db, core.api)
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    bob = api.add_user(api.next_id(), 'bob', 10)
+    parser.parse(api.mention(alice, f'@{api.engine.screen_name} generate 4 likes'))
+    parser.parse(api.mention(alice, f'@{api.engine.screen_name} agreement 20 TSC with @bob', mentions=[bob]))
+
+    kept, rebuilt = totals(core)
+    assert kept == rebuilt
+    assert kept['live_contracts']['like'] == 1
+    assert kept['live_supply']['like'] == 4
+    assert kept['open_agreements'] == 1
+    assert kept['collateral_locked'] == 20
+
+# changes a failed status made to the totals are forgotten along with the rest of its changes
+def test_stats_after_rollback(engine):
+    core, api = engine
+    parser = Parser(core.db, core.api)
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    bob = api.add_user(api.next_id(), 'bob', 10)
+    parser.parse(api.mention(alice, f'@{api.engine.screen_name} generate 4 likes'))
+    before = economy_stats(core.db).get()
+
+    with pytest.raises(RuntimeError):
+        with core.db.transaction():
+            parser.parse(api.mention(alice, f'@{api.engine.screen_name} generate 2 retweets'))
+            parser.parse(api.mention(alice, f'@{api.engine.screen_name} agreement 20 TSC with @bob', mentions=[bob]))
+            with core.db.transaction():
+                Account(alice.id).change_balance(alice.id, 5, 'payout')
+            raise RuntimeError('failed status')
+
+    kept, rebuilt = totals(core)
+    assert kept == rebuilt == before
@@ -0,0 +1,75 @@
+import pytest
+
+from app.database import storage
+from app.database.parser import Parser
+from app.database.ledger import balance_ledger
+from app.database.stats import economy_stats
+from app.database.indexes import agreement_index
+from app.objs.account import Account
+
+def fund(core, user, amount):
+    with core.db.transaction():
+        Account(user).change_balance(user.id, amount, 'payout')
+
+def balance(core, user):
+    return core.db.table('accounts').get(doc_id=user.id)['balance']
+
+# a send that fails between taking the payment and paying the recipient leaves nothing behind
+def test_failed_send_is_rolled_back(engine, monkeypatch):
+    core, api = engine
+    parser = Parser(core.db, core.api)
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    bob = api.add_user(api.next_id(), 'bob', 10)
+    fund(core, alice, 20)
+
+    tables = storage.read_tables(core.db)
+    stats = economy_stats(core.db).get()
+    index = agreement_index(core.db)
+
+    change_balance = Account.change_balance
+    def fail_on_credit(self, user_id, amount, kind, ref=None):
+        if (kind == 'transfer') and (amount > 0):
+            raise RuntimeError('injected failure')
+        change_balance(self, user_id, amount, kind, ref)
+    monkeypatch.setattr(Account, 'change_balance', fail_on_credit)
+
+    status = api.mention(alice, f'@{api.engine.screen_name} send 5 @bob', mentions=[bob])
+    with pytest.raises(RuntimeError):
+        parser.parse(status)
+
+    # the sender's debit, the recipient's new account, the status and the welcome reply are all gone
+    assert storage.read_tables(core.db) == tables
+    assert economy_stats(core.db).get() == stats
+    assert balance_ledger(core.db).verify() == {}
+    # structures the send never touched are kept
+    assert agreement_index(core.db) is index
+
+    monkeypatch.setattr(Account, 'change_balance', change_balance)
+    parser.parse(status)
+
+    assert (balance(core, alice), balance(core, bob)) == (15, 5)
+    assert economy_stats(core.db).get()['tsc_in_circulation'] == 20
+    assert balance_ledger(core.db).verify() == {}
+
+# changes of a failed status don't leak into the next one committed
+def test_rolled_back_changes_are_not_committed_later(engine, monkeypatch):
+    core, api = engine
+    parser = Parser(core.db, core.api)
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    bob = api.add_user(api.next_id(), 'bob', 10)
+    fund(core, alice, 20)
+
+    def fail(self, status, command):
+        self.change_balance(self.id, -7, 'transfer', status.id)
+        raise RuntimeError('injected failure')
+    send_tsc = Account.send_tsc
+    monkeypatch.setattr(Account, 'send_tsc', fail)
+    with pytest.raises(RuntimeError):
+        parser.parse(api.mention(alice, f'@{api.engine.screen_name} send 7 @bob', mentions=[bob]))
+    monkeypatch.setattr(Account, 'send_tsc', send_tsc)
+
+    parser.parse(api.mention(alice, f'@{api.engine.screen_name} send 1 @bob', mentions=[bob]))
+
+    assert (balance(core, alice), balance(core, bob)) == (19, 1)
+    assert balance_ledger(core.db).verify() == {}
+    assert balance_ledger(core.db).balances[alice.id] == 19
@@ -0,0 +1,51 @@
+import pytest
+import tweepy
+
+from app.database import update
+from app.database.metadata import Metadata
+from app.database.sources import PollingSource
+from app.objs.account import Account
+
+def checkpoint(core):
+    return Metadata(core.db).retrieve('last_status_parsed')
+
+def parsed(core, status):
+    return core.db.table('statuses').contains(doc_id=status.id)
+
+# a status that fails for any reason but twitter is rolled back and parsed again on the next update
+@pytest.mark.parametrize('workers', [1, 4])
+def test_failed_status_is_retried(engine, monkeypatch, workers):
+    core, api = engine
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    first = api.mention(alice, f'@{api.engine.screen_name} balance')
+    failing = api.mention(alice, f'@{api.engine.screen_name} likes')
+    last = api.mention(alice, f'@{api.engine.screen_name} retweets')
+
+    send_current_likes = Account.send_current_likes
+    def fail(self, status, command):
+        raise OSError('disk full')
+    monkeypatch.setattr(Account, 'send_current_likes', fail)
+
+    with pytest.raises(OSError):
+        update.run(PollingSource(api), workers)
+    assert checkpoint(core) == first.id
+    assert not parsed(core, failing)
+
+    monkeypatch.setattr(Account, 'send_current_likes', send_current_likes)
+    update.run(PollingSource(api), workers)
+    assert checkpoint(core) == last.id
+    assert parsed(core, failing) and parsed(core, last)
+
+# statuses twitter refuses to act on are skipped
+def test_twitter_error_is_skipped(engine, monkeypatch):
+    core, api = engine
+    alice = api.add_user(api.next_id(), 'alice', 10)
+    status = api.mention(alice, f'@{api.engine.screen_name} balance')
+
+    def fail(self, status, command):
+        raise tweepy.error.TweepError('User not found.', api_code=50)
+    monkeypatch.setattr(Account, 'send_current_balance', fail)
+
+    update.run(PollingSource(api))
+    assert checkpoint(core) == status.id
+    assert not parsed(core, status)